@@ -0,0 +1,206 @@
+import hashlib, json, os, sqlite3, threading, time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .compression import DECOMPRESSION_ERRORS, codec_for, decompressed, is_csv_name
+from .validators import iter_csv, to_canonical, TypeChecker, RowValidationError
+from .schemas import BILLS, schema_for_header
+
+# Catalog entry facts: columns (header as uploaded), row_count, date_ranges
+# ({"start_date": [min, max], "end_date": [min, max]}, canonical ISO), valid, error
+Facts = Dict[str, object]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_files (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    row_count INTEGER,
+    min_start_date TEXT, max_start_date TEXT,
+    min_end_date TEXT, max_end_date TEXT,
+    valid INTEGER NOT NULL,
+    error TEXT,
+    crawled_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_files_sha256 ON catalog_files(sha256);
+CREATE TABLE IF NOT EXISTS crawler_runs (
+    id INTEGER PRIMARY KEY,
+    crawler TEXT NOT NULL,
+    run_at REAL NOT NULL,
+    seconds REAL NOT NULL,
+    scanned INTEGER NOT NULL,
+    added INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    unchanged INTEGER NOT NULL,
+    removed INTEGER NOT NULL
+);
+"""
+_FIELDS = ("key", "size", "mtime_ns", "sha256", "columns", "row_count", "min_start_date", "max_start_date",
+           "min_end_date", "max_end_date", "valid", "error", "crawled_at")
+
+def scan_file(path: Path) -> Facts:
+    """Parse and type-check a stored CSV once to collect its catalog facts, against the
+    registered schema its header matches (app/schemas.py). A file that matches none, or
+    does not parse or check, is still cataloged, with valid=False and the error."""
+    checker = TypeChecker()
+    columns: List[str] = []
+    try:
+        with path.open("rb") as raw, decompressed(raw, codec_for(path.name)) as stream:
+            columns, rows = iter_csv(stream)
+            schema = schema_for_header(columns)
+            if schema is None:
+                missing, extra = BILLS.check_header(columns)[1].values()
+                raise ValueError(f"InvalidSchema: header matches no registered schema "
+                                 f"(bills: missing {missing}, extra {extra})")
+            checker = TypeChecker(schema=schema)
+            for _ in checker.iter_checked(to_canonical(columns, rows, schema)):
+                pass
+    except RowValidationError as e:
+        return {"columns": columns, "row_count": checker.rows_checked, "date_ranges": {},
+                "valid": False, "error": f"InvalidType: {e.info.get('error_count')} bad cells"}
+    except (ValueError, UnicodeDecodeError, *DECOMPRESSION_ERRORS) as e:
+        return {"columns": columns, "row_count": None, "date_ranges": {}, "valid": False, "error": str(e)}
+    return {"columns": columns, "row_count": checker.rows_checked, "date_ranges": checker.date_ranges,
+            "valid": True, "error": None}
+
+def checker_facts(columns: List[str], checker: TypeChecker) -> Facts:
+    """Facts of a file that was just loaded: the ingest already parsed and checked it."""
+    return {"columns": list(columns), "row_count": checker.rows_checked,
+            "date_ranges": dict(checker.date_ranges), "valid": True, "error": None}
+
+class Catalog:
+    """Glue-style metadata index of local_state/uploads, kept in its own SQLite file: per
+    object size, mtime, sha256, header, row count, min/max dates and validity. crawl() is
+    incremental: files whose (size, mtime_ns) still match their entry are skipped without
+    being opened, a changed stat with unchanged content only costs a hash, and only new
+    content is parsed. A crawl can be limited to a few keys (the objects an upload just
+    wrote), so it does not stat the whole store. One crawl runs at a time."""
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _entry(row: sqlite3.Row) -> dict:
+        entry = dict(row)
+        entry["columns"] = json.loads(entry["columns"])
+        entry["valid"] = bool(entry["valid"])
+        return entry
+
+    def entry(self, key: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM catalog_files WHERE key = ?", (key,)).fetchone()
+        return self._entry(row) if row else None
+
+    def cached_sha256(self, path: Path) -> Optional[str]:
+        """The recorded hash of a stored object whose size and mtime are unchanged, so an
+        upsert of a stored file can skip re-hashing it."""
+        st = path.stat()
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT sha256 FROM catalog_files WHERE key = ? AND size = ? AND mtime_ns = ?",
+                               (path.name, st.st_size, st.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def files(self, date_from: str | None = None, date_to: str | None = None,
+              valid: bool | None = None) -> List[dict]:
+        """Entries, optionally only those whose start_date range overlaps [date_from, date_to]."""
+        where, params = [], []
+        if date_from:
+            where.append("max_start_date >= ?"); params.append(date_from)
+        if date_to:
+            where.append("min_start_date <= ?"); params.append(date_to)
+        if valid is not None:
+            where.append("valid = ?"); params.append(int(valid))
+        sql = "SELECT * FROM catalog_files" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY key"
+        with closing(self._connect()) as conn:
+            return [self._entry(r) for r in conn.execute(sql, params)]
+
+    def last_run(self, crawler: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM crawler_runs WHERE crawler = ? ORDER BY id DESC LIMIT 1",
+                               (crawler,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def _record(conn: sqlite3.Connection, key: str, st: os.stat_result, sha256: str, facts: Facts) -> None:
+        ranges = facts.get("date_ranges") or {}
+        start, end = ranges.get("start_date", [None, None]), ranges.get("end_date", [None, None])
+        values = (key, st.st_size, st.st_mtime_ns, sha256, json.dumps(facts["columns"]), facts["row_count"],
+                  start[0], start[1], end[0], end[1], int(bool(facts["valid"])), facts["error"], time.time())
+        conn.execute(f"INSERT OR REPLACE INTO catalog_files ({', '.join(_FIELDS)}) "
+                     f"VALUES ({', '.join('?' * len(_FIELDS))})", values)
+
+    def crawl(self, root: Path, crawler: str = "bills_crawler",
+              known: Dict[str, tuple] | None = None, keys: Iterable[str] | None = None) -> dict:
+        """Bring the catalog in line with the stored CSVs (plain or compressed) directly under root and log the run.
+        known maps key -> (size, mtime_ns, sha256 or None, facts) for objects the caller has
+        just parsed (facts None: parse unless the content is cataloged); they are used as
+        long as the file's stat still matches. keys limits the run to those objects: other
+        entries are left alone, and a listed key no longer on disk is removed."""
+        known = known or {}
+        run_at, started = time.time(), time.perf_counter()
+        counts = {"scanned": 0, "added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        with self._lock, closing(self._connect()) as conn:
+            select = "SELECT key, size, mtime_ns, sha256 FROM catalog_files"
+            if keys is None:
+                paths, rows = sorted(root.iterdir()), conn.execute(select)
+            else:
+                keys = sorted(set(keys))
+                paths = [root / key for key in keys]
+                rows = conn.execute(f"{select} WHERE key IN ({', '.join('?' * len(keys))})", keys)
+            current = {r["key"]: r for r in rows}
+            on_disk = set()
+            for path in paths:
+                if path.name.startswith(".") or not is_csv_name(path.name) or not path.is_file():
+                    continue
+                key = path.name
+                on_disk.add(key)
+                counts["scanned"] += 1
+                st = path.stat()
+                old = current.get(key)
+                if old is not None and (old["size"], old["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                    counts["unchanged"] += 1
+                    continue
+                size, mtime_ns, sha256, facts = known.get(key) or (None, None, None, None)
+                if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    sha256, facts = None, None
+                if sha256 is None:
+                    with path.open("rb") as f:
+                        sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+                if facts is None:
+                    facts = self._facts_by_hash(conn, sha256, key) or scan_file(path)
+                self._record(conn, key, st, sha256, facts)
+                counts["added" if old is None else "updated"] += 1
+            gone = [k for k in current if k not in on_disk]
+            conn.executemany("DELETE FROM catalog_files WHERE key = ?", [(k,) for k in gone])
+            counts["removed"] = len(gone)
+            seconds = round(time.perf_counter() - started, 4)
+            conn.execute("INSERT INTO crawler_runs (crawler, run_at, seconds, scanned, added, updated, unchanged, removed) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (crawler, run_at, seconds, *counts.values()))
+            conn.commit()
+            totals = conn.execute("SELECT count(*), sum(row_count), sum(size), sum(valid = 0) FROM catalog_files").fetchone()
+        return {"crawler": crawler, "run_at": run_at, "seconds": seconds, **counts,
+                "files": totals[0], "rows": totals[1] or 0, "bytes": totals[2] or 0, "invalid_files": totals[3] or 0}
+
+    def _facts_by_hash(self, conn: sqlite3.Connection, sha256: str, key: str) -> Optional[Facts]:
+        """Facts of an already cataloged object with the same content (a touched file, or
+        a copy under another key): no need to parse it again."""
+        row = conn.execute("SELECT * FROM catalog_files WHERE sha256 = ? ORDER BY key = ? DESC LIMIT 1",
+                           (sha256, key)).fetchone()
+        if row is None:
+            return None
+        entry = self._entry(row)
+        return {"columns": entry["columns"], "row_count": entry["row_count"],
+                "date_ranges": {"start_date": [entry["min_start_date"], entry["max_start_date"]],
+                                "end_date": [entry["min_end_date"], entry["max_end_date"]]},
+                "valid": entry["valid"], "error": entry["error"]}
@@ -0,0 +1,41 @@
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+from .cache import LRUCache
+
+DATE_CACHE_SIZE = 4096
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def _parse(s: str) -> Optional[Tuple[str, int]]:
+    """(canonical ISO text, days since 1970-01-01) or None when s is not an ISO date/datetime."""
+    try:
+        d = date.fromisoformat(s)
+    except (TypeError, ValueError):
+        try:
+            d = datetime.fromisoformat(s)
+        except (TypeError, ValueError):
+            return None
+    return d.isoformat(), d.toordinal() - _EPOCH_ORDINAL
+
+class DateCache(LRUCache):
+    """Memoized ISO date parsing. Bill files repeat a handful of period boundaries across
+    millions of cells, so each distinct string is parsed once; invalid strings are cached
+    too (as None). Shared by the validators and the DB loader through DATE_CACHE."""
+    def lookup(self, s: str) -> Optional[Tuple[str, int]]:
+        return self.get_or_compute(s, _parse)
+
+    def is_valid(self, s: str) -> bool:
+        return self.lookup(s) is not None
+
+    def normalize(self, s: str) -> Optional[str]:
+        parsed = self.lookup(s)
+        return parsed[0] if parsed else None
+
+    def epoch_day(self, s: str) -> Optional[int]:
+        parsed = self.lookup(s)
+        return parsed[1] if parsed else None
+
+DATE_CACHE = DateCache(DATE_CACHE_SIZE)
+
+def iso_from_epoch_day(n: int) -> str:
+    return date.fromordinal(int(n) + _EPOCH_ORDINAL).isoformat()
@@ -1,58 +1,798 @@
-import sqlite3
+import json, re, sqlite3, threading, time
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Iterable, Iterator
+
+from .schemas import BILLS, Row, Schema
+from .pool import ConnectionPool, get_pool
+from .dates import DATE_CACHE, iso_from_epoch_day
+from .settings import settings
 
 DB_DIRNAME = "local_state/db"
 DB_FILENAME = "bills_db.sqlite"
-TABLE_NAME = "custom_csv"
+TABLE_NAME = BILLS.table  # custom_csv; other registered layouts load into their own table (load_rows)
+INSERT_SQL = BILLS.insert_sql(TABLE_NAME)
+
+INGEST_LOG_TABLE = "ingest_log"
+ROLLUP_TABLE = f"{TABLE_NAME}_rollup"
+ROLLUP_COLUMNS = ("building_id", "usage_type", "month", "bill_count", "min_start", "max_end", "total_days")
+FETCH_BATCH = 500  # rows per cursor.fetchmany()
+LOAD_MODES = ("append", "upsert")
+
+DATE_STORAGES = ("text", "epoch_days")
+# "partitioned": one custom_csv_pYYYY_MM table per start_date month behind a custom_csv
+# view with the same columns as the table, and a custom_csv_by_month view that adds the
+# month as a bill_month column (see _create_view)
+LAYOUTS = ("table", "partitioned")
+PARTITIONS_TABLE = f"{TABLE_NAME}_partitions"
+TEMPLATE_TABLE = f"{TABLE_NAME}_template"
+MONTH_VIEW = f"{TABLE_NAME}_by_month"
+PARTITION_COLUMN = "bill_month"
+PARTITION_BATCH = 5000  # rows buffered per month before they are inserted
+_MONTH = re.compile(r"\d{4}-\d{2}$")
+
+# Managed index set: name -> (columns, unique). DEFAULT_INDEXES are created by the v1
+# migration; the unique bill_id index is opt-in (POST /db/indexes/...) because it fails
+# while the table still holds duplicate bill_ids.
+MANAGED_INDEXES: Dict[str, Tuple[Tuple[str, ...], bool]] = {
+    f"idx_{TABLE_NAME}_building_start": (("building_id", "start_date"), False),
+    f"idx_{TABLE_NAME}_meter_id": (("meter_id",), False),
+    f"idx_{TABLE_NAME}_bill_id": (("bill_id",), False),
+    f"idx_{TABLE_NAME}_start_end": (("start_date", "end_date"), False),
+    f"uq_{TABLE_NAME}_bill_id": (("bill_id",), True),
+}
+DEFAULT_INDEXES = [name for name, (_, unique) in MANAGED_INDEXES.items() if not unique]
+
+class PartitionedLayoutError(Exception):
+    """An operation that needs custom_csv to be a single table (upsert, dedupe, index changes)."""
 
+class ManagedIndexError(Exception):
+    """An index that cannot be built, e.g. a UNIQUE one while duplicates exist, or a load
+    whose rows a UNIQUE index rejects. Unknown index names raise LookupError instead."""
+
+@lru_cache(maxsize=None)
 def get_db_path(project_root: Path) -> Path:
     db_dir = project_root / DB_DIRNAME
-    db_dir.mkdir(parents=True, exist_ok=True)
+    db_dir.mkdir(parents=True, exist_ok=True)  # once per project root
     return db_dir / DB_FILENAME
 
-def init_db(project_root: Path) -> None:
-    db_path = get_db_path(project_root)
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-                bill_id TEXT NOT NULL,
-                meter_id INTEGER NOT NULL,
-                usage_type TEXT NOT NULL,
-                building_id INTEGER NOT NULL,
-                start_date TEXT NOT NULL,
-                end_date TEXT NOT NULL
-            )
-        """)
-        conn.commit()
-
-def load_rows(project_root: Path, rows: List[Dict[str, str]]) -> int:
+def _sql_epoch_day(value):
+    return value if value is None or isinstance(value, int) else DATE_CACHE.epoch_day(str(value))
+
+def _sql_iso_date(value):
+    if value is None:
+        return None
+    return iso_from_epoch_day(value) if isinstance(value, int) else DATE_CACHE.normalize(str(value))
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    """epoch_day(x) / iso_date(x) convert between the two date storages inside SQL."""
+    conn.create_function("epoch_day", 1, _sql_epoch_day, deterministic=True)
+    conn.create_function("iso_date", 1, _sql_iso_date, deterministic=True)
+
+def pool_for(project_root: Path) -> ConnectionPool:
+    return get_pool(get_db_path(project_root), on_connect=register_functions)
+
+def _detect_date_storage(conn: sqlite3.Connection) -> str:
+    types = {name: (ctype or "").upper() for _, name, ctype, *_ in conn.execute(f"PRAGMA table_info({TABLE_NAME})")}
+    return "epoch_days" if types.get("start_date") == "INTEGER" else "text"
+
+def _create_index(conn: sqlite3.Connection, name: str) -> None:
+    columns, unique = MANAGED_INDEXES[name]
+    conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {TABLE_NAME} ({', '.join(columns)})")
+
+def _migrate_v1_default_indexes(conn: sqlite3.Connection) -> None:
+    for name in DEFAULT_INDEXES:
+        _create_index(conn, name)
+
+def _migrate_v2_ingest_log(conn: sqlite3.Connection) -> None:
+    # one row per CSV loaded in upsert mode, keyed by the SHA-256 of its bytes
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {INGEST_LOG_TABLE} (
+            content_hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            result TEXT NOT NULL,
+            loaded_at REAL NOT NULL
+        )
+    """)
+
+# Rollup: one row per (building_id, usage_type, month of start_date) with the bill count,
+# the date span and the summed bill length in days. Dates are ISO text whatever the
+# custom_csv storage, so a storage migration leaves it valid.
+def _month_sql(date_storage: str, col: str) -> str:
+    if date_storage == "epoch_days":
+        return f"strftime('%Y-%m', {col} * 86400, 'unixepoch')"
+    return f"substr({col}, 1, 7)"
+
+def _rollup_select(date_storage: str, where: str = "", table: str = TABLE_NAME) -> str:
+    if date_storage == "epoch_days":
+        span = "date(MIN(start_date) * 86400, 'unixepoch'), date(MAX(end_date) * 86400, 'unixepoch')"
+        days = "end_date - start_date"
+    else:
+        span = "MIN(start_date), MAX(end_date)"
+        days = "CAST(ROUND(julianday(end_date) - julianday(start_date)) AS INTEGER)"
+    return (f"INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}) "
+            f"SELECT building_id, usage_type, {_month_sql(date_storage, 'start_date')}, COUNT(*), {span}, SUM({days}) "
+            f"FROM {table} {where} GROUP BY 1, 2, 3")
+
+def _rebuild_rollups(conn: sqlite3.Connection, date_storage: str) -> int:
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+    return conn.execute(_rollup_select(date_storage)).rowcount
+
+def _rollup_add(conn: sqlite3.Connection, date_storage: str, after_rowid: int, table: str = TABLE_NAME) -> None:
+    """Fold rows appended to `table` after `after_rowid` into the rollup: O(new rows)."""
+    conn.execute(_rollup_select(date_storage, "WHERE rowid > ?", table)
+                 + " ON CONFLICT (building_id, usage_type, month) DO UPDATE SET"
+                   " bill_count = bill_count + excluded.bill_count,"
+                   " min_start = min(min_start, excluded.min_start), max_end = max(max_end, excluded.max_end),"
+                   " total_days = total_days + excluded.total_days", (after_rowid,))
+
+_ROLLUP_DIRTY = "rollup_dirty"
+
+def _track_updates(conn: sqlite3.Connection, date_storage: str) -> None:
+    """Record the old and new group of every row an upsert overwrites (temp objects, this
+    connection and transaction only); _refresh_dirty_rollups then recomputes just those."""
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {_ROLLUP_DIRTY} (building_id, usage_type, month, "
+                 f"PRIMARY KEY (building_id, usage_type, month)) WITHOUT ROWID")
+    # normally empty already: a failed load rolls these temp objects back with its rows
+    conn.execute(f"DELETE FROM temp.{_ROLLUP_DIRTY}")
+    conn.execute(f"DROP TRIGGER IF EXISTS {_ROLLUP_DIRTY}_track")
+    # ON CONFLICT DO NOTHING rather than INSERT OR IGNORE: the OR policy of a trigger body
+    # is overridden by the firing statement's (ABORT for the upsert), an UPSERT clause is not
+    conn.execute(f"""
+        CREATE TEMP TRIGGER {_ROLLUP_DIRTY}_track AFTER UPDATE ON main.{TABLE_NAME} BEGIN
+            INSERT INTO {_ROLLUP_DIRTY} VALUES
+                (OLD.building_id, OLD.usage_type, {_month_sql(date_storage, 'OLD.start_date')}),
+                (NEW.building_id, NEW.usage_type, {_month_sql(date_storage, 'NEW.start_date')})
+            ON CONFLICT DO NOTHING;
+        END
+    """)
+
+def _refresh_dirty_rollups(conn: sqlite3.Connection, date_storage: str) -> None:
+    conn.execute(f"DROP TRIGGER {_ROLLUP_DIRTY}_track")
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE (building_id, usage_type, month) IN "
+                 f"(SELECT building_id, usage_type, month FROM temp.{_ROLLUP_DIRTY})")
+    conn.execute(_rollup_select(date_storage,
+        f"WHERE building_id IN (SELECT building_id FROM temp.{_ROLLUP_DIRTY}) "
+        f"AND (building_id, usage_type, {_month_sql(date_storage, 'start_date')}) IN "
+        f"(SELECT building_id, usage_type, month FROM temp.{_ROLLUP_DIRTY})"))
+    conn.execute(f"DELETE FROM temp.{_ROLLUP_DIRTY}")
+
+def _migrate_v3_rollups(conn: sqlite3.Connection) -> None:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            building_id INTEGER NOT NULL,
+            usage_type TEXT NOT NULL,
+            month TEXT NOT NULL,
+            bill_count INTEGER NOT NULL,
+            min_start TEXT NOT NULL,
+            max_end TEXT NOT NULL,
+            total_days INTEGER NOT NULL,
+            PRIMARY KEY (building_id, usage_type, month)
+        ) WITHOUT ROWID
+    """)
+    _rebuild_rollups(conn, _detect_date_storage(conn))
+
+def _partition_table(month: str) -> str:
+    if not _MONTH.match(month):
+        raise ValueError(f"Invalid partition month {month!r}; expected YYYY-MM.")
+    return f"{TABLE_NAME}_p{month.replace('-', '_')}"
+
+def _month_bounds(month: str, date_storage: str) -> Tuple[Any, Any]:
+    """[first day of month, first day of next month) in the column's storage."""
+    year, mon = int(month[:4]), int(month[5:])
+    lo, hi = f"{month}-01", f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+    if date_storage == "epoch_days":
+        return DATE_CACHE.epoch_day(lo), DATE_CACHE.epoch_day(hi)
+    return lo, hi
+
+def _detect_layout(conn: sqlite3.Connection) -> str:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name=?", (TABLE_NAME,)).fetchone()
+    return "partitioned" if row and row[0] == "view" else "table"
+
+def _partition_months(conn: sqlite3.Connection) -> List[str]:
+    return [m for (m,) in conn.execute(f"SELECT month FROM {PARTITIONS_TABLE} ORDER BY month")]
+
+def _drop_views(conn: sqlite3.Connection) -> None:
+    conn.execute(f"DROP VIEW IF EXISTS {TABLE_NAME}")
+    conn.execute(f"DROP VIEW IF EXISTS {MONTH_VIEW}")
+
+def _create_view(conn: sqlite3.Connection) -> None:
+    """custom_csv and custom_csv_by_month as UNION ALL of the month tables. custom_csv has
+    the table's columns, so `SELECT *` reads the same in both layouts. custom_csv_by_month
+    tags each branch with its month as bill_month; SQLite pushes WHERE terms into every
+    branch, so `bill_month = '2024-03'` (or a range on it) becomes a constant-false test
+    that skips the other partitions without opening them. The empty template branch comes
+    first so column types and an empty layout still work."""
+    months = _partition_months(conn)
+    tables = [f"SELECT * FROM {TEMPLATE_TABLE} WHERE 0"] + [f"SELECT * FROM {_partition_table(m)}" for m in months]
+    tagged = [f"SELECT *, NULL AS {PARTITION_COLUMN} FROM {TEMPLATE_TABLE} WHERE 0"]
+    tagged += [f"SELECT *, '{m}' FROM {_partition_table(m)}" for m in months]
+    _drop_views(conn)
+    conn.execute(f"CREATE VIEW {TABLE_NAME} AS " + " UNION ALL ".join(tables))
+    conn.execute(f"CREATE VIEW {MONTH_VIEW} AS " + " UNION ALL ".join(tagged))
+
+def _add_partition(conn: sqlite3.Connection, month: str, date_storage: str) -> str:
+    table = _partition_table(month)
+    conn.execute(BILLS.ddl(table, date_storage))
+    for name in DEFAULT_INDEXES:
+        columns, _ = MANAGED_INDEXES[name]
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name.replace(TABLE_NAME, table, 1)} ON {table} ({', '.join(columns)})")
+    conn.execute(f"INSERT INTO {PARTITIONS_TABLE} (month, table_name) VALUES (?, ?)", (month, table))
+    _create_view(conn)
+    return table
+
+def _convert_to_partitioned(conn: sqlite3.Connection, date_storage: str) -> int:
+    """Move the custom_csv table into month partitions (rows copied one index range at a
+    time) and replace it with the view. Rollups are unchanged: same rows."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {PARTITIONS_TABLE} (month TEXT PRIMARY KEY, table_name TEXT NOT NULL)")
+    conn.execute(BILLS.ddl(TEMPLATE_TABLE, date_storage))
+    months = [m for (m,) in conn.execute(f"SELECT DISTINCT {_month_sql(date_storage, 'start_date')} FROM {TABLE_NAME}")]
+    cols = ", ".join(BILLS.names)
+    total = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+    moved = 0
+    for month in sorted(months):
+        table = _partition_table(month)
+        conn.execute(BILLS.ddl(table, date_storage))
+        moved += conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {TABLE_NAME} "
+                              f"WHERE start_date >= ? AND start_date < ? ORDER BY rowid",
+                              _month_bounds(month, date_storage)).rowcount
+    if moved != total:
+        raise ValueError(f"Partitioning would keep {moved} of {total} rows (start_date outside YYYY-MM-DD?).")
+    conn.execute(f"DROP TABLE {TABLE_NAME}")
+    for month in sorted(months):
+        _add_partition(conn, month, date_storage)  # indexes after the bulk copy
+    for name in DEFAULT_INDEXES:
+        columns, _ = MANAGED_INDEXES[name]
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {TEMPLATE_TABLE} ({', '.join(columns)})")
+    _create_view(conn)
+    return moved
+
+def _physical_tables(conn: sqlite3.Connection) -> List[str]:
+    if _detect_layout(conn) == "table":
+        return [TABLE_NAME]
+    return [TEMPLATE_TABLE] + [_partition_table(m) for m in _partition_months(conn)]
+
+def _migrate_v4_month_view(conn: sqlite3.Connection) -> None:
+    # custom_csv no longer carries bill_month when partitioned; it moved to custom_csv_by_month
+    if _detect_layout(conn) == "partitioned":
+        _create_view(conn)
+
+# (user_version reached, step). Steps run once, in order, inside init_db's transaction
+# (BEGIN IMMEDIATE, so their DDL does not commit statement by statement): an existing
+# bills_db.sqlite is brought up to date on the next start, and an upgrade that fails
+# part-way leaves both the schema and user_version as they were. Dropping a default
+# index through the API is not undone on restart.
+_MIGRATIONS = [
+    (1, _migrate_v1_default_indexes),
+    (2, _migrate_v2_ingest_log),
+    (3, _migrate_v3_rollups),
+    (4, _migrate_v4_month_view),
+]
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+_date_storage: Dict[Path, str] = {}
+_layouts: Dict[Path, str] = {}
+_table_versions: Dict[Path, int] = {}
+
+def table_version(project_root: Path) -> int:
+    """Counter bumped after every committed write to custom_csv by this process (loads,
+    dedupe, migrations); cached query results are only valid for the version they read."""
+    return _table_versions.get(get_db_path(project_root), 0)
+
+def _bump_version(project_root: Path) -> None:
     db_path = get_db_path(project_root)
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        to_insert = []
-        for r in rows:
-            to_insert.append((
-                r.get("bill_id",""),
-                int(r.get("meter_id","0") or 0),
-                r.get("usage_type",""),
-                int(r.get("building_id","0") or 0),
-                r.get("start_date",""),
-                r.get("end_date",""),
-            ))
-        cur.executemany(f"""
-            INSERT INTO {TABLE_NAME} (bill_id, meter_id, usage_type, building_id, start_date, end_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, to_insert)
-        conn.commit()
-        return len(to_insert)
-
-def run_select(project_root: Path, sql: str, max_rows: int = 1000) -> Tuple[List[str], List[Tuple]]:
+    _table_versions[db_path] = _table_versions.get(db_path, 0) + 1
+
+def init_db(project_root: Path) -> None:
     db_path = get_db_path(project_root)
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute(sql)
-        cols = [d[0] for d in cur.description] if cur.description else []
-        rows = cur.fetchall()
-        return cols, rows[:max_rows]
+    if db_path in _date_storage and db_path.exists():
+        return  # already created/migrated by this process
+    with pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(BILLS.ddl(TABLE_NAME, settings.date_storage))
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, step in _MIGRATIONS:
+            if version < target:
+                step(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if version == 0 and settings.storage_layout == "partitioned" and _detect_layout(conn) == "table":
+            _convert_to_partitioned(conn, settings.date_storage)  # fresh database: empty
+        _date_storage[db_path] = _detect_date_storage(conn)
+        _layouts[db_path] = _detect_layout(conn)
+
+def date_storage(project_root: Path) -> str:
+    init_db(project_root)
+    return _date_storage[get_db_path(project_root)]
+
+def storage_layout(project_root: Path) -> str:
+    init_db(project_root)
+    return _layouts[get_db_path(project_root)]
+
+def _require_table_layout(project_root: Path, what: str) -> None:
+    if storage_layout(project_root) == "partitioned":
+        raise PartitionedLayoutError(f"{what} is not available while {TABLE_NAME} is partitioned by month.")
+
+def _to_epoch_days(rows: Iterable[Row]) -> Iterable[Row]:
+    start, end = BILLS.index["start_date"], BILLS.index["end_date"]
+    memo: Dict[str, int] = {}  # per-load memo in front of the shared DATE_CACHE
+    def conv(v: str | None) -> int | None:
+        if v is None:
+            return None  # nullable column left empty
+        d = memo.get(v)
+        if d is None:
+            d = memo[v] = DATE_CACHE.epoch_day(v)
+        return d
+    for r in rows:
+        cells = list(r)
+        cells[start], cells[end] = conv(r[start]), conv(r[end])
+        yield tuple(cells)
+
+def parse_key(key: Optional[str], schema: Schema = BILLS) -> Tuple[str, ...]:
+    """'bill_id' / 'bill_id,meter_id' -> column tuple (defaults to settings.upsert_key)."""
+    cols = tuple(c.strip() for c in (key or settings.upsert_key).split(",") if c.strip())
+    unknown = [c for c in cols if c not in schema.index]
+    if not cols or unknown:
+        raise ValueError(f"Invalid upsert key {key!r}; use columns from {schema.names}.")
+    return cols
+
+def key_index_name(key: Sequence[str], table: str = TABLE_NAME) -> str:
+    return f"uq_{table}_{'_'.join(key)}"
+
+def _ensure_key_index(conn: sqlite3.Connection, key: Sequence[str], table: str = TABLE_NAME) -> None:
+    name = key_index_name(key, table)
+    try:
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(key)})")
+    except sqlite3.IntegrityError as e:
+        raise ManagedIndexError(f"Cannot upsert on ({', '.join(key)}): existing rows repeat it ({e}). "
+                                f"Run POST /db/dedupe?key={','.join(key)} first.")
+
+@contextmanager
+def _unique_keys(table: str) -> Iterator[None]:
+    """A load's rows repeating a UNIQUE index (one an earlier upsert built, say): ManagedIndexError."""
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        raise ManagedIndexError(f"Rows repeat a UNIQUE key of {table} ({e}); load with mode=upsert on that key, "
+                                f"or drop the index (DELETE /db/indexes/<name>).") from None
+
+@lru_cache(maxsize=None)
+def upsert_sql(key: Tuple[str, ...]) -> str:
+    return BILLS.upsert_sql(TABLE_NAME, key)
+
+def load_rows(project_root: Path, rows: Iterable[Row], mode: str = "append", key: Sequence[str] = ("bill_id",),
+              schema: Schema = BILLS) -> int:
+    """Insert canonical row tuples (schema column order) in a single transaction.
+    rows may be a lazy iterator: executemany consumes it one tuple at a time, so memory
+    does not grow with the file size. The INTEGER column affinity converts the numeric
+    text of meter_id/building_id on insert; with epoch_days storage the (already
+    validated) date text is converted through DATE_CACHE. Any exception raised while
+    iterating rolls the whole load back.
+    mode="upsert" makes the load idempotent on `key`: a UNIQUE index on it is ensured
+    (ManagedIndexError if the table already repeats the key) and a conflicting row
+    replaces the stored one. The index is built inside the load's transaction, so a
+    failed load does not leave it behind; rows that repeat a UNIQUE index already on the
+    table raise ManagedIndexError in either mode. Returns rows inserted or updated.
+    The custom_csv_rollup groups are brought up to date in the same transaction: appended
+    rows (rowid above the previous maximum) are added in, and groups touched by upsert
+    overwrites are recomputed. Other layouts than BILLS go to their own table (_load_layout)."""
+    if mode not in LOAD_MODES:
+        raise ValueError(f"mode must be one of {LOAD_MODES}")
+    if schema is not BILLS:
+        return _load_layout(project_root, rows, mode, key, schema)
+    storage = date_storage(project_root)
+    if storage_layout(project_root) == "partitioned":
+        if mode == "upsert":
+            _require_table_layout(project_root, "Upsert")
+        with _unique_keys(TABLE_NAME), pool_for(project_root).writer() as conn:
+            count = _load_partitioned(conn, rows, storage)
+        _bump_version(project_root)
+        return count
+    if storage == "epoch_days":
+        rows = _to_epoch_days(rows)
+    with _unique_keys(TABLE_NAME), pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # so the key index built below rolls back with a failed load
+        last_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {TABLE_NAME}").fetchone()[0]
+        if mode == "upsert":
+            _ensure_key_index(conn, key)
+            _track_updates(conn, storage)
+            count = conn.executemany(upsert_sql(tuple(key)), rows).rowcount
+        else:
+            count = conn.executemany(INSERT_SQL, rows).rowcount
+        _rollup_add(conn, storage, last_rowid)
+        if mode == "upsert":
+            _refresh_dirty_rollups(conn, storage)
+    _bump_version(project_root)
+    return count
+
+def _load_layout(project_root: Path, rows: Iterable[Row], mode: str, key: Sequence[str], schema: Schema) -> int:
+    """load_rows for a non-BILLS layout: schema.table, created on first load from schema.ddl
+    (ISO text dates). Rollups, partitions, managed indexes and date storage migrations
+    belong to custom_csv and do not apply."""
+    init_db(project_root)
+    table = schema.table
+    with _unique_keys(table), pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(schema.ddl(table))
+        if mode == "upsert":
+            _ensure_key_index(conn, key, table)
+            count = conn.executemany(schema.upsert_sql(table, tuple(key)), rows).rowcount
+        else:
+            count = conn.executemany(schema.insert_sql(table), rows).rowcount
+    _bump_version(project_root)
+    return count
+
+def _drop_secondary_indexes(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """Drop the non-UNIQUE indexes on custom_csv -> [(name, CREATE sql)] to rebuild later.
+    UNIQUE ones stay: they are constraints, not just access paths."""
+    dropped = [(name, sql) for name, sql in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (TABLE_NAME,))
+        if not sql.upper().startswith("CREATE UNIQUE")]
+    for name, _ in dropped:
+        conn.execute(f"DROP INDEX {name}")
+    return dropped
+
+def bulk_load(project_root: Path, rows: Iterable[Row], batch_size: int = settings.bulk_batch) -> dict:
+    """Append-only load for very large files. Same single transaction and rollups as
+    load_rows, plus:
+    - rows go in as executemany batches of batch_size (memory bounded by one batch);
+    - the writer runs with synchronous=settings.bulk_synchronous for this load only;
+    - when custom_csv holds at most settings.bulk_reindex_max_rows rows, its non-UNIQUE
+      indexes are dropped and rebuilt once at the end (one sort per index instead of a
+      B-tree insert per row; on a bigger table the rebuild would cost more than it saves).
+    The journal stays WAL: readers keep their snapshot while the load runs, and a failed
+    load still rolls back. Returns rows_inserted, seconds, rows_per_s, batches and
+    indexes_deferred."""
+    storage = date_storage(project_root)
+    partitioned = storage_layout(project_root) == "partitioned"
+    t0 = time.perf_counter()
+    pool = pool_for(project_root)
+    with _unique_keys(TABLE_NAME), pool.writer(synchronous=settings.bulk_synchronous) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if partitioned:  # routing already batches per month; indexes stay per partition
+            count, batches, deferred = _load_partitioned(conn, rows, storage), None, []
+        else:
+            last_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {TABLE_NAME}").fetchone()[0]
+            deferred = _drop_secondary_indexes(conn) if last_rowid <= settings.bulk_reindex_max_rows else []
+            if storage == "epoch_days":
+                rows = _to_epoch_days(rows)
+            it = iter(rows)
+            count = batches = 0
+            while True:
+                batch = list(islice(it, batch_size))
+                if not batch:
+                    break
+                count += conn.executemany(INSERT_SQL, batch).rowcount
+                batches += 1
+            for _, sql in deferred:
+                conn.execute(sql)
+            _rollup_add(conn, storage, last_rowid)
+    seconds = time.perf_counter() - t0
+    _bump_version(project_root)
+    with pool.writer() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # fold the large WAL back; skipped pages stay if readers are busy
+    return {"rows_inserted": count, "seconds": round(seconds, 3),
+            "rows_per_s": round(count / seconds) if seconds else None,
+            "batches": batches, "indexes_deferred": [name for name, _ in deferred]}
+
+def _load_partitioned(conn: sqlite3.Connection, rows: Iterable[Row], date_storage: str) -> int:
+    """Route rows to their start_date month's table (created on first use), buffering up to
+    PARTITION_BATCH rows per month; one transaction for the whole load."""
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")  # so partitions created here roll back with the rows
+    start = BILLS.index["start_date"]
+    known = set(_partition_months(conn))
+    last_rowid: Dict[str, int] = {}  # per touched month: max rowid before this load
+    pending: Dict[str, List[Row]] = {}
+    count = 0
+
+    def flush(month: str) -> None:
+        nonlocal count
+        batch = pending.pop(month)
+        if month not in known:
+            _add_partition(conn, month, date_storage)
+            known.add(month)
+        table = _partition_table(month)
+        if month not in last_rowid:
+            last_rowid[month] = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+        count += conn.executemany(BILLS.insert_sql(table),
+                                  _to_epoch_days(batch) if date_storage == "epoch_days" else batch).rowcount
+
+    for row in rows:
+        month = row[start][:7]
+        batch = pending.setdefault(month, [])
+        batch.append(row)
+        if len(batch) >= PARTITION_BATCH:
+            flush(month)
+    for month in list(pending):
+        flush(month)
+    for month, after in last_rowid.items():
+        _rollup_add(conn, date_storage, after, _partition_table(month))
+    return count
+
+def dedupe(project_root: Path, key: Sequence[str]) -> int:
+    """Delete all but the most recently inserted row (highest rowid) for each key value."""
+    _require_table_layout(project_root, "Dedupe")
+    cols = ", ".join(key)
+    with pool_for(project_root).writer() as conn:
+        deleted = conn.execute(f"DELETE FROM {TABLE_NAME} WHERE rowid NOT IN "
+                               f"(SELECT MAX(rowid) FROM {TABLE_NAME} GROUP BY {cols})").rowcount
+        if deleted:
+            _rebuild_rollups(conn, date_storage(project_root))
+    _bump_version(project_root)
+    return deleted
+
+def query_rollups(project_root: Path, building_id: Optional[int] = None, usage_type: Optional[str] = None,
+                  month_from: Optional[str] = None, month_to: Optional[str] = None) -> List[dict]:
+    """Rollup rows (one per building_id, usage_type, month) matching the given filters;
+    months are 'YYYY-MM' and the range is inclusive."""
+    init_db(project_root)
+    filters = [("building_id = ?", building_id), ("usage_type = ?", usage_type),
+               ("month >= ?", month_from), ("month <= ?", month_to)]
+    where = [cond for cond, value in filters if value is not None]
+    args = [value for _, value in filters if value is not None]
+    cur = pool_for(project_root).reader().execute(
+        f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM {ROLLUP_TABLE} "
+        f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY building_id, usage_type, month", args)
+    return [dict(zip(ROLLUP_COLUMNS, row)) for row in cur]
+
+def rebuild_rollups(project_root: Path) -> int:
+    """Recompute custom_csv_rollup from custom_csv; returns the number of groups."""
+    storage = date_storage(project_root)
+    with pool_for(project_root).writer() as conn:
+        groups = _rebuild_rollups(conn, storage)
+    _bump_version(project_root)
+    return groups
+
+def find_ingest(project_root: Path, content_hash: str) -> Optional[dict]:
+    """Result recorded for a CSV with these exact bytes, if one was already loaded."""
+    init_db(project_root)
+    row = pool_for(project_root).reader().execute(
+        f"SELECT result FROM {INGEST_LOG_TABLE} WHERE content_hash=?", (content_hash,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def record_ingest(project_root: Path, content_hash: str, filename: str, result: dict) -> None:
+    record_ingests(project_root, [(content_hash, filename, result)])
+
+def record_ingests(project_root: Path, entries: Sequence[Tuple[str, str, dict]]) -> None:
+    """record_ingest for many (content_hash, filename, result) in one commit."""
+    now = time.time()
+    with pool_for(project_root).writer() as conn:
+        conn.executemany(f"INSERT OR REPLACE INTO {INGEST_LOG_TABLE} (content_hash, filename, result, loaded_at) "
+                         f"VALUES (?, ?, ?, ?)", [(h, name, json.dumps(result), now) for h, name, result in entries])
+
+_DUP_SUFFIX = re.compile(r":\d+$")
+_LEADING_NOISE = re.compile(r"(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.S)
+_READ_KEYWORD = re.compile(r"(?:select|with)\b", re.I)
+# literals, quoted identifiers, comments, ';' and parameters (?, ?NNN, :name, @name, $name)
+# as single tokens
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|\Z)"
+                         r"|\s+|\?\d*|[:@$][A-Za-z_]\w*|[\w$]+|.", re.S)
+
+def _is_noise(token: str) -> bool:
+    return token.isspace() or token == ";" or token.startswith(("--", "/*"))
+
+@lru_cache(maxsize=1024)
+def select_statement(sql: str) -> Optional[str]:
+    """The statement to run for a /athena/query body (trailing whitespace, comments and ';'
+    removed, so it can be wrapped by _limited), or None unless it starts with SELECT or
+    WITH after any comments. Cached on the raw text, so a repeated query costs one dict
+    lookup; reader connections are query_only, so a WITH ... DELETE that slips past still
+    cannot write."""
+    tokens = _SQL_TOKENS.findall(sql.strip())
+    while tokens and _is_noise(tokens[-1]):
+        tokens.pop()
+    stmt = "".join(tokens)
+    if not _READ_KEYWORD.match(stmt, _LEADING_NOISE.match(stmt).end()):
+        return None
+    return stmt
+
+@lru_cache(maxsize=1024)
+def _placeholder_count(sql: str) -> int:
+    """Parameters a statement takes, numbered the way SQLite does: ?N is parameter N, and
+    '?' or a name not seen before is the highest number so far plus one."""
+    count, names = 0, set()
+    for tok in _SQL_TOKENS.findall(sql):
+        if tok == "?" or (tok[0] in ":@$" and len(tok) > 1 and tok not in names):
+            count += 1
+            names.add(tok)
+        elif tok[0] == "?":
+            count = max(count, int(tok[1:]))
+    return count
+
+def _limited(sql: str, params: Sequence[Any], max_rows: Optional[int]) -> Tuple[str, tuple]:
+    """Push the row cap into SQLite: it stops stepping (or keeps a top-N sort) at max_rows
+    instead of producing every row. Newlines keep a trailing -- comment inside the parens.
+    The cap is bound as the last `?`, so the wrapped text (and its prepared statement) is
+    the same for every cap and params value. None means no cap; SQLite would read a
+    negative LIMIT as no cap too, so anything below 1 is rejected. The params count is
+    checked against sql first, so an error never counts the hidden cap placeholder."""
+    expected = _placeholder_count(sql)
+    if len(params) != expected:
+        raise ValueError(f"Incorrect number of bindings supplied. The statement uses {expected}, "
+                         f"and there are {len(params)} supplied.")
+    if max_rows is None:
+        return sql, tuple(params)
+    if max_rows < 1:
+        raise ValueError(f"max_rows must be at least 1, not {max_rows}.")
+    return f"SELECT * FROM (\n{sql}\n) LIMIT ?", (*params, max_rows)
+
+def _columns(cur: sqlite3.Cursor) -> List[str]:
+    # the wrapping subquery renames repeated output names to name:1, name:2, ...; undo that
+    cols: List[str] = []
+    for d in cur.description or ():
+        base = _DUP_SUFFIX.sub("", d[0])
+        cols.append(base if base != d[0] and base in cols else d[0])
+    return cols
+
+def run_select(project_root: Path, sql: str, max_rows: int = 1000,
+               params: Sequence[Any] = ()) -> Tuple[List[str], List[Tuple]]:
+    limited, args = _limited(sql, params, max_rows)
+    cur = pool_for(project_root).reader().execute(limited, args)
+    try:
+        cols = _columns(cur)
+        rows: List[Tuple] = []
+        while True:
+            batch = cur.fetchmany(FETCH_BATCH)
+            if not batch:
+                return cols, rows
+            rows.extend(batch)
+    finally:
+        cur.close()
+
+class RowStream:
+    """fetchmany batches from a cursor on a private connection. close() releases the
+    connection; it is idempotent and works whether iteration finished, stopped mid-way or
+    never started (a generator's finally would not run in that last case)."""
+    def __init__(self, conn: sqlite3.Connection, cur: sqlite3.Cursor):
+        self._conn, self._cur = conn, cur
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[List[Tuple]]:
+        try:
+            while True:
+                batch = self._cur.fetchmany(FETCH_BATCH)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is None:
+                return
+            conn, self._conn = self._conn, None
+        self._cur.close()
+        conn.close()
+
+def stream_select(project_root: Path, sql: str, max_rows: Optional[int] = None,
+                  params: Sequence[Any] = ()) -> Tuple[List[str], RowStream]:
+    """Execute now (so SQL errors surface before anything is sent) and return the column
+    names plus a RowStream of fetchmany batches on a private connection, which the caller
+    must close()."""
+    conn = pool_for(project_root).open_stream()
+    try:
+        limited, args = _limited(sql, params, max_rows)
+        cur = conn.execute(limited, args)
+    except BaseException:
+        conn.close()
+        raise
+    return _columns(cur), RowStream(conn, cur)
+
+def list_indexes(project_root: Path) -> List[dict]:
+    """Indexes present on custom_csv plus managed ones that are not (present=False). When
+    partitioned, those of the template table, which every partition mirrors."""
+    table = TEMPLATE_TABLE if storage_layout(project_root) == "partitioned" else TABLE_NAME
+    conn = pool_for(project_root).reader()
+    present = {}
+    for _seq, name, unique, *_ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        cols = tuple(r[2] for r in conn.execute(f"PRAGMA index_info({name})").fetchall())
+        present[name] = (cols, bool(unique))
+    out = [{"name": name, "columns": list(cols), "unique": unique, "managed": name in MANAGED_INDEXES, "present": True}
+           for name, (cols, unique) in present.items()]
+    out += [{"name": name, "columns": list(cols), "unique": unique, "managed": True, "present": False}
+            for name, (cols, unique) in MANAGED_INDEXES.items() if name not in present]
+    return out
+
+def create_index(project_root: Path, name: str) -> None:
+    if name not in MANAGED_INDEXES:
+        raise LookupError(f"Unknown index '{name}'; choose one of {sorted(MANAGED_INDEXES)}.")
+    _require_table_layout(project_root, "Changing indexes")
+    try:
+        with pool_for(project_root).writer() as conn:
+            _create_index(conn, name)
+    except sqlite3.IntegrityError as e:
+        raise ManagedIndexError(f"Cannot create {name}: {e} (remove duplicate rows first).")
+
+def drop_index(project_root: Path, name: str) -> None:
+    if not any(ix["name"] == name and ix["present"] for ix in list_indexes(project_root)):
+        raise LookupError(f"No index '{name}' on {TABLE_NAME}.")
+    _require_table_layout(project_root, "Changing indexes")
+    with pool_for(project_root).writer() as conn:
+        conn.execute(f"DROP INDEX {name}")
+
+def _rewrite_dates(conn: sqlite3.Connection, table: str, target: str) -> int:
+    """Copy `table` into a fresh one with `target` date columns (same rowids), swap it in
+    and re-create its indexes."""
+    convert = "epoch_day" if target == "epoch_days" else "iso_date"
+    tmp = f"{table}__migrating"
+    index_sql = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (table,))]
+    conn.execute(f"DROP TABLE IF EXISTS {tmp}")
+    conn.execute(BILLS.ddl(tmp, target))
+    cols = ", ".join(BILLS.names)
+    select = ", ".join(f"{convert}({c})" if c in BILLS.date_columns else c for c in BILLS.names)
+    migrated = conn.execute(f"INSERT INTO {tmp} (rowid, {cols}) SELECT rowid, {select} FROM {table}").rowcount
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+    for sql in index_sql:
+        conn.execute(sql)
+    return migrated
+
+def migrate_date_storage(project_root: Path, target: str) -> dict:
+    """Rewrite custom_csv (every partition when partitioned) with start_date/end_date stored
+    as `target`, keeping rowids and re-creating the indexes it had. Runs as one
+    transaction; a no-op when already there."""
+    if target not in DATE_STORAGES:
+        raise ValueError(f"date_storage must be one of {DATE_STORAGES}")
+    current = date_storage(project_root)
+    if current == target:
+        return {"date_storage": target, "rows_migrated": 0, "changed": False}
+    partitioned = storage_layout(project_root) == "partitioned"
+    with pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        tables = _physical_tables(conn)
+        if partitioned:
+            _drop_views(conn)  # RENAME refuses while a view points at a dropped table
+        migrated = sum(_rewrite_dates(conn, table, target) for table in tables)
+        if partitioned:
+            _create_view(conn)
+    _date_storage[get_db_path(project_root)] = target
+    _bump_version(project_root)
+    return {"date_storage": target, "rows_migrated": migrated, "changed": True}
+
+def migrate_layout(project_root: Path, target: str) -> dict:
+    """Split custom_csv into month partitions (one transaction); a no-op when already there.
+    Going back to a single table is not supported."""
+    if target not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}")
+    current = storage_layout(project_root)
+    if current == target:
+        return {"layout": target, "rows_migrated": 0, "changed": False}
+    if target == "table":
+        raise PartitionedLayoutError("Merging partitions back into one table is not supported.")
+    storage = date_storage(project_root)
+    with pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        migrated = _convert_to_partitioned(conn, storage)
+    _layouts[get_db_path(project_root)] = target
+    _bump_version(project_root)
+    return {"layout": target, "rows_migrated": migrated, "changed": True}
+
+def list_partitions(project_root: Path) -> List[dict]:
+    if storage_layout(project_root) == "table":
+        return []
+    conn = pool_for(project_root).reader()
+    return [{"month": m, "table": _partition_table(m),
+             "rows": conn.execute(f"SELECT COUNT(*) FROM {_partition_table(m)}").fetchone()[0]}
+            for m in _partition_months(conn)]
+
+def drop_partition(project_root: Path, month: str) -> int:
+    """Delete a whole month by dropping its table (no row-by-row DELETE, and the pages go
+    straight to the freelist); its rollup groups go with it. Returns rows dropped."""
+    if not any(p["month"] == month for p in list_partitions(project_root)):
+        raise LookupError(f"No partition for month '{month}'.")
+    table = _partition_table(month)
+    with pool_for(project_root).writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        _drop_views(conn)
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"DELETE FROM {PARTITIONS_TABLE} WHERE month=?", (month,))
+        conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE month=?", (month,))
+        _create_view(conn)
+    _bump_version(project_root)
+    return rows
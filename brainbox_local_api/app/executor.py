@@ -0,0 +1,59 @@
+import asyncio, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+class ServerBusy(Exception):
+    """Raised when a BoundedExecutor already has max_workers running and max_queue waiting."""
+    def __init__(self, pool_name: str):
+        super().__init__(f"The {pool_name} pool is at capacity; retry later.")
+        self.pool_name = pool_name
+
+class BoundedExecutor:
+    """Runs blocking callables (sqlite3, file I/O, CSV parsing) off the event loop on a
+    dedicated thread pool. Admission is bounded: at most max_workers jobs run and at most
+    max_queue more wait; anything beyond that is rejected with ServerBusy right away
+    instead of piling up behind a large load."""
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Queue fn without waiting for it; raises ServerBusy when the pool is full."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServerBusy(self.name)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"max_workers": self.max_workers, "max_queue": self.max_queue, "in_flight": self.in_flight,
+                "completed": self.completed, "rejected": self.rejected}
@@ -0,0 +1,69 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi.responses import Response
+
+# orjson (JSON) and msgpack (binary format) are in requirements.txt; the fallbacks keep
+# a partial install serving JSON
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+COLUMNAR = "application/vnd.brainbox.columnar+json"
+MSGPACK = "application/msgpack"
+
+# ?format= value -> media type; the Accept header is matched against the same types
+FORMATS = {"json": JSON, "ndjson": NDJSON, "columnar": COLUMNAR, "msgpack": MSGPACK}
+_ACCEPT_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+def _default(value: Any) -> Any:
+    """Values the encoders have no native form for: SQLite BLOB cells become hex text."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    raise TypeError(f"Type is not serializable: {type(value).__name__}")
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON bytes: orjson when installed (serializes tuples natively, ~10x faster
+    than json), else the stdlib encoder. BLOBs are hex encoded (see _default)."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default).encode()
+
+def available(media_type: str) -> bool:
+    return media_type != MSGPACK or msgpack is not None
+
+def negotiate(format: Optional[str], accept: str) -> Optional[str]:
+    """Media type for a query response: explicit ?format= wins (None when unknown), then the
+    first known type in Accept that is available here, then JSON."""
+    if format is not None:
+        return FORMATS.get(format.lower())
+    for part in accept.split(","):
+        media = part.split(";", 1)[0].strip().lower()
+        media = _ACCEPT_ALIASES.get(media, media)
+        if media in (NDJSON, COLUMNAR, MSGPACK) and available(media):
+            return media
+    return JSON
+
+def columnar(cols: List[str], rows: List[tuple]) -> Dict[str, Any]:
+    """{"columns": [...], "values": [[col0 values], [col1 values], ...], "rowcount": n};
+    values are positional so repeated column names survive."""
+    values = [list(v) for v in zip(*rows)] if rows else [[] for _ in cols]
+    return {"columns": cols, "values": values, "rowcount": len(rows)}
+
+def query_response(media_type: str, cols: List[str], rows: List[tuple]) -> Response:
+    """Serialize a result directly to bytes. Returning a Response skips FastAPI's
+    jsonable_encoder, which otherwise walks every cell of every row. TypeError when a cell
+    cannot be encoded. MessagePack keeps BLOBs as its native bin type."""
+    if media_type == JSON:
+        return Response(dumps({"columns": cols, "rows": rows, "rowcount": len(rows)}), media_type=JSON)
+    payload = columnar(cols, rows)
+    if media_type == MSGPACK:
+        return Response(msgpack.packb(payload, default=_default), media_type=MSGPACK)
+    return Response(dumps(payload), media_type=COLUMNAR)
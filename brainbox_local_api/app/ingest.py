@@ -0,0 +1,447 @@
+import hashlib, io, os, sys, tarfile, time, zipfile
+from contextlib import contextmanager
+from itertools import chain, islice
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from .validators import CHUNK_SIZE, iter_csv, to_canonical, validate_header_exact, TypeChecker, RowValidationError
+from .schemas import BILLS, Schema, get_schema
+from .cache import LRUCache
+from .services import LocalMockAws
+from .catalog import checker_facts
+from .compression import DECOMPRESSION_ERRORS, codec_for, decompressed, is_csv_name
+from .parallel import ParallelCsv, file_path, map_ordered, use_parallel
+from . import db as localdb
+from .settings import settings
+
+# Validate once: sha256 of a file that passed /validate -> {"schema", "facts", "rows", "bytes"}
+# (rows: its checked canonical rows when small enough, else None). /upload?validation_token=<sha256>
+# with the same bytes and schema loads without checking again.
+validated = LRUCache(settings.validation_cache_entries, ttl_s=settings.validation_cache_ttl_s or None,
+                     max_bytes=settings.validation_cache_max_bytes, sizeof=lambda entry: entry["bytes"])
+
+class IngestError(Exception):
+    """A client-facing failure: HTTP status plus the JSON body to return."""
+    def __init__(self, status_code: int, body: dict):
+        super().__init__(body.get("message") or body.get("error"))
+        self.status_code = status_code
+        self.body = body
+
+@contextmanager
+def csv_errors() -> Iterator[None]:
+    """Map parse/validation exceptions raised while streaming a CSV to IngestError."""
+    try:
+        yield
+    except RowValidationError as e:
+        raise IngestError(422, {"error":"InvalidType", **e.info})
+    except UnicodeDecodeError:
+        raise IngestError(400, {"error":"InvalidEncoding","message":"CSV must be UTF-8."})
+    except DECOMPRESSION_ERRORS as e:
+        raise IngestError(400, {"error":"InvalidCompression","message":f"Cannot decompress the upload: {e}"})
+    except ValueError as e:
+        raise IngestError(400, {"error":"InvalidCSV","message":str(e)})
+
+def schema_option(name: str | None) -> Schema:
+    """The ?schema= layout (BILLS when not given); 400 UnknownSchema otherwise."""
+    if name is None:
+        return BILLS
+    try:
+        return get_schema(name)
+    except LookupError as e:
+        raise IngestError(400, {"error":"UnknownSchema","message":str(e)})
+
+def check_header(header: list, schema: Schema = BILLS) -> None:
+    ok_schema, info = validate_header_exact(header, schema)
+    if not ok_schema:
+        raise IngestError(422, {"error":"InvalidSchema", **info})
+
+def open_rows(stream: BinaryIO, schema: Schema = BILLS):
+    """Parse the header, enforce the exact schema and return (header, canonical row iterator)."""
+    header, rows = iter_csv(stream)
+    check_header(header, schema)
+    return header, to_canonical(header, rows, schema)
+
+@contextmanager
+def checked_rows(stream: BinaryIO, progress: Callable[[int, int], None] | None = None, keep_rows: bool = True,
+                 codec: str | None = None, schema: Schema = BILLS):
+    """(header, canonical type-checked row iterator, TypeChecker holding the counts). Large
+    uploads are parsed and checked by worker processes (app/parallel.py), small ones
+    inline; both raise the same errors and number rows the same way. A compressed upload
+    (codec) is decompressed as it is parsed, inline: a compressed stream cannot be cut
+    into ranges."""
+    if codec is not None or not use_parallel(stream):
+        with decompressed(stream, codec) as plain:
+            header, rows = open_rows(plain, schema)
+            checker = TypeChecker(schema=schema)
+            yield header, checker.iter_checked(rows, progress), checker
+        return
+    with file_path(stream) as path:
+        source = ParallelCsv(path, schema=schema)
+        check_header(source.header, schema)
+        yield source.header, source.iter_checked(progress, keep_rows), source.checker
+
+def _rows_size(rows: List[tuple]) -> int:
+    """Approximate memory held by a list of row tuples, extrapolated from the first row."""
+    if not rows:
+        return sys.getsizeof(rows)
+    return sys.getsizeof(rows) + len(rows) * (sys.getsizeof(rows[0]) + sum(map(sys.getsizeof, rows[0])))
+
+VALIDATE_MODES = ("full", "sample", "header")
+DEFAULT_SAMPLE = 100
+HEADER_CHUNK = 64 * 1024  # bytes decoded to find the header in mode=header
+
+def validate_options(mode: str, sample: int) -> None:
+    if mode not in VALIDATE_MODES:
+        raise IngestError(400, {"error":"InvalidMode","message":f"mode must be one of {list(VALIDATE_MODES)}."})
+    if sample < 1:
+        raise IngestError(400, {"error":"InvalidSample","message":"sample must be at least 1."})
+
+def check_prefix(stream: BinaryIO, codec: str | None, rows: int, schema: Schema = BILLS) -> dict:
+    """/validate?mode=header|sample: the header and then only the first `rows` rows are
+    parsed and type-checked; the rest of the file is never read (header mode decodes one
+    64 KiB chunk). Same errors as a full check, for the part that was looked at."""
+    with csv_errors(), decompressed(stream, codec) as plain:
+        header, records = iter_csv(plain, HEADER_CHUNK if rows == 0 else CHUNK_SIZE)
+        check_header(header, schema)
+        checker = TypeChecker(schema=schema)
+        for _ in checker.iter_checked(islice(to_canonical(header, records, schema), rows)):
+            pass
+    return {"message": "CSV header is valid." if rows == 0 else "CSV sample is valid.", "columns": header,
+            "rows_checked": checker.rows_checked, "mode": "header" if rows == 0 else "sample"}
+
+def check_csv(stream: BinaryIO, codec: str | None = None, mode: str = "full", sample: int = DEFAULT_SAMPLE,
+              schema: Schema = BILLS) -> dict:
+    """Blocking body of /validate. mode="header" / "sample" only look at the start of the
+    file (check_prefix) and return no token. A file that passes is remembered in `validated` under its
+    sha256, returned as validation_token: with its kept rows when the upload is at most
+    settings.validation_keep_rows_max_bytes, else when its dates are already canonical (the
+    upload can then be parsed without the type check)."""
+    if mode != "full":
+        return check_prefix(stream, codec, 0 if mode == "header" else sample, schema)
+    digest = file_sha256(stream)
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    keep = codec is None and size <= settings.validation_keep_rows_max_bytes
+    with csv_errors(), checked_rows(stream, keep_rows=keep, codec=codec, schema=schema) as (header, rows, checker):
+        kept = list(rows) if keep else None
+        if kept is None:
+            for _ in rows:
+                pass
+    if kept is not None or checker.rewritten_batches == 0:
+        validated.put(digest, {"schema": schema.name, "facts": checker_facts(header, checker), "rows": kept,
+                               "bytes": _rows_size(kept) if kept is not None else 0})
+    return {"message":"CSV file is valid.","columns": header, "rows_checked": checker.rows_checked,
+            "mode": "full", "validation_token": digest}
+
+@contextmanager
+def trusted_rows(stream: BinaryIO, codec: str | None, entry: dict, schema: Schema = BILLS):
+    """checked_rows for a file /validate already passed (a `validated` entry): its kept
+    rows, or a plain parse with no header or type checks (its dates are canonical)."""
+    if entry["rows"] is not None:
+        yield entry["facts"]["columns"], iter(entry["rows"]), None
+        return
+    with decompressed(stream, codec) as plain:
+        header, rows = iter_csv(plain)
+        yield header, to_canonical(header, rows, schema), None
+
+def file_sha256(stream: BinaryIO) -> str:
+    """Hash a seekable stream from the start and rewind it for the parser."""
+    stream.seek(0)
+    digest = hashlib.file_digest(stream, "sha256").hexdigest()
+    stream.seek(0)
+    return digest
+
+def load_options(mode: str | None, key: str | None, schema: Schema = BILLS) -> tuple:
+    """Validate the /upload mode/key parameters -> (mode, key columns of schema). An append
+    without key= has none: the default key (BRAINBOX_UPSERT_KEY) is a bills column."""
+    mode = mode or settings.ingest_mode
+    if mode not in localdb.LOAD_MODES:
+        raise IngestError(400, {"error":"InvalidMode","message":f"mode must be one of {list(localdb.LOAD_MODES)}."})
+    if mode == "append" and key is None:
+        return mode, ()
+    try:
+        return mode, localdb.parse_key(key, schema)
+    except ValueError as e:
+        raise IngestError(400, {"error":"InvalidKey","message":str(e)})
+
+def ingest_csv(project_root: Path, aws: LocalMockAws, stream: BinaryIO, filename: str,
+               progress: Callable[[int, int], None] | None = None,
+               mode: str | None = None, key: str | None = None, bulk: bool = False,
+               stored: Path | None = None, validation_token: str | None = None, schema: Schema = BILLS) -> dict:
+    """Blocking body of /upload: validate + load into custom_csv (schema.table for another
+    registered layout, reported as "schema" / "table" in the result), then store it and
+    catalog that one object (Glue catalog update, app/catalog.py).
+    progress(rows_validated, rows_inserted) is reported per validation batch.
+    In upsert mode the load is keyed on `key` and a byte-identical CSV that was already
+    loaded is not parsed again: the earlier result comes back with "skipped": true.
+    bulk=True appends through localdb.bulk_load and adds its timings as "load".
+    stored is set when the stream already is an object in the uploads store (ingest_stored):
+    it is not written back, which would truncate the file being read.
+    validation_token is the /validate result for these bytes: when it matches their sha256
+    and is still cached, the rows are loaded without being checked again ("validation":
+    "token" in the result; "full" when the token could not be used)."""
+    mode, key_cols = load_options(mode, key, schema)
+    if bulk and mode != "append":
+        raise IngestError(400, {"error":"InvalidMode","message":"bulk=true only appends; drop mode=upsert."})
+    if bulk and schema is not BILLS:
+        raise IngestError(400, {"error":"InvalidMode","message":"bulk=true loads custom_csv only; drop schema."})
+    if mode == "upsert" and schema is BILLS and localdb.storage_layout(project_root) == "partitioned":
+        raise IngestError(400, {"error":"InvalidMode","message":"mode=upsert needs the single-table layout."})
+    if stored is None:
+        try:
+            aws.key_path(filename)
+        except ValueError as e:
+            raise IngestError(400, {"error":"InvalidObjectKey","message":str(e)})
+    else:
+        stored_stat = stored.stat()  # before parsing: the catalog trusts our facts only for this version
+    content_hash, trusted = None, None
+    if validation_token:
+        content_hash = file_sha256(stream)
+        trusted = validated.get(validation_token) if content_hash == validation_token else None
+        if trusted and trusted["schema"] != schema.name:
+            trusted = None  # validated against another layout
+    if mode == "upsert":
+        # a stored object the catalog has already hashed (same size/mtime) is not re-read
+        content_hash = content_hash or (stored and aws.catalog.cached_sha256(stored)) or file_sha256(stream)
+        previous = localdb.find_ingest(project_root, content_hash)
+        if previous is not None:
+            return {**previous, "rows_inserted": 0, "skipped": True, "content_hash": content_hash}
+
+    codec = codec_for(filename)
+    rows_source = (trusted_rows(stream, codec, trusted, schema) if trusted
+                   else checked_rows(stream, progress, codec=codec, schema=schema))
+    with csv_errors(), rows_source as (header, checked, checker):
+        # Load into SQLite (bills_db.custom_csv or schema.table) straight from the parser.
+        # Every row is type-checked on the way in; any failure rolls the whole insert back.
+        localdb.init_db(project_root)
+        load_stats = None
+        try:
+            if bulk:
+                load_stats = localdb.bulk_load(project_root, checked)
+                inserted = load_stats["rows_inserted"]
+            else:
+                inserted = localdb.load_rows(project_root, checked, mode=mode, key=key_cols, schema=schema)
+        except localdb.ManagedIndexError as e:
+            raise IngestError(409, {"error":"DuplicateKeys","message":str(e)})
+
+    # Save CSV & crawl it alone; the catalog gets its facts from the load instead of re-parsing it
+    facts = trusted["facts"] if trusted else checker_facts(header, checker)
+    if stored is None:
+        obj = aws.put_stream(stream, filename=filename)
+        saved_path, known = obj.path, (obj.size, obj.mtime_ns, obj.sha256, facts)
+    else:
+        saved_path, known = stored, (stored_stat.st_size, stored_stat.st_mtime_ns, content_hash, facts)
+    marker_path = aws.trigger_glue_crawler("bills_crawler", known={saved_path.name: known}, keys=[saved_path.name])
+
+    result = {
+        "status":"ok",
+        "stored": str(saved_path.relative_to(project_root)),
+        "crawler_marker": str(marker_path.relative_to(project_root)),
+        "rows_inserted": inserted
+    }
+    if schema is not BILLS:
+        result.update({"schema": schema.name, "table": schema.table})
+    if load_stats:
+        result["load"] = load_stats
+    if validation_token:
+        result["validation"] = "token" if trusted else "full"
+    if mode == "upsert":
+        localdb.record_ingest(project_root, content_hash, filename, result)
+        result = {**result, "mode": mode, "content_hash": content_hash}
+    return result
+
+@contextmanager
+def stored_object(aws: LocalMockAws, name: str) -> Iterator:
+    """Open an upload already in local_state/uploads through mmap; bad or unknown keys
+    become 400 InvalidObjectKey / 404 NoSuchKey."""
+    try:
+        mapped = aws.open_mapped(name)
+    except ValueError as e:
+        raise IngestError(400, {"error":"InvalidObjectKey","message":str(e)})
+    except FileNotFoundError as e:
+        raise IngestError(404, {"error":"NoSuchKey","message":str(e)})
+    with mapped:
+        yield mapped
+
+def check_stored(aws: LocalMockAws, name: str, mode: str = "full", sample: int = DEFAULT_SAMPLE,
+                 schema: Schema = BILLS) -> dict:
+    """Blocking body of /uploads/{key}/validate."""
+    with stored_object(aws, name) as mapped:
+        return {**check_csv(mapped, codec_for(name), mode, sample, schema), "key": name}
+
+def ingest_stored(project_root: Path, aws: LocalMockAws, name: str, mode: str | None = None,
+                  key: str | None = None, bulk: bool = False, schema: Schema = BILLS) -> dict:
+    """Blocking body of /uploads/{key}/ingest: load a stored upload in place. The parser
+    decodes straight from the mapping, so the file is neither re-sent over HTTP nor read
+    into Python bytes; large files go to the worker processes by path."""
+    with stored_object(aws, name) as mapped:
+        return ingest_csv(project_root, aws, mapped, name, mode=mode, key=key, bulk=bulk,
+                          stored=Path(mapped.name), schema=schema)
+
+def complete_multipart(project_root: Path, aws: LocalMockAws, name: str, upload_id: str) -> dict:
+    """Blocking body of /uploads/{key}/multipart/{upload_id}/complete: join the parts and
+    catalog the new object alone. Its sha256 comes from the join, so the crawl only parses
+    it (or nothing, when the same content is already cataloged)."""
+    obj = aws.complete_multipart_upload(name, upload_id)
+    marker_path = aws.trigger_glue_crawler("bills_crawler", known={obj.key: (obj.size, obj.mtime_ns, obj.sha256, None)},
+                                           keys=[obj.key])
+    return {"key": obj.key, "stored": str(obj.path.relative_to(project_root)), "size": obj.size, "sha256": obj.sha256,
+            "crawler_marker": str(marker_path.relative_to(project_root))}
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+def _archive_members(filename: str, stream: BinaryIO) -> Iterator[Tuple[str, int, Callable[[], bytes]]]:
+    """(member name, uncompressed size, read) for each regular file of a .zip / .tar[.gz]."""
+    stream.seek(0)
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(stream) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, lambda info=info: zf.read(info)
+    else:
+        with tarfile.open(fileobj=stream, mode="r:*") as tf:
+            for info in tf:
+                if info.isfile():
+                    yield info.name, info.size, lambda info=info: tf.extractfile(info).read()
+
+def batch_files(uploads: List[Tuple[str, BinaryIO]]) -> List[Tuple[str, Optional[bytes]]]:
+    """Flatten /upload/batch parts into (name, content); archives are expanded into their
+    members, named by base name (hidden files skipped). content is None when the name is
+    not a .csv. Sizes are checked before anything is read (413 BatchTooLarge)."""
+    files: List[Tuple[str, Optional[bytes]]] = []
+    total = 0
+    def add(name: str, size: int, read: Callable[[], bytes]) -> None:
+        nonlocal total
+        total += size
+        if len(files) >= settings.batch_max_files or total > settings.batch_max_bytes:
+            raise IngestError(413, {"error":"BatchTooLarge","message":
+                f"A batch is limited to {settings.batch_max_files} files and {settings.batch_max_bytes} bytes."})
+        files.append((name, read() if is_csv_name(name) else None))
+    for filename, stream in uploads:
+        filename = filename or ""
+        if not filename.lower().endswith(ARCHIVE_SUFFIXES):
+            size = stream.seek(0, os.SEEK_END)
+            stream.seek(0)
+            add(filename, size, stream.read)
+            continue
+        try:
+            for name, size, read in _archive_members(filename, stream):
+                base = PurePosixPath(name).name
+                if not base.startswith("."):
+                    add(base, size, read)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            raise IngestError(400, {"error":"InvalidArchive","message":f"{filename}: {e}"})
+    return files
+
+def check_bytes(item: Tuple[bytes, Optional[str], Schema]) -> dict:
+    """Parse and type-check one small CSV held in memory, (content, codec, schema)
+    (runs on the parse workers) -> {"status": 200, "rows", "facts"} or {"status": 4xx,
+    "body": <the /upload error body>}."""
+    data, codec, schema = item
+    try:
+        with csv_errors(), decompressed(io.BytesIO(data), codec) as plain:
+            header, rows = open_rows(plain, schema)
+            checker = TypeChecker(schema=schema)
+            kept = list(checker.iter_checked(rows))
+    except IngestError as e:
+        return {"status": e.status_code, "body": e.body}
+    return {"status": 200, "rows": kept, "facts": checker_facts(header, checker)}
+
+def ingest_batch(project_root: Path, aws: LocalMockAws, uploads: List[Tuple[str, BinaryIO]],
+                 mode: str | None = None, key: str | None = None, schema: Schema = BILLS) -> dict:
+    """Blocking body of /upload/batch: many small CSVs (parts and/or .zip/.tar members).
+    Files are validated concurrently on the parse workers, every valid one is loaded in a
+    single load_rows transaction, stored, and cataloged by one crawler run. A bad file does
+    not stop the others; each gets its own status ({"file", "status", ...}: the /upload
+    result or error body)."""
+    started = time.perf_counter()
+    mode, key_cols = load_options(mode, key, schema)
+    if mode == "upsert" and schema is BILLS and localdb.storage_layout(project_root) == "partitioned":
+        raise IngestError(400, {"error":"InvalidMode","message":"mode=upsert needs the single-table layout."})
+    files = batch_files(uploads)
+    if not files:
+        raise IngestError(400, {"error":"NoFiles","message":"The batch has no files."})
+
+    statuses: List[Optional[dict]] = [None] * len(files)
+    todo: List[int] = []
+    seen = set()
+    for i, (name, data) in enumerate(files):
+        if data is None:
+            statuses[i] = {"file": name, "status": 415, "error":"InvalidFileType", "message":"Only .csv accepted."}
+        elif name in seen:
+            statuses[i] = {"file": name, "status": 409, "error":"DuplicateKey",
+                           "message":"The name appears more than once in the batch."}
+        else:
+            try:
+                aws.key_path(name)
+            except ValueError as e:
+                statuses[i] = {"file": name, "status": 400, "error":"InvalidObjectKey", "message":str(e)}
+                continue
+            seen.add(name)
+            todo.append(i)
+
+    hashes = {}
+    if mode == "upsert":  # byte-identical files already loaded (or earlier in this batch) are skipped
+        localdb.init_db(project_root)
+        fresh, seen_digests = [], set()
+        for i in todo:
+            digest = hashlib.sha256(files[i][1]).hexdigest()
+            if digest in seen_digests or localdb.find_ingest(project_root, digest) is not None:
+                statuses[i] = {"file": files[i][0], "status": 200, "rows_inserted": 0, "skipped": True,
+                               "content_hash": digest}
+            else:
+                hashes[i] = digest
+                seen_digests.add(digest)
+                fresh.append(i)
+        todo = fresh
+
+    loaded = []
+    items = [(files[i][1], codec_for(files[i][0]), schema) for i in todo]
+    for i, res in zip(todo, map_ordered(check_bytes, items)):
+        if res["status"] == 200:
+            loaded.append((i, res))
+        else:
+            statuses[i] = {"file": files[i][0], "status": res["status"], **res["body"]}
+
+    inserted, marker_path = 0, None
+    if loaded:
+        localdb.init_db(project_root)
+        try:
+            inserted = localdb.load_rows(project_root, chain.from_iterable(res["rows"] for _, res in loaded),
+                                         mode=mode, key=key_cols, schema=schema)
+        except localdb.ManagedIndexError as e:
+            raise IngestError(409, {"error":"DuplicateKeys","message":str(e)})
+        known = {}
+        for i, res in loaded:
+            name, data = files[i]
+            obj = aws.put_bytes(data, filename=name)
+            known[obj.key] = (obj.size, obj.mtime_ns, obj.sha256, res["facts"])
+            statuses[i] = {"file": name, "status": 200, "rows_inserted": len(res["rows"]),
+                           "stored": str(obj.path.relative_to(project_root))}
+            if i in hashes:
+                statuses[i]["content_hash"] = hashes[i]
+        marker_path = aws.trigger_glue_crawler("bills_crawler", known=known, keys=known)
+        if hashes:
+            marker = str(marker_path.relative_to(project_root))  # recorded in the /upload result shape
+            localdb.record_ingests(project_root, [
+                (hashes[i], statuses[i]["file"], {"status":"ok", "stored": statuses[i]["stored"],
+                                                  "crawler_marker": marker, "rows_inserted": statuses[i]["rows_inserted"]})
+                for i, _ in loaded])
+
+    failed = sum(1 for st in statuses if st["status"] != 200)
+    seconds = time.perf_counter() - started
+    result = {
+        "status": "ok" if not failed else ("partial" if failed < len(files) else "failed"),
+        "files_total": len(files),
+        "files_loaded": len(loaded),
+        "files_skipped": sum(1 for st in statuses if st.get("skipped")),
+        "files_failed": failed,
+        "rows_inserted": inserted,
+        "crawler_marker": str(marker_path.relative_to(project_root)) if marker_path else None,
+        "seconds": round(seconds, 4),
+        "files_per_s": round(len(files) / seconds, 1) if seconds > 0 else None,
+        "files": statuses,
+    }
+    if schema is not BILLS:
+        result.update({"schema": schema.name, "table": schema.table})
+    return result
@@ -0,0 +1,109 @@
+import shutil, threading, time, uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from .executor import BoundedExecutor
+from .ingest import IngestError
+
+@dataclass
+class Job:
+    """One background ingest. Progress counters are written by the worker thread and
+    read by GET /jobs/{id}; plain int assignments, so no lock is needed. While the job
+    runs, rows_inserted counts rows handed to the (still open) load transaction; it ends
+    as the committed count: the result's on success, 0 on failure (rolled back)."""
+    id: str
+    filename: str
+    status: str = "queued"  # queued -> running -> succeeded | failed
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    rows_validated: int = 0
+    rows_inserted: int = 0
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+    error_status: Optional[int] = None
+
+    def progress(self, rows_validated: int, rows_inserted: int) -> None:
+        self.rows_validated = rows_validated
+        self.rows_inserted = rows_inserted
+
+    def snapshot(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id, "filename": self.filename, "status": self.status,
+            "rows_validated": self.rows_validated, "rows_inserted": self.rows_inserted,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": round(self.rows_validated / elapsed, 1) if elapsed > 0 else None,
+            "queued_s": round((self.started_at or end) - self.created_at, 3),
+            "result": self.result, "error": self.error, "error_status": self.error_status,
+        }
+
+def spool_upload(fileobj: BinaryIO, spool_dir: Path) -> Path:
+    """Copy an upload out of the request's temp file so a job can outlive the request."""
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    path = spool_dir / f"{uuid.uuid4().hex}.csv"
+    fileobj.seek(0)
+    with path.open("wb") as out:
+        shutil.copyfileobj(fileobj, out, length=1024 * 1024)
+    return path
+
+class JobManager:
+    """Runs ingest work on a bounded pool of background workers and keeps the last
+    `history` jobs for status polling (oldest finished jobs are forgotten first)."""
+    def __init__(self, workers: int, queue: int, history: int):
+        self.pool = BoundedExecutor("jobs", workers, queue)
+        self.history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, filename: str, work: Callable[[Job], dict], cleanup: Callable[[], None] | None = None) -> Job:
+        """Queue work(job) -> result dict. cleanup runs after the job ends either way (and
+        right away if the pool rejects the job with ServerBusy)."""
+        job = Job(id=uuid.uuid4().hex, filename=filename)
+        try:
+            self.pool.submit(self._run, job, work, cleanup)
+        except BaseException:
+            if cleanup: cleanup()
+            raise
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def _run(self, job: Job, work: Callable[[Job], dict], cleanup: Callable[[], None] | None) -> None:
+        job.status, job.started_at = "running", time.time()
+        try:
+            job.result = work(job)
+            job.rows_inserted = job.result.get("rows_inserted", job.rows_inserted)
+            job.status = "succeeded"
+        except IngestError as e:
+            job.status, job.error, job.error_status = "failed", e.body, e.status_code
+            job.rows_inserted = 0
+        except Exception as e:
+            job.status, job.error, job.error_status = "failed", {"error":"InternalError","message":str(e)}, 500
+            job.rows_inserted = 0
+        finally:
+            job.finished_at = time.time()
+            if cleanup: cleanup()
+
+    def _trim(self) -> None:
+        excess = len(self._jobs) - self.history
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status: dict = {}
+            for j in self._jobs.values():
+                by_status[j.status] = by_status.get(j.status, 0) + 1
+        return {**self.pool.stats(), "jobs": by_status}
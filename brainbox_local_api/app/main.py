@@ -1,11 +1,25 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, UploadFile, File, Request, Query
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Union
+import sqlite3, threading
 
-from .validators import parse_csv, validate_header_exact, validate_basic_types
 from .services import LocalMockAws
 from . import db as localdb
+from .dates import DATE_CACHE
+from .query_cache import QueryCache
+from .compression import SUFFIXES, codec_for, is_csv_name
+from .formats import NDJSON, FORMATS, available, dumps, negotiate, query_response
+from .pool import close_all as close_all_pools
+from . import parallel
+from .executor import BoundedExecutor, ServerBusy
+from .ingest import (DEFAULT_SAMPLE, IngestError, check_csv, check_stored, complete_multipart, ingest_batch, ingest_csv,
+                     ingest_stored, load_options, schema_option, validate_options, validated)
+from .settings import settings
+from .jobs import JobManager, spool_upload
 
 app = FastAPI(title="BrainBox QA Local API v4", version="1.0.0")
 
@@ -13,80 +27,322 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 aws = LocalMockAws(PROJECT_ROOT)
 localdb.init_db(PROJECT_ROOT)  # ensure DB/table on startup
 
+# Blocking work (sqlite3, file I/O, CSV parsing) runs on these pools, never on the event
+# loop; separate pools keep small queries responsive while large uploads are loading.
+ingest_pool = BoundedExecutor("ingest", settings.ingest_workers, settings.ingest_queue)
+query_pool = BoundedExecutor("query", settings.query_workers, settings.query_queue)
+jobs = JobManager(settings.job_workers, settings.job_queue, settings.job_history)
+JOB_SPOOL_DIR = PROJECT_ROOT / "local_state" / "jobs"
+ACCEPTED_MESSAGE = f"Only {', '.join(SUFFIXES)} accepted."
+
+stream_slots = threading.BoundedSemaphore(settings.max_streams)
+query_cache = (QueryCache(settings.query_cache_entries, settings.query_cache_ttl_s, settings.query_cache_max_bytes)
+               if settings.query_cache_entries > 0 else None)
+
 class QueryIn(BaseModel):
     sql: str
+    params: List[Union[int, float, str, None]] = []  # values for the ? placeholders in sql
+    max_rows: Optional[int] = Field(None, ge=1)  # defaults: settings.query_max_rows (json) / stream_max_rows (ndjson)
+
+def _stream_release(rows: localdb.RowStream) -> Callable[[], None]:
+    """Close the stream's connection and free its stream_slots slot, once. It runs from the
+    NDJSON generator's finally and as the response's background task, so the slot comes
+    back even when the client goes away before the generator is first stepped."""
+    released = threading.Lock()
+    def release() -> None:
+        if released.acquire(blocking=False):
+            rows.close()
+            stream_slots.release()
+    return release
+
+def _ndjson(cols: List[str], batches: localdb.RowStream, release: Callable[[], None]) -> Iterator[bytes]:
+    """{"columns": [...]}, then one JSON array per row, then {"rowcount": n}. One line
+    buffer per fetch batch, so memory stays flat whatever the result size."""
+    rowcount = 0
+    try:
+        yield dumps({"columns": cols}) + b"\n"
+        for batch in batches:
+            rowcount += len(batch)
+            yield b"".join(dumps(row) + b"\n" for row in batch)
+        yield dumps({"rowcount": rowcount}) + b"\n"
+    except Exception as e:  # headers are already sent; report in-band
+        yield dumps({"error":"QueryError","message": str(e), "rowcount": rowcount}) + b"\n"
+    finally:
+        release()
+
+@app.exception_handler(ServerBusy)
+async def server_busy_handler(request: Request, e: ServerBusy):
+    return JSONResponse(status_code=503, headers={"Retry-After": str(settings.busy_retry_after_s)},
+                        content={"error":"ServerBusy","message":str(e)})
+
+@app.exception_handler(localdb.PartitionedLayoutError)
+async def partitioned_layout_handler(request: Request, e: localdb.PartitionedLayoutError):
+    return JSONResponse(status_code=409, content={"error":"UnsupportedLayout","message":str(e)})
+
+@app.exception_handler(IngestError)
+async def ingest_error_handler(request: Request, e: IngestError):
+    return JSONResponse(status_code=e.status_code, content=e.body)
 
 @app.get("/health")
 def health():
     return {"status":"ok"}
 
+@app.on_event("shutdown")
+def close_db_pools():
+    jobs.shutdown()
+    ingest_pool.shutdown()
+    query_pool.shutdown()
+    parallel.shutdown()
+    close_all_pools()
+
+@app.get("/stats")
+def stats():
+    return {"date_cache": DATE_CACHE.stats(), "db_pool": localdb.pool_for(PROJECT_ROOT).stats(),
+            "ingest_pool": ingest_pool.stats(), "query_pool": query_pool.stats(), "jobs": jobs.stats(),
+            "query_cache": query_cache.stats() if query_cache else None, "validation_cache": validated.stats()}
+
 @app.post("/validate")
 @app.post("/validate/")
-async def validate(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".csv"):
-        return JSONResponse(status_code=415, content={"error":"InvalidFileType","message":"Only .csv accepted."})
+async def validate(file: UploadFile = File(...), mode: str = "full", sample: int = DEFAULT_SAMPLE,
+                   schema: str | None = None):
+    if not is_csv_name(file.filename):
+        return JSONResponse(status_code=415, content={"error":"InvalidFileType","message":ACCEPTED_MESSAGE})
+    validate_options(mode, sample)
+    table_schema = schema_option(schema)
+    return await ingest_pool.run(check_csv, file.file, codec_for(file.filename), mode, sample, table_schema)
+
+@app.post("/upload")
+@app.post("/upload/")
+async def upload(file: UploadFile = File(...), async_: bool = Query(False, alias="async"),
+                 mode: str | None = None, key: str | None = None, bulk: bool = False,
+                 validation_token: str | None = None, schema: str | None = None):
+    if not is_csv_name(file.filename):
+        return JSONResponse(status_code=415, content={"error":"InvalidFileType","message":ACCEPTED_MESSAGE})
+    table_schema = schema_option(schema)
+    load_options(mode, key, table_schema)  # reject bad mode/key before doing any work
+    if not async_:
+        return await ingest_pool.run(ingest_csv, PROJECT_ROOT, aws, file.file, file.filename, mode=mode, key=key,
+                                     bulk=bulk, validation_token=validation_token, schema=table_schema)
+
+    # Async ingest: spool the upload, hand it to a background worker, answer with a job id
+    spool_path = await run_in_threadpool(spool_upload, file.file, JOB_SPOOL_DIR)
+    filename = file.filename
+
+    def work(job):
+        with spool_path.open("rb") as stream:
+            return ingest_csv(PROJECT_ROOT, aws, stream, filename, progress=job.progress, mode=mode, key=key,
+                              bulk=bulk, validation_token=validation_token, schema=table_schema)
+
+    job = jobs.submit(filename, work, cleanup=lambda: spool_path.unlink(missing_ok=True))
+    return JSONResponse(status_code=202, content={"status":"accepted","job_id": job.id,"status_url": f"/jobs/{job.id}"})
+
+@app.post("/upload/batch")
+@app.post("/upload/batch/")
+async def upload_batch(files: List[UploadFile] = File(...), mode: str | None = None, key: str | None = None,
+                       schema: str | None = None):
+    table_schema = schema_option(schema)
+    load_options(mode, key, table_schema)
+    return await ingest_pool.run(ingest_batch, PROJECT_ROOT, aws, [(f.filename, f.file) for f in files],
+                                 mode=mode, key=key, schema=table_schema)
+
+@app.get("/jobs/{job_id}")
+@app.get("/jobs/{job_id}/")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error":"JobNotFound","message":f"No job with id {job_id}."})
+    return job.snapshot()
+
+@app.get("/uploads")
+@app.get("/uploads/")
+async def uploads_list():
+    return {"objects": await run_in_threadpool(aws.list_objects)}
+
+@app.post("/uploads/{name}/validate")
+@app.post("/uploads/{name}/validate/")
+async def uploads_validate(name: str, mode: str = "full", sample: int = DEFAULT_SAMPLE, schema: str | None = None):
+    validate_options(mode, sample)
+    return await ingest_pool.run(check_stored, aws, name, mode, sample, schema_option(schema))
+
+@app.post("/uploads/{name}/ingest")
+@app.post("/uploads/{name}/ingest/")
+async def uploads_ingest(name: str, mode: str | None = None, key: str | None = None, bulk: bool = False,
+                         schema: str | None = None):
+    table_schema = schema_option(schema)
+    load_options(mode, key, table_schema)
+    return await ingest_pool.run(ingest_stored, PROJECT_ROOT, aws, name, mode=mode, key=key, bulk=bulk,
+                                 schema=table_schema)
+
+@app.post("/uploads/{name}/multipart")
+@app.post("/uploads/{name}/multipart/")
+async def multipart_create(name: str):
     try:
-        content = await file.read()
-        header, rows = parse_csv(content)
-    except UnicodeDecodeError:
-        return JSONResponse(status_code=400, content={"error":"InvalidEncoding","message":"CSV must be UTF-8."})
+        upload_id = await run_in_threadpool(aws.create_multipart_upload, name)
     except ValueError as e:
-        return JSONResponse(status_code=400, content={"error":"InvalidCSV","message":str(e)})
+        return JSONResponse(status_code=400, content={"error":"InvalidObjectKey","message":str(e)})
+    return {"key": name, "upload_id": upload_id}
 
-    ok_schema, info = validate_header_exact(header)
-    if not ok_schema:
-        return JSONResponse(status_code=422, content={"error":"InvalidSchema", **info})
+@app.put("/uploads/{name}/multipart/{upload_id}/parts/{part_number}")
+@app.put("/uploads/{name}/multipart/{upload_id}/parts/{part_number}/")
+async def multipart_part(name: str, upload_id: str, part_number: int, file: UploadFile = File(...)):
+    try:
+        return await ingest_pool.run(aws.upload_part, name, upload_id, part_number, file.file)
+    except LookupError as e:
+        return JSONResponse(status_code=404, content={"error":"NoSuchUpload","message":str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error":"InvalidPart","message":str(e)})
+
+@app.post("/uploads/{name}/multipart/{upload_id}/complete")
+@app.post("/uploads/{name}/multipart/{upload_id}/complete/")
+async def multipart_complete(name: str, upload_id: str):
+    try:
+        return await ingest_pool.run(complete_multipart, PROJECT_ROOT, aws, name, upload_id)
+    except LookupError as e:
+        return JSONResponse(status_code=404, content={"error":"NoSuchUpload","message":str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error":"InvalidPart","message":str(e)})
 
-    ok_types, tinfo = validate_basic_types(rows)
-    if not ok_types:
-        return JSONResponse(status_code=422, content={"error":"InvalidType", **tinfo})
+@app.delete("/uploads/{name}/multipart/{upload_id}")
+@app.delete("/uploads/{name}/multipart/{upload_id}/")
+async def multipart_abort(name: str, upload_id: str):
+    try:
+        await run_in_threadpool(aws.abort_multipart_upload, name, upload_id)
+    except LookupError as e:
+        return JSONResponse(status_code=404, content={"error":"NoSuchUpload","message":str(e)})
+    return {"status":"aborted","upload_id": upload_id}
 
-    return {"message":"CSV file is valid.","columns": header, "rows_checked": min(100, len(rows))}
+@app.get("/db/indexes")
+@app.get("/db/indexes/")
+async def db_indexes():
+    return {"table": localdb.TABLE_NAME, "indexes": await query_pool.run(localdb.list_indexes, PROJECT_ROOT)}
 
-@app.post("/upload")
-@app.post("/upload/")
-async def upload(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".csv"):
-        return JSONResponse(status_code=415, content={"error":"InvalidFileType","message":"Only .csv accepted."})
+@app.post("/db/indexes/{name}")
+@app.delete("/db/indexes/{name}")
+async def db_index_change(name: str, request: Request):
+    change = localdb.create_index if request.method == "POST" else localdb.drop_index
+    try:
+        await ingest_pool.run(change, PROJECT_ROOT, name)
+    except LookupError as e:
+        return JSONResponse(status_code=404, content={"error":"IndexNotFound","message":str(e)})
+    except localdb.ManagedIndexError as e:
+        return JSONResponse(status_code=409, content={"error":"IndexConflict","message":str(e)})
+    return {"table": localdb.TABLE_NAME, "indexes": await query_pool.run(localdb.list_indexes, PROJECT_ROOT)}
+
+@app.post("/db/migrate")
+@app.post("/db/migrate/")
+async def db_migrate(date_storage: Optional[str] = Query(None, pattern="^(text|epoch_days)$"),
+                     layout: Optional[str] = Query(None, pattern="^(table|partitioned)$")):
+    if (date_storage is None) == (layout is None):
+        return JSONResponse(status_code=400, content={"error":"InvalidMigration","message":"Pass either date_storage or layout."})
+    try:
+        if layout is not None:
+            return await ingest_pool.run(localdb.migrate_layout, PROJECT_ROOT, layout)
+        return await ingest_pool.run(localdb.migrate_date_storage, PROJECT_ROOT, date_storage)
+    except (sqlite3.IntegrityError, ValueError) as e:
+        return JSONResponse(status_code=409, content={"error":"MigrationFailed","message":str(e)})
+
+@app.get("/db/partitions")
+@app.get("/db/partitions/")
+async def db_partitions():
+    return {"layout": await query_pool.run(localdb.storage_layout, PROJECT_ROOT),
+            "partitions": await query_pool.run(localdb.list_partitions, PROJECT_ROOT)}
+
+@app.delete("/db/partitions/{month}")
+async def db_partition_drop(month: str):
+    try:
+        dropped = await ingest_pool.run(localdb.drop_partition, PROJECT_ROOT, month)
+    except LookupError as e:
+        return JSONResponse(status_code=404, content={"error":"PartitionNotFound","message":str(e)})
+    return {"month": month, "rows_deleted": dropped}
+
+@app.post("/db/dedupe")
+@app.post("/db/dedupe/")
+async def db_dedupe(key: str | None = None):
     try:
-        content = await file.read()
-        header, rows = parse_csv(content)
-    except UnicodeDecodeError:
-        return JSONResponse(status_code=400, content={"error":"InvalidEncoding","message":"CSV must be UTF-8."})
+        key_cols = localdb.parse_key(key)
     except ValueError as e:
-        return JSONResponse(status_code=400, content={"error":"InvalidCSV","message":str(e)})
+        return JSONResponse(status_code=400, content={"error":"InvalidKey","message":str(e)})
+    deleted = await ingest_pool.run(localdb.dedupe, PROJECT_ROOT, key_cols)
+    return {"key": list(key_cols), "rows_deleted": deleted}
+
+@app.get("/rollups")
+@app.get("/rollups/")
+async def rollups(building_id: Optional[int] = None, usage_type: Optional[str] = None,
+                  month_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+                  month_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$")):
+    groups = await query_pool.run(localdb.query_rollups, PROJECT_ROOT, building_id, usage_type, month_from, month_to)
+    return {"table": localdb.ROLLUP_TABLE, "rollups": groups, "rowcount": len(groups)}
 
-    ok_schema, info = validate_header_exact(header)
-    if not ok_schema:
-        return JSONResponse(status_code=422, content={"error":"InvalidSchema", **info})
+@app.post("/rollups/rebuild")
+@app.post("/rollups/rebuild/")
+async def rollups_rebuild():
+    return {"table": localdb.ROLLUP_TABLE, "groups": await ingest_pool.run(localdb.rebuild_rollups, PROJECT_ROOT)}
 
-    ok_types, tinfo = validate_basic_types(rows)
-    if not ok_types:
-        return JSONResponse(status_code=422, content={"error":"InvalidType", **tinfo})
+@app.get("/catalog")
+@app.get("/catalog/")
+async def catalog_files(date_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                        date_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                        valid: Optional[bool] = None):
+    files = await query_pool.run(aws.catalog.files, date_from, date_to, valid)
+    return {"files": files, "count": len(files), "last_run": await run_in_threadpool(aws.catalog.last_run, "bills_crawler")}
 
-    # Save CSV & simulate Glue
-    saved_path = aws.put_csv(content, filename=file.filename)
-    marker_path = aws.trigger_glue_crawler("bills_crawler")
+@app.get("/catalog/{name}")
+@app.get("/catalog/{name}/")
+async def catalog_entry(name: str):
+    entry = await query_pool.run(aws.catalog.entry, name)
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error":"NoSuchKey","message":f"{name!r} is not cataloged."})
+    return entry
 
-    # Load into SQLite (bills_db.custom_csv)
-    localdb.init_db(PROJECT_ROOT)
-    inserted = localdb.load_rows(PROJECT_ROOT, rows)
+@app.post("/catalog/crawl")
+@app.post("/catalog/crawl/")
+async def catalog_crawl():
+    marker = await ingest_pool.run(aws.trigger_glue_crawler, "bills_crawler")
+    return {"crawler_marker": str(marker.relative_to(PROJECT_ROOT)),
+            **await run_in_threadpool(aws.catalog.last_run, "bills_crawler")}
 
-    return {
-        "status":"ok",
-        "stored": str(saved_path.relative_to(PROJECT_ROOT)),
-        "crawler_marker": str(marker_path.relative_to(PROJECT_ROOT)),
-        "rows_inserted": inserted
-    }
+async def _stream_query(sql: str, params: List, max_rows: Optional[int]):
+    if not stream_slots.acquire(blocking=False):
+        raise ServerBusy("stream")
+    try:
+        cols, batches = await query_pool.run(localdb.stream_select, PROJECT_ROOT, sql,
+                                             max_rows=max_rows, params=params)
+    except Exception as e:
+        stream_slots.release()
+        if isinstance(e, ServerBusy):
+            raise
+        return JSONResponse(status_code=400, content={"error":"QueryError","message": str(e)})
+    except BaseException:  # cancelled while waiting
+        stream_slots.release()
+        raise
+    release = _stream_release(batches)
+    return StreamingResponse(_ndjson(cols, batches, release), media_type=NDJSON, background=BackgroundTask(release))
 
 @app.post("/athena/query")
 @app.post("/athena/query/")
-async def athena_query(q: QueryIn):
-    sql = q.sql.strip().rstrip(";")
-    if not sql.lower().startswith("select"):
+async def athena_query(q: QueryIn, request: Request, format: Optional[str] = None):
+    sql = localdb.select_statement(q.sql)
+    if sql is None:
         return JSONResponse(status_code=400, content={"error":"OnlySelectAllowed","message":"Only SELECT statements are allowed."})
+    media_type = negotiate(format, request.headers.get("accept", ""))
+    if media_type is None or not available(media_type):
+        return JSONResponse(status_code=406, content={"error":"NotAcceptable","message":
+            f"Unsupported or unavailable format {format!r}; available: "
+            f"{[name for name, mt in FORMATS.items() if available(mt)]}."})
+    if media_type == NDJSON:
+        return await _stream_query(sql, q.params, q.max_rows or settings.stream_max_rows or None)
+    max_rows = min(q.max_rows or settings.query_max_rows, settings.query_max_rows)
+    version = localdb.table_version(PROJECT_ROOT)  # read before running: a racing load makes the entry unreachable
+    cached = query_cache.get(sql, q.params, max_rows, version) if query_cache else None
     try:
-        cols, rows = localdb.run_select(PROJECT_ROOT, sql, max_rows=1000)
-        return {"columns": cols, "rows": rows, "rowcount": len(rows)}
+        if cached is not None:
+            return query_response(media_type, *cached)
+        cols, rows = await query_pool.run(localdb.run_select, PROJECT_ROOT, sql, max_rows=max_rows, params=q.params)
+        response = query_response(media_type, cols, rows)
+    except ServerBusy:
+        raise
     except Exception as e:
         return JSONResponse(status_code=400, content={"error":"QueryError","message": str(e)})
+    if query_cache:
+        query_cache.put(sql, q.params, max_rows, version, (cols, rows))
+    return response
@@ -0,0 +1,189 @@
+import csv, io, mmap, multiprocessing, os, shutil, tempfile, threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Callable, Deque, Iterator, List, Optional, Tuple
+
+from .schemas import BILLS, Row, Schema
+from .settings import settings
+from .validators import TypeChecker, RowValidationError, iter_records, to_canonical, too_many_fields
+
+def _workers() -> int:
+    return settings.parse_workers or os.cpu_count() or 1
+
+def use_parallel(stream: BinaryIO) -> bool:
+    """Large enough (settings.parallel_min_bytes) and more than one worker configured."""
+    if _workers() < 2:
+        return False
+    pos = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(pos)
+    return size >= settings.parallel_min_bytes
+
+@contextmanager
+def file_path(stream: BinaryIO) -> Iterator[Path]:
+    """A path the worker processes can open: the stream's own file when it has one
+    (spooled async jobs), else a temporary copy that is removed afterwards."""
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        yield Path(name)
+        return
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="brainbox-parse-", suffix=".csv") as tmp:
+        shutil.copyfileobj(stream, tmp, 1024 * 1024)
+        tmp.flush()
+        yield Path(tmp.name)
+    stream.seek(0)
+
+def record_boundaries(mm: mmap.mmap, start: int, chunk_bytes: int) -> List[int]:
+    """Offsets that split mm[start:] into ~chunk_bytes ranges, each cut just after a newline
+    that lies outside quotes. With RFC 4180 quoting ("" escapes a quote) a position is
+    outside quotes exactly when the number of '"' bytes before it is even, so one counting
+    pass at memchr speed finds the cuts without parsing. `start` must be a record start."""
+    size = len(mm)
+    cuts = [start]
+    pos, quotes = start, 0
+    while cuts[-1] + chunk_bytes < size:
+        target = cuts[-1] + chunk_bytes
+        quotes += mm[pos:target].count(b'"')
+        pos, quotes = _record_end(mm, target, quotes)
+        if pos >= size:
+            break
+        cuts.append(pos)
+    cuts.append(size)
+    return cuts
+
+def _record_end(mm: mmap.mmap, pos: int, quotes: int) -> Tuple[int, int]:
+    """(offset just past the first newline at or after pos with an even quote count before
+    it, updated count); len(mm) when there is none. `quotes` counts '"' before pos."""
+    while True:
+        nl = mm.find(b"\n", pos)
+        if nl < 0:
+            return len(mm), quotes
+        quotes += mm[pos:nl].count(b'"')
+        pos = nl + 1
+        if quotes % 2 == 0:
+            return pos, quotes
+
+def _check_range(path: str, start: int, end: int, header: List[str], keep_rows: bool,
+                 schema: Schema = BILLS) -> dict:
+    """Worker: parse and type-check path[start:end] (whole records) against schema. Row
+    numbers in errors and the line number of a fatal error are relative to the range."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    try:
+        text = data.decode("utf-8")  # ranges end after b"\n", never inside a UTF-8 sequence
+    except UnicodeDecodeError as e:
+        return {"fatal": ("encoding", str(e))}
+    reader = csv.reader(io.StringIO(text, newline=""))
+    rows = iter(to_canonical(header, iter_records(reader, len(header)), schema))
+    checker = TypeChecker(schema=schema)
+    kept: List[Row] = []
+    try:
+        while True:
+            batch = list(islice(rows, checker.batch_size))
+            if not batch:
+                break
+            batch = checker.check(batch)
+            if keep_rows and checker.ok:
+                kept.extend(batch)
+    except ValueError:
+        return {"fatal": ("fields", reader.line_num)}
+    return {"fatal": None, "rows": checker.rows_checked, "lines": reader.line_num,
+            "error_count": checker.error_count, "errors": checker.errors, "date_ranges": checker.date_ranges,
+            "rewritten_batches": checker.rewritten_batches,
+            "data": kept if keep_rows and checker.ok else None}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # forkserver: workers are not forked from a process that has server threads running
+            _executor = ProcessPoolExecutor(_workers(), mp_context=multiprocessing.get_context("forkserver"))
+        return _executor
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+def map_ordered(fn: Callable, items: List) -> Iterator:
+    """fn over items, results in item order: on the worker processes (in chunks, so many
+    small items do not each pay a round trip) when more than one worker is configured,
+    inline otherwise. fn must be a module-level function."""
+    workers = _workers()
+    if workers < 2 or len(items) < 2:
+        return map(fn, items)
+    return _get_executor().map(fn, items, chunksize=max(1, len(items) // (4 * workers)))
+
+class ParallelCsv:
+    """Parallel counterpart of iter_csv + TypeChecker.iter_checked for one file on disk.
+    The header is read here; the body is cut at record boundaries into chunk_bytes ranges
+    that worker processes parse and check. Results are merged in file order, so rows come
+    out in the original order and error rows/lines are numbered for the whole file. At
+    most 2 x workers ranges are in flight, which bounds memory."""
+    def __init__(self, path: Path, chunk_bytes: int = settings.parse_chunk_bytes, schema: Schema = BILLS):
+        self.path = str(path)
+        self.chunk_bytes = chunk_bytes
+        self.schema = schema
+        self.checker = TypeChecker(schema=schema)
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end, _ = _record_end(mm, 0, 0)
+            head = mm[:header_end].decode("utf-8")
+            raw_header = next(csv.reader(io.StringIO(head, newline="")), None)
+            if raw_header is None:
+                raise ValueError("InvalidCSV: No header found")
+            self.header = [h.strip() for h in raw_header]
+            self.header_lines = head.count("\n")
+            cuts = record_boundaries(mm, header_end, chunk_bytes)
+            self.ranges = list(zip(cuts, cuts[1:]))
+
+    @property
+    def rows_checked(self) -> int:
+        return self.checker.rows_checked
+
+    def iter_checked(self, progress: Callable[[int, int], None] | None = None,
+                     keep_rows: bool = True) -> Iterator[Row]:
+        """Canonical, type-checked rows (self.header must have passed validate_header_exact
+        for self.schema). Raises like the sequential path: ValueError / UnicodeDecodeError
+        on malformed input, RowValidationError at the end when any cell failed.
+        keep_rows=False only checks."""
+        executor = _get_executor()
+        ranges = iter(self.ranges)
+        pending: Deque[Future] = deque()
+        def refill() -> None:
+            for start, end in islice(ranges, 2 * _workers() - len(pending)):
+                pending.append(executor.submit(_check_range, self.path, start, end, self.header,
+                                               keep_rows, self.schema))
+        lines, yielded = self.header_lines, 0
+        try:
+            refill()
+            while pending:
+                res = pending.popleft().result()
+                refill()
+                if res["fatal"]:
+                    kind, detail = res["fatal"]
+                    if kind == "encoding":
+                        raise UnicodeDecodeError("utf-8", b"", 0, 1, detail)
+                    raise too_many_fields(lines + detail)
+                lines += res["lines"]
+                self.checker.merge(res["rows"], res["error_count"], res["errors"], res["date_ranges"],
+                                   res["rewritten_batches"])
+                if progress: progress(self.checker.rows_checked, yielded)
+                if self.checker.ok and keep_rows:
+                    yield from res["data"]
+                    yielded += res["rows"]
+                    if progress: progress(self.checker.rows_checked, yielded)
+        finally:
+            for fut in pending:
+                fut.cancel()
+        if not self.checker.ok:
+            raise RowValidationError(self.checker.result()[1])
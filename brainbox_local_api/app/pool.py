@@ -0,0 +1,114 @@
+import sqlite3, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .settings import settings
+
+class ConnectionPool:
+    """Long-lived connections to one SQLite file: a lazily opened reader per thread and a
+    single writer connection behind a lock. The file is switched to WAL on first use so
+    readers never block on the writer (or each other). Readers are query_only, and every
+    connection keeps `statement_cache` prepared statements, so repeating the same SQL text
+    skips parsing and planning."""
+    def __init__(self, db_path: Path, synchronous: str = settings.sqlite_synchronous,
+                 cache_size: int = settings.sqlite_cache_size, mmap_size: int = settings.sqlite_mmap_size,
+                 temp_store: str = settings.sqlite_temp_store, busy_timeout_ms: int = settings.sqlite_busy_timeout_ms,
+                 statement_cache: int = settings.sqlite_statement_cache,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.db_path = db_path
+        self.on_connect = on_connect
+        self.statement_cache = statement_cache
+        self.pragmas = {"synchronous": synchronous, "cache_size": cache_size,
+                        "mmap_size": mmap_size, "temp_store": temp_store, "busy_timeout": busy_timeout_ms}
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._writer = self._connect()
+        self.journal_mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        self.writer_acquisitions = 0
+        self.writer_wait_s = 0.0
+        self.streams_opened = 0
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=self.statement_cache,
+                               timeout=self.pragmas["busy_timeout"] / 1000)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read connection (opened on first use, then reused)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect(read_only=True)
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def open_stream(self) -> sqlite3.Connection:
+        """A private connection for one streamed result set. It may be stepped from any
+        thread (a streaming response hops between threadpool threads) and must be closed
+        by the caller when the stream ends."""
+        self.streams_opened += 1
+        return self._connect(read_only=True)
+
+    @contextmanager
+    def writer(self, synchronous: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+        """Exclusive use of the writer connection; commits on success, rolls back on error.
+        `synchronous` overrides the pool's level for this block only (it cannot change
+        inside a transaction, so it is set before and restored after the commit)."""
+        t0 = time.perf_counter()
+        with self._writer_lock:
+            self.writer_wait_s += time.perf_counter() - t0
+            self.writer_acquisitions += 1
+            if synchronous:
+                self._writer.execute(f"PRAGMA synchronous={synchronous}")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+            finally:
+                if synchronous:
+                    self._writer.execute(f"PRAGMA synchronous={self.pragmas['synchronous']}")
+
+    def close(self) -> None:
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._writer_lock:
+            self._writer.close()
+
+    def stats(self) -> dict:
+        return {"db_path": str(self.db_path), "journal_mode": self.journal_mode, "pragmas": self.pragmas,
+                "statement_cache": self.statement_cache,
+                "reader_connections": len(self._readers), "writer_acquisitions": self.writer_acquisitions,
+                "writer_wait_ms": round(self.writer_wait_s * 1000, 3), "writer_busy": self._writer_lock.locked(),
+                "streams_opened": self.streams_opened}
+
+_pools: Dict[Path, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: Path, on_connect: Optional[Callable[[sqlite3.Connection], None]] = None) -> ConnectionPool:
+    """The process-wide pool for db_path (on_connect only applies when it is created)."""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = _pools[db_path] = ConnectionPool(db_path, on_connect=on_connect)
+    return pool
+
+def close_all() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,63 @@
+import re, sys, threading
+from functools import lru_cache
+from typing import Any, Hashable, List, Optional, Sequence, Tuple
+
+from .cache import LRUCache
+
+# string literals, quoted identifiers and comments are kept verbatim (a -- comment with the
+# line break that ends it, so text after it stays out of the comment); whitespace elsewhere collapses
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]"
+                         r"|--[^\n]*(?:\n|\Z)|/\*.*?(?:\*/|\Z)|\s+|(?:[^'\"`\[\s/-]|/(?!\*)|-(?!-))+|.", re.S)
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Cache key form of a statement: runs of whitespace outside quotes and comments become
+    one space. Case is kept: SQLite derives result column names from the statement text."""
+    parts = []
+    for tok in _SQL_TOKENS.findall(sql.strip()):
+        parts.append(" " if tok.isspace() else tok)
+    return "".join(parts)
+
+def _result_size(result: Tuple[List[str], List[tuple]]) -> int:
+    """Rough in-memory size of (columns, rows) in bytes."""
+    cols, rows = result
+    size = sys.getsizeof(cols) + sum(sys.getsizeof(c) for c in cols) + sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+    return size
+
+class QueryCache:
+    """In-process /athena/query result cache: LRU + TTL + memory cap, keyed on normalized
+    SQL, its bound params and the row cap. Every key also carries the custom_csv table version the result was
+    read at; when load_rows bumps the version, older entries can no longer be hit and the
+    whole cache is dropped on the next lookup."""
+    def __init__(self, maxsize: int, ttl_s: float, max_bytes: int):
+        self._lru = LRUCache(maxsize, ttl_s=ttl_s or None, max_bytes=max_bytes, sizeof=_result_size)
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def _sync(self, version: int) -> None:
+        with self._lock:
+            if self._version != version:
+                if self._version is not None and len(self._lru):
+                    self._lru.clear()
+                    self.invalidations += 1
+                self._version = version
+
+    @staticmethod
+    def key(sql: str, params: Sequence[Any], max_rows: Optional[int], version: int) -> Hashable:
+        return (normalize_sql(sql), tuple(params), max_rows, version)
+
+    def get(self, sql: str, params: Sequence[Any], max_rows: Optional[int],
+            version: int) -> Optional[Tuple[List[str], List[tuple]]]:
+        self._sync(version)
+        return self._lru.get(self.key(sql, params, max_rows, version))
+
+    def put(self, sql: str, params: Sequence[Any], max_rows: Optional[int], version: int,
+            result: Tuple[List[str], List[tuple]]) -> None:
+        if version == self._version:  # a load committed meanwhile: the result may be stale already
+            self._lru.put(self.key(sql, params, max_rows, version), result)
+
+    def stats(self) -> dict:
+        return {**self._lru.stats(), "invalidations": self.invalidations, "table_version": self._version}
@@ -1,8 +1,115 @@
-REQUIRED_COLUMNS = [
-    "bill_id",
-    "meter_id",
-    "usage_type",
-    "building_id",
-    "start_date",
-    "end_date",
-]
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Rows travel through parsing, validation and executemany as plain tuples in the
+# schema's column order (see validators.to_canonical); no per-row dicts.
+Row = Tuple[str, ...]
+
+COLUMN_TYPES = ("string", "integer", "date")
+
+@dataclass(frozen=True)
+class Column:
+    """One declared column. type is one of COLUMN_TYPES; an empty cell in a nullable
+    column is loaded as NULL instead of failing the type check."""
+    name: str
+    type: str = "string"
+    nullable: bool = False
+
+    def __post_init__(self):
+        if self.type not in COLUMN_TYPES:
+            raise ValueError(f"Column {self.name!r}: type must be one of {COLUMN_TYPES}, not {self.type!r}.")
+
+    def sql_type(self, date_storage: str = "text") -> str:
+        if self.type == "integer" or (self.type == "date" and date_storage == "epoch_days"):
+            return "INTEGER"
+        return "TEXT"
+
+class Schema:
+    """A declarative CSV/table layout, compiled once when it is built: column index, date
+    columns, the header check, the header -> canonical order converter (an itemgetter, so
+    reordering stays one C-level map over the rows) and the DDL / INSERT / UPSERT text.
+    The per-column type checks are compiled from it by validators.column_rules. Rows of
+    the layout load into `table` (default: the schema name)."""
+    def __init__(self, name: str, columns: Sequence[Column], table: Optional[str] = None):
+        names = [c.name for c in columns]
+        if not names or len(set(names)) != len(names):
+            raise ValueError(f"Schema {name!r} needs distinct, non-empty column names.")
+        self.name = name
+        self.table = table or name
+        self.columns: Tuple[Column, ...] = tuple(columns)
+        self.names: List[str] = names
+        self.index: Dict[str, int] = {n: i for i, n in enumerate(names)}
+        self.date_columns: Tuple[str, ...] = tuple(c.name for c in columns if c.type == "date")
+        self._names = frozenset(names)
+        self._placeholders = ", ".join("?" * len(names))
+
+    def __repr__(self) -> str:
+        return f"Schema({self.name!r}, {self.names})"
+
+    # equal by definition, so a copy unpickled on a parse worker shares its column_rules entry
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Schema) and (self.name, self.table, self.columns) == (other.name, other.table, other.columns)
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.table, self.columns))
+
+    def check_header(self, header: List[str]) -> Tuple[bool, dict]:
+        missing = [c for c in self.names if c not in header]
+        extra = [c for c in header if c not in self._names]
+        return not missing and not extra, {"missing": missing, "extra": extra}
+
+    def converter(self, header: List[str]) -> Optional[Callable[[Row], Row]]:
+        """Row reorderer from header order into schema order (header must have passed
+        check_header); None when the file is already in schema order."""
+        if header == self.names:
+            return None
+        return itemgetter(*[header.index(c) for c in self.names])
+
+    def ddl(self, table: str, date_storage: str = "text") -> str:
+        cols = ",\n            ".join(f"{c.name} {c.sql_type(date_storage)}{'' if c.nullable else ' NOT NULL'}"
+                                     for c in self.columns)
+        return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {cols}
+        )
+    """
+
+    def insert_sql(self, table: str) -> str:
+        return f"INSERT INTO {table} ({', '.join(self.names)}) VALUES ({self._placeholders})"
+
+    def upsert_sql(self, table: str, key: Sequence[str]) -> str:
+        updates = ", ".join(f"{c}=excluded.{c}" for c in self.names if c not in key)
+        return (f"{self.insert_sql(table)} ON CONFLICT ({', '.join(key)}) DO "
+                + (f"UPDATE SET {updates}" if updates else "NOTHING"))
+
+# name -> Schema, for ?schema= on the ingest endpoints. The parse workers are sent the
+# Schema itself, so a layout registered after import works there too.
+SCHEMAS: Dict[str, Schema] = {}
+
+def register_schema(schema: Schema) -> Schema:
+    if schema.name in SCHEMAS:
+        raise ValueError(f"Schema {schema.name!r} is already registered.")
+    if any(s.table == schema.table for s in SCHEMAS.values()):
+        raise ValueError(f"Table {schema.table!r} already belongs to another schema.")
+    SCHEMAS[schema.name] = schema
+    return schema
+
+def get_schema(name: str) -> Schema:
+    try:
+        return SCHEMAS[name]
+    except KeyError:
+        raise LookupError(f"No schema '{name}'; registered: {', '.join(SCHEMAS)}.") from None
+
+def schema_for_header(header: List[str]) -> Optional[Schema]:
+    """The first registered schema whose exact header this is, if any."""
+    return next((s for s in SCHEMAS.values() if s.check_header(header)[0]), None)
+
+BILLS = register_schema(Schema("bills", [
+    Column("bill_id", "string"),
+    Column("meter_id", "integer"),
+    Column("usage_type", "string"),
+    Column("building_id", "integer"),
+    Column("start_date", "date"),
+    Column("end_date", "date"),
+], table="custom_csv"))
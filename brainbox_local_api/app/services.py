@@ -1,23 +1,265 @@
+from dataclasses import dataclass
 from pathlib import Path
-import uuid, time
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+import hashlib, json, mmap, os, re, tempfile, uuid, shutil
+
+from .catalog import Catalog
+from .compression import CODEC_SUFFIX, check_codec, codec_for, compressed_writer, is_csv_name
+from .settings import settings
+
+FSYNC_POLICIES = ("none", "file", "full")
+COPY_CHUNK = 1024 * 1024
+MAX_PARTS = 10_000
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+_UMASK = os.umask(0)  # read once at import: mkstemp creates 0600, objects get the usual mode
+os.umask(_UMASK)
+
+class MappedFile:
+    """Read-only, file-like view of a file through mmap. read() returns memoryview slices
+    of the mapping, so the parser decodes straight from the page cache and the file is
+    never copied into Python bytes; getbuffer() lets hashlib.file_digest hash it in one
+    zero-copy pass. `name` is the path, for code that needs to reopen the file."""
+    def __init__(self, path: Path):
+        self.name = str(path)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None  # mmap rejects empty files
+        self._view = memoryview(self._mm) if self._mm is not None else memoryview(b"")
+        self._pos = 0
+
+    def read(self, size: int = -1) -> memoryview:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        chunk = self._view[self._pos:end]
+        self._pos = max(self._pos, end)
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def close(self) -> None:
+        self._view.release()
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:  # a slice is still referenced somewhere; the GC unmaps it later
+                pass
+
+    def __enter__(self) -> "MappedFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+@dataclass(frozen=True)
+class StoredObject:
+    key: str
+    path: Path
+    size: int
+    sha256: str
+    mtime_ns: int
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class AtomicWriter:
+    """Stage an object in a temp file (same filesystem as the destination), hashing the
+    bytes as they are written, then publish it with os.replace. Readers see the previous
+    object or the complete new one, never a torn file; of concurrent puts to one key the
+    last to commit wins. fsync: "none", "file" (data before the rename) or "full" (also
+    the directory entry after it). Leaving the with-block on an exception drops the temp file."""
+    def __init__(self, path: Path, staging: Path, fsync: str = settings.upload_fsync):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {list(FSYNC_POLICIES)}.")
+        self.path = path
+        self.fsync = fsync
+        self.size = 0
+        self._digest = hashlib.sha256()
+        staging.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".put-", suffix=".tmp", dir=staging)
+        self._tmp = Path(tmp)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data) -> None:
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+
+    def copy_from(self, fileobj: BinaryIO, chunk_size: int = COPY_CHUNK) -> None:
+        while chunk := fileobj.read(chunk_size):
+            self.write(chunk)
+
+    def commit(self) -> StoredObject:
+        self._file.flush()
+        if self.fsync != "none":
+            os.fsync(self._file.fileno())
+        os.fchmod(self._file.fileno(), 0o666 & ~_UMASK)
+        mtime_ns = os.fstat(self._file.fileno()).st_mtime_ns
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        if self.fsync == "full":
+            _fsync_dir(self.path.parent)
+        return StoredObject(self.path.name, self.path, self.size, self._digest.hexdigest(), mtime_ns)
+
+    def abort(self) -> None:
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+    def __enter__(self) -> "AtomicWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is not None:
+            self.abort()
+
+def object_files(root: Path) -> List[Path]:
+    """Stored objects directly under root (plain or compressed CSVs; staging dirs skipped)."""
+    return sorted(p for p in root.iterdir() if not p.name.startswith(".") and is_csv_name(p.name) and p.is_file())
 
 class LocalMockAws:
-    """Simulates S3 (uploads/) and Glue (glue/ markers)."""
+    """Simulates S3 (uploads/) and Glue (glue/catalog.sqlite, see app/catalog.py)."""
     def __init__(self, project_root: Path):
         self.project_root = project_root
         self.state_root = self.project_root / "local_state"
         self.uploads = self.state_root / "uploads"
         self.glue = self.state_root / "glue"
+        self.staging = self.uploads / ".staging"      # AtomicWriter temp files
+        self.multipart = self.uploads / ".multipart"  # <upload_id>/key + part-NNNNN files
         self.uploads.mkdir(parents=True, exist_ok=True)
         self.glue.mkdir(parents=True, exist_ok=True)
+        self._root = self.uploads.resolve()
+        check_codec(settings.upload_compression)
+        self.compression = settings.upload_compression
+        self.catalog = Catalog(self.glue / "catalog.sqlite")
 
     def put_csv(self, content: bytes, filename: str | None = None) -> Path:
+        return self.put_bytes(content, filename).path
+
+    def stored_as(self, filename: str | None) -> Tuple[str, Optional[str]]:
+        """(object key, codec to compress with) for an upload: plain .csv names get
+        settings.upload_compression and its suffix, compressed uploads are kept as sent."""
         name = filename or f"upload__{uuid.uuid4().hex}.csv"
-        path = self.uploads / name
-        path.write_bytes(content)
+        codec = None if self.compression == "none" or not is_csv_name(name) or codec_for(name) else self.compression
+        return (name + CODEC_SUFFIX[codec] if codec else name), codec
+
+    def put_bytes(self, content: bytes, filename: str | None = None) -> StoredObject:
+        name, codec = self.stored_as(filename)
+        with AtomicWriter(self.key_path(name), self.staging) as w:
+            if codec:
+                with compressed_writer(w, codec) as z:
+                    z.write(content)
+            else:
+                w.write(content)
+            return w.commit()
+
+    def put_stream(self, fileobj: BinaryIO, filename: str | None = None) -> StoredObject:
+        """Stream a file object into the store in 1 MiB chunks (temp file, optional
+        compression, sha256 of the stored bytes, fsync per settings.upload_fsync, atomic
+        rename) -> key, path, size, sha256."""
+        name, codec = self.stored_as(filename)
+        fileobj.seek(0)
+        with AtomicWriter(self.key_path(name), self.staging) as w:
+            if codec:
+                with compressed_writer(w, codec) as z:
+                    shutil.copyfileobj(fileobj, z, COPY_CHUNK)
+            else:
+                w.copy_from(fileobj)
+            return w.commit()
+
+    # S3-style multipart upload: parts are staged one file each and concatenated in part
+    # order on complete, so a large object never has to arrive in a single request.
+    def create_multipart_upload(self, name: str) -> str:
+        self.key_path(name)
+        upload_id = uuid.uuid4().hex
+        folder = self.multipart / upload_id
+        folder.mkdir(parents=True)
+        (folder / "key").write_text(name)
+        return upload_id
+
+    def _upload_dir(self, name: str, upload_id: str) -> Path:
+        folder = self.multipart / upload_id
+        if not _UPLOAD_ID.fullmatch(upload_id) or not (folder / "key").is_file() \
+                or (folder / "key").read_text() != name:
+            raise LookupError(f"No multipart upload {upload_id!r} for {name!r}.")
+        return folder
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, fileobj: BinaryIO) -> dict:
+        """Store (or replace) one part -> part_number, size, etag (sha256 of the part)."""
+        folder = self._upload_dir(name, upload_id)
+        if not 1 <= part_number <= MAX_PARTS:
+            raise ValueError(f"part_number must be between 1 and {MAX_PARTS}.")
+        fileobj.seek(0)
+        with AtomicWriter(folder / f"part-{part_number:05d}", folder) as w:
+            w.copy_from(fileobj)
+            part = w.commit()
+        return {"part_number": part_number, "size": part.size, "etag": part.sha256}
+
+    def complete_multipart_upload(self, name: str, upload_id: str) -> StoredObject:
+        """Concatenate parts 1..n into the object (one atomic publish) and drop the upload.
+        ValueError when there are no parts or a number in 1..n is missing."""
+        folder = self._upload_dir(name, upload_id)
+        parts = sorted(folder.glob("part-*"))
+        numbers = [int(p.name[5:]) for p in parts]
+        if not parts:
+            raise ValueError("The multipart upload has no parts.")
+        if numbers != list(range(1, len(parts) + 1)):
+            missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+            raise ValueError(f"Parts must be numbered 1..n; missing {missing[:10]}.")
+        with AtomicWriter(self.key_path(name), self.staging) as w:
+            for part in parts:
+                with part.open("rb") as f:
+                    w.copy_from(f)
+            stored = w.commit()
+        shutil.rmtree(folder, ignore_errors=True)
+        return stored
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        shutil.rmtree(self._upload_dir(name, upload_id))
+
+    def key_path(self, name: str) -> Path:
+        """Destination of an object key: a .csv (.csv.gz, .csv.zst) file directly under uploads/. ValueError for
+        anything else (separators, '..', absolute paths, symlinks out, other suffixes)."""
+        if not name or name.startswith(".") or "/" in name or os.sep in name or not is_csv_name(name):
+            raise ValueError(f"Invalid object key {name!r}.")
+        path = self._root / name  # a plain name: only a symlink can lead out of uploads/
+        if path.is_symlink() and path.resolve().parent != self._root:
+            raise ValueError(f"Invalid object key {name!r}.")
+        return path
+
+    def object_path(self, name: str) -> Path:
+        """Path of a stored upload ("S3 key"); ValueError as key_path, FileNotFoundError
+        when absent."""
+        path = self.key_path(name)
+        if not path.is_file():
+            raise FileNotFoundError(f"No stored upload {name!r}.")
         return path
 
-    def trigger_glue_crawler(self, crawler_name: str = "bills_crawler") -> Path:
-        marker = self.glue / f"{crawler_name}__{int(time.time())}__{uuid.uuid4().hex}.marker"
-        marker.write_text("ok")
-        return marker
+    def list_objects(self) -> List[dict]:
+        return [{"key": p.name, "size": st.st_size, "modified": st.st_mtime}
+                for p in object_files(self.uploads) for st in [p.stat()]]
+
+    def open_mapped(self, name: str) -> MappedFile:
+        return MappedFile(self.object_path(name))
+
+    def trigger_glue_crawler(self, crawler_name: str = "bills_crawler", known: dict | None = None,
+                             keys: Iterable[str] | None = None) -> Path:
+        """Run an incremental catalog crawl over uploads/, or only over `keys` (known: see
+        Catalog.crawl), and rewrite the crawler's one rolling summary file,
+        glue/<crawler>__last_run.json."""
+        summary = self.catalog.crawl(self.uploads, crawler_name, known, keys)
+        path = self.glue / f"{crawler_name}__last_run.json"
+        with AtomicWriter(path, self.glue, fsync="none") as w:
+            w.write(json.dumps(summary, indent=2).encode())
+            w.commit()
+        return path
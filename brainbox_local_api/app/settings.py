@@ -0,0 +1,87 @@
+import os
+from dataclasses import dataclass, fields
+
+ENV_PREFIX = "BRAINBOX_"
+
+@dataclass(frozen=True)
+class Settings:
+    """Runtime knobs. Each field can be overridden by an environment variable named
+    BRAINBOX_<FIELD_NAME_UPPERCASE>, e.g. BRAINBOX_SQLITE_SYNCHRONOUS=FULL."""
+    # SQLite connection pool (app/pool.py)
+    sqlite_synchronous: str = "NORMAL"        # OFF | NORMAL | FULL | EXTRA
+    sqlite_cache_size: int = -65536           # pages, or KiB when negative (-65536 = 64 MiB)
+    sqlite_mmap_size: int = 256 * 1024 * 1024 # bytes
+    sqlite_temp_store: str = "MEMORY"         # DEFAULT | FILE | MEMORY
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_statement_cache: int = 512         # prepared statements kept per connection
+    # custom_csv storage for start_date/end_date when the table is first created:
+    # "text" (ISO strings) or "epoch_days" (INTEGER days since 1970-01-01).
+    # Existing databases are converted with POST /db/migrate?date_storage=...
+    date_storage: str = "text"
+    # custom_csv layout for a fresh database: "table" or "partitioned" (one table per
+    # start_date month behind a custom_csv view). Existing ones: POST /db/migrate?layout=...
+    storage_layout: str = "table"
+    # /upload default load mode: "append" (plain INSERT) or "upsert" (idempotent on
+    # upsert_key, comma-separated columns, and skips byte-identical re-uploads)
+    ingest_mode: str = "append"
+    upsert_key: str = "bill_id"
+    # /upload?bulk=true (db.bulk_load): append in batches with synchronous relaxed and,
+    # while custom_csv is at most bulk_reindex_max_rows, indexes rebuilt once at the end
+    bulk_batch: int = 50_000
+    bulk_synchronous: str = "OFF"
+    bulk_reindex_max_rows: int = 1_000_000
+    # Parallel parse/validate (app/parallel.py): uploads of at least parallel_min_bytes are
+    # cut into parse_chunk_bytes ranges checked by parse_workers processes (0 = one per CPU)
+    parse_workers: int = 0
+    parallel_min_bytes: int = 32 * 1024 * 1024
+    parse_chunk_bytes: int = 8 * 1024 * 1024
+    # Upload store (app/services.py): fsync before the atomic rename of a stored object,
+    # "none" | "file" | "full" (file + directory entry)
+    upload_fsync: str = "file"
+    # Compress plain .csv uploads when storing them (as <name>.csv.gz / .csv.zst):
+    # "none" | "gzip" | "zstd" (needs zstandard). Compressed uploads are always kept as sent.
+    upload_compression: str = "none"
+    # /upload/batch: limits on files per request and on their total (uncompressed) size
+    batch_max_files: int = 10_000
+    batch_max_bytes: int = 256 * 1024 * 1024
+    # Validate once (app/ingest.py): files that pass /validate are remembered by sha256, returned
+    # as validation_token; /upload?validation_token= with the same bytes skips re-checking them.
+    # Files of at most validation_keep_rows_max_bytes also keep their parsed rows for the upload.
+    validation_cache_entries: int = 256
+    validation_cache_ttl_s: float = 600.0
+    validation_cache_max_bytes: int = 128 * 1024 * 1024
+    validation_keep_rows_max_bytes: int = 4 * 1024 * 1024
+    # Blocking-work thread pools (app/executor.py); requests beyond workers + queue get 503
+    ingest_workers: int = 2    # /validate, /upload: parse, validate, store, load
+    ingest_queue: int = 8
+    query_workers: int = 8     # /athena/query
+    query_queue: int = 64
+    query_max_rows: int = 1000      # cap for JSON /athena/query responses
+    stream_max_rows: int = 0        # cap for streamed (NDJSON) responses; 0 = no cap
+    max_streams: int = 16           # concurrent streamed responses
+    busy_retry_after_s: int = 5
+    # JSON /athena/query result cache (app/query_cache.py); 0 entries disables it
+    query_cache_entries: int = 256
+    query_cache_ttl_s: float = 300.0             # 0 = no expiry (uploads still invalidate)
+    query_cache_max_bytes: int = 64 * 1024 * 1024
+    # Background ingest jobs (app/jobs.py, /upload?async=true)
+    job_workers: int = 2
+    job_queue: int = 32        # accepted-but-not-started jobs before /upload?async=true gets 503
+    job_history: int = 1000    # finished jobs kept for GET /jobs/{id}
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        overrides = {}
+        for f in fields(cls):
+            raw = os.environ.get(ENV_PREFIX + f.name.upper())
+            if raw is None:
+                continue
+            if f.type is bool:
+                overrides[f.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            elif f.type in (int, float):
+                overrides[f.name] = f.type(raw)
+            else:
+                overrides[f.name] = raw
+        return cls(**overrides)
+
+settings = Settings.from_env()
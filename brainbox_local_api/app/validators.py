@@ -1,41 +1,253 @@
-import csv, io
-from datetime import datetime
-from typing import Tuple, List, Dict
-from .schemas import REQUIRED_COLUMNS
-
-def parse_csv(content: bytes) -> Tuple[List[str], List[Dict[str,str]]]:
-    text = content.decode("utf-8", errors="strict")
-    reader = csv.DictReader(io.StringIO(text))
-    if reader.fieldnames is None:
+import csv, io, codecs, re
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Tuple, List, Iterator, Iterable, BinaryIO, Callable
+from .schemas import BILLS, Schema, Row
+from .dates import DATE_CACHE
+
+CHUNK_SIZE = 1024 * 1024  # bytes read per step when streaming an upload
+VALIDATION_BATCH = 50_000  # rows transposed into columns per type-check step
+MAX_REPORTED_ERRORS = 1000  # offending cells listed in an InvalidType response
+
+def iter_text_lines(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Decode a binary stream as UTF-8 chunk by chunk and yield lines (newline kept).
+    Only one chunk plus a partial line is held in memory at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="strict")
+    pending = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        if "\n" in pending:
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line + "\n"
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+def iter_csv(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Tuple[List[str], Iterator[Row]]:
+    """Streaming counterpart of parse_csv: returns the header and a lazy iterator of
+    stripped value tuples in header order. Short rows are padded with "".
+    UnicodeDecodeError / ValueError may surface while iterating the rows."""
+    reader = csv.reader(iter_text_lines(stream, chunk_size))
+    try:
+        raw_header = next(reader)
+    except StopIteration:
         raise ValueError("InvalidCSV: No header found")
-    header = [h.strip() for h in reader.fieldnames]
-    rows = []
-    for r in reader:
-        rows.append({(k.strip() if k is not None else k): (v.strip() if v is not None else v) for k,v in r.items()})
-    return header, rows
-
-def validate_header_exact(header: List[str]) -> Tuple[bool, dict]:
-    missing = [c for c in REQUIRED_COLUMNS if c not in header]
-    extra = [c for c in header if c not in REQUIRED_COLUMNS]
-    ok = (len(missing) == 0 and len(extra) == 0)
-    return ok, {"missing": missing, "extra": extra}
+    header = [h.strip() for h in raw_header]
+    return header, iter_records(reader, len(header))
+
+def too_many_fields(line: int) -> ValueError:
+    return ValueError(f"InvalidCSV: line {line} has more fields than the header")
+
+def iter_records(reader, width: int) -> Iterator[Row]:
+    """Stripped value tuples from a csv.reader positioned after the header."""
+    strip = str.strip
+    for values in reader:
+        n = len(values)
+        if n == width:
+            yield tuple(map(strip, values))
+        elif n == 0:
+            continue  # blank line (csv.DictReader skips these too)
+        elif n > width:
+            raise too_many_fields(reader.line_num)
+        else:
+            yield tuple(map(strip, values)) + ("",) * (width - n)
+
+def parse_csv(content: bytes) -> Tuple[List[str], List[Row]]:
+    header, rows = iter_csv(io.BytesIO(content))
+    return header, list(rows)
+
+def to_canonical(header: List[str], rows: Iterable[Row], schema: Schema = BILLS) -> Iterable[Row]:
+    """Reorder header-ordered tuples into schema column order. Call only after
+    validate_header_exact passed; a file already in canonical order is passed through."""
+    convert = schema.converter(header)
+    return rows if convert is None else map(convert, rows)
+
+def validate_header_exact(header: List[str], schema: Schema = BILLS) -> Tuple[bool, dict]:
+    return schema.check_header(header)
 
 def is_iso_date(s: str) -> bool:
-    try:
-        datetime.fromisoformat(s)
-        return True
-    except Exception:
-        return False
-
-def validate_basic_types(rows: List[Dict[str,str]], sample_n: int = 100) -> Tuple[bool, dict]:
-    sample = rows[:sample_n]
-    for i, r in enumerate(sample, start=1):
-        if not r.get("bill_id"): return False, {"row": i, "field":"bill_id", "expected":"string(non-empty)"}
-        if not r.get("usage_type"): return False, {"row": i, "field":"usage_type", "expected":"string(non-empty)"}
-        try: int(r.get("meter_id",""))
-        except Exception: return False, {"row": i, "field":"meter_id", "expected":"integer"}
-        try: int(r.get("building_id",""))
-        except Exception: return False, {"row": i, "field":"building_id", "expected":"integer"}
-        if not is_iso_date(r.get("start_date","")): return False, {"row": i, "field":"start_date", "expected":"ISO date"}
-        if not is_iso_date(r.get("end_date","")): return False, {"row": i, "field":"end_date", "expected":"ISO date"}
-    return True, {}
+    return DATE_CACHE.is_valid(s)
+
+class RowValidationError(ValueError):
+    """Raised at the end of TypeChecker.iter_checked when any row failed a type check."""
+    def __init__(self, info: dict):
+        super().__init__(f"InvalidType: {info.get('error_count', 0)} invalid value(s)")
+        self.info = info
+
+# Column checks return (batch offsets of offending values, rewrites). Each has a fast path
+# that runs over the whole column in C (all/map/regex) and only enumerates when it fails.
+# rewrites maps raw cell text to its normalized form (only dates have one), or is None.
+_INT_MATCH = re.compile(r"[+-]?[0-9]+", re.ASCII).fullmatch
+
+def _bad_empty(col: Tuple[str, ...]) -> Tuple[List[int], None]:
+    if all(col):
+        return [], None
+    return [i for i, v in enumerate(col) if not v], None
+
+def _bad_integer(col: Tuple[str, ...]) -> Tuple[List[int], None]:
+    if all(map(_INT_MATCH, col)):
+        return [], None
+    return [i for i, v in enumerate(col) if not _INT_MATCH(v)], None
+
+def _bad_iso_date(col: Tuple[str, ...]) -> Tuple[List[int], dict | None]:
+    # one DATE_CACHE lookup per distinct value in the batch, never per cell. Valid non-canonical
+    # spellings (20240201) are rewritten to isoformat() on purpose: dates are compared as text
+    canonical = {v: DATE_CACHE.normalize(v) for v in set(col)}
+    bad = {v for v, c in canonical.items() if c is None}
+    rewrites = {v: c for v, c in canonical.items() if c is not None and c != v}
+    if not bad:
+        return [], rewrites or None
+    return [i for i, v in enumerate(col) if v in bad], None
+
+def _bad_none(col: Tuple[str, ...]) -> Tuple[List[int], None]:
+    return [], None
+
+def _nullable(find_bad: Callable) -> Callable:
+    """Skip empty cells and rewrite them to None (NULL) through the same per-batch rewrite
+    the dates use, so a nullable column costs no extra pass while it has no empties."""
+    def check(col: Tuple[str, ...]) -> Tuple[List[int], dict | None]:
+        if all(col):
+            return find_bad(col)
+        present = [i for i, v in enumerate(col) if v]
+        bad, rewrites = find_bad(tuple(col[i] for i in present))
+        return [present[j] for j in bad], {**(rewrites or {}), "": None}
+    return check
+
+# column type -> (expected label in InvalidType errors, column check); nullable columns
+# use the second label
+_TYPE_RULES = {
+    "string": (("string(non-empty)", _bad_empty), ("string", _bad_none)),
+    "integer": (("integer", _bad_integer), ("integer", _bad_integer)),
+    "date": (("ISO date", _bad_iso_date), ("ISO date", _bad_iso_date)),
+}
+
+@lru_cache(maxsize=None)
+def column_rules(schema: Schema) -> Tuple[Tuple[int, str, str, Callable], ...]:
+    """(position, field, expected, check) per column of schema, compiled once per schema."""
+    rules = []
+    for pos, column in enumerate(schema.columns):
+        expected, find_bad = _TYPE_RULES[column.type][column.nullable]
+        rules.append((pos, column.name, expected, _nullable(find_bad) if column.nullable else find_bad))
+    return tuple(rules)
+
+def _rewrite(row: Row, rewrites: List[Tuple[int, dict]]) -> Row:
+    cells = list(row)
+    for pos, mapping in rewrites:
+        cells[pos] = mapping.get(cells[pos], cells[pos])
+    return tuple(cells)
+
+class TypeChecker:
+    """Whole-file type validation over canonical row tuples, one column at a time.
+    Rows are checked in batches of VALIDATION_BATCH: each batch is transposed into column
+    tuples and every rule runs over a full column. Every offending (row, field) is counted;
+    the first MAX_REPORTED_ERRORS are listed, ordered by row then column. While the file
+    is clean, date_ranges keeps the [min, max] canonical value of each date column
+    (recorded by the Glue catalog, app/catalog.py)."""
+    def __init__(self, batch_size: int = VALIDATION_BATCH, max_errors: int = MAX_REPORTED_ERRORS,
+                 schema: Schema = BILLS):
+        self.schema = schema
+        self.rules = column_rules(schema)
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.rows_checked = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+        self.date_ranges: Dict[str, List[str]] = {}
+        self.rewritten_batches = 0  # batches whose dates needed rewriting to canonical form
+
+    @property
+    def ok(self) -> bool:
+        return self.error_count == 0
+
+    def check(self, batch: List[Row]) -> List[Row]:
+        """Check one batch and return it with date cells normalized to canonical ISO text
+        (e.g. 20240201 -> 2024-02-01); the batch is returned unchanged when nothing needs it."""
+        if not batch:
+            return batch
+        columns = list(zip(*batch))
+        found, rewrites = [], []
+        for order, (pos, field, expected, find_bad) in enumerate(self.rules):
+            bad, mapping = find_bad(columns[pos])
+            found.extend((i, order, field, expected) for i in bad)
+            if mapping:
+                rewrites.append((pos, mapping))
+        if found:
+            self.error_count += len(found)
+            room = self.max_errors - len(self.errors)
+            if room > 0:
+                found.sort()
+                base = self.rows_checked + 1
+                self.errors.extend({"row": base + i, "field": field, "expected": expected}
+                                   for i, _, field, expected in found[:room])
+        else:
+            mappings = dict(rewrites)
+            for field in self.schema.date_columns:
+                pos = self.schema.index[field]
+                mapping = mappings.get(pos, {})
+                self._widen(field, {mapping.get(v, v) for v in set(columns[pos])})
+            if rewrites:
+                batch = [_rewrite(r, rewrites) for r in batch]
+                self.rewritten_batches += 1
+        self.rows_checked += len(batch)
+        return batch
+
+    def _widen(self, field: str, values: Iterable[str]) -> None:
+        values = [v for v in values if v]
+        if not values:
+            return
+        lo, hi = min(values), max(values)
+        current = self.date_ranges.get(field)
+        self.date_ranges[field] = [min(current[0], lo), max(current[1], hi)] if current else [lo, hi]
+
+    def merge(self, rows_checked: int, error_count: int, errors: List[dict],
+              date_ranges: Dict[str, List[str]] | None = None, rewritten_batches: int = 0) -> None:
+        """Fold in a chunk checked by another TypeChecker (app/parallel.py), whose error row
+        numbers start at 1 for the chunk. Chunks must be merged in file order."""
+        self.rewritten_batches += rewritten_batches
+        for field, bounds in (date_ranges or {}).items():
+            self._widen(field, bounds)
+        room = self.max_errors - len(self.errors)
+        if room > 0:
+            base = self.rows_checked
+            self.errors.extend({**e, "row": e["row"] + base} for e in errors[:room])
+        self.error_count += error_count
+        self.rows_checked += rows_checked
+
+    def result(self) -> Tuple[bool, dict]:
+        if self.ok:
+            return True, {}
+        # first offending cell stays at the top level for clients of the old single-error shape
+        return False, {**self.errors[0], "error_count": self.error_count,
+                       "errors": self.errors, "errors_truncated": self.error_count > len(self.errors)}
+
+    def iter_checked(self, rows: Iterable[Row], progress: Callable[[int, int], None] | None = None) -> Iterator[Row]:
+        """Yield rows batch by batch once each batch has passed. After the first failing
+        batch nothing more is yielded, but the remaining rows are still checked so the
+        report covers the whole file; RowValidationError is then raised, which makes a
+        consuming load_rows roll back. progress(rows_checked, rows_yielded) is called
+        after each batch is checked and again once it has been consumed."""
+        it = iter(rows)
+        yielded = 0
+        while True:
+            batch = list(islice(it, self.batch_size))
+            if not batch:
+                break
+            batch = self.check(batch)
+            if progress: progress(self.rows_checked, yielded)
+            if self.ok:
+                yield from batch
+                yielded += len(batch)
+                if progress: progress(self.rows_checked, yielded)
+        if not self.ok:
+            raise RowValidationError(self.result()[1])
+
+def validate_basic_types(rows: List[Row], sample_n: int | None = 100) -> Tuple[bool, dict]:
+    """rows are canonical tuples (see to_canonical); sample_n=None checks every row."""
+    sample = rows if sample_n is None else rows[:sample_n]
+    checker = TypeChecker()
+    for start in range(0, len(sample), checker.batch_size):
+        checker.check(sample[start:start + checker.batch_size])
+    return checker.result()
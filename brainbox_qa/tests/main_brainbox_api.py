@@ -18,7 +18,7 @@ nonexist_csv_file = './tests/data/xxxxx.csv'
   
 # -------------------------------------------
 # post csv file to API endpoint - upload
-def post_upload_csv(file):
+def post_upload_csv(file, validation_token = None):
     # test data files
     file_path = file
     if not os.path.exists(file_path):
@@ -33,8 +33,11 @@ def post_upload_csv(file):
         # variables
         files = {'file': file_obj}
         data = {}
-        # send POST to endpoint
-        response = requests.post(url_endpoint_upload, files = files, data = data)
+        # send POST to endpoint (a token from /validate lets the server skip re-validating the same file)
+        if validation_token:
+            response = requests.post(url_endpoint_upload, params = {"validation_token": validation_token}, files = files, data = data)
+        else:
+            response = requests.post(url_endpoint_upload, files = files, data = data)
         # check
         if response.ok:
             # upload ok
@@ -119,10 +122,10 @@ if __name__ == '__main__':
     # Valid CSV
     print("-------- Valid CSV ------------")
     print("/validate API call")
-    post_validate_csv(valid_csv_file)
+    validation = post_validate_csv(valid_csv_file)
     print()
     print("/upload API call")
-    post_upload_csv(valid_csv_file)
+    post_upload_csv(valid_csv_file, validation.get("validation_token"))
     print()
     print("/query API call --- Optional")
     post_query_csv(valid_csv_file)
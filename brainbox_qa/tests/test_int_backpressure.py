@@ -0,0 +1,125 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - bounded work pools (503 ServerBusy)
+# Gang Hu
+# --------------------------------
+# Blocking work runs on bounded pools (app/executor.py): beyond workers + queue a request
+# gets 503 ServerBusy with Retry-After right away. These tests start an API instance with
+# one ingest worker, one job worker and no queue, keep the worker busy with a large file,
+# and check that the next request is turned away while /health still answers.
+# modules
+import pytest
+import logging
+import requests
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+API_DIR = Path(__file__).resolve().parents[2] / "brainbox_local_api"
+RETRY_AFTER = 7
+# -------------------------------------------------
+@pytest.fixture(scope="module")
+def busy_api():
+    # tear up - API instance on a free port with single-worker, queue-less pools
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {**os.environ, "BRAINBOX_INGEST_WORKERS": "1", "BRAINBOX_INGEST_QUEUE": "0", "BRAINBOX_JOB_WORKERS": "1",
+           "BRAINBOX_JOB_QUEUE": "0", "BRAINBOX_BUSY_RETRY_AFTER_S": str(RETRY_AFTER)}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+                              cwd = API_DIR, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    base_url = f"http://localhost:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(base_url + "/health", timeout = 1).status_code == 200:
+                break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    else:
+        server.terminate()
+        pytest.fail("API instance with bounded pools did not start")
+    yield base_url
+    # tear down
+    server.terminate()
+    server.wait(timeout = 10)
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers
+    session = requests.Session()
+    yield session
+    # tear down
+    session.close()
+
+@pytest.fixture(scope="module")
+def large_csv():
+    # big enough that checking it keeps a worker busy for a while
+    prefix = "BP-" + uuid.uuid4().hex[:8]
+    rows = "".join(f"{prefix}-{i},{i},water,7,2024-01-01,2024-01-31\n" for i in range(600_000))
+    return ("bill_id,meter_id,usage_type,building_id,start_date,end_date\n" + rows).encode()
+
+def wait_busy(client, url, pool):
+    # poll /stats until the pool's only worker has picked the request up
+    for _ in range(200):
+        stats = client.get(url + "/stats", timeout = 10).json()
+        if stats[pool]["in_flight"] == 1:
+            return stats
+        time.sleep(0.02)
+    pytest.fail(f"{pool} never became busy")
+
+def test_brainbox_api_ingest_pool_full(brainbox_api_client, busy_api, large_csv):
+    LOGGER.info("test_brainbox_api_ingest_pool_full()")
+    # send POST to endpoint validate with the large file in the background: it takes the only ingest worker
+    first = {}
+    worker = threading.Thread(target = lambda: first.update(response = requests.post(
+        busy_api + "/validate/", files = {'file': ('bp_large.csv', large_csv)}, timeout = 120)))
+    worker.start()
+    try:
+        before = wait_busy(brainbox_api_client, busy_api, "ingest_pool")
+        # send POST to endpoint validate while the pool is full, and GET health
+        busy = brainbox_api_client.post(busy_api + "/validate/", files = {'file': ('bp_small.csv', large_csv[:200])},
+                                        timeout = 10)
+        health = brainbox_api_client.get(busy_api + "/health", timeout = 10)
+        after = brainbox_api_client.get(busy_api + "/stats", timeout = 10).json()
+    finally:
+        worker.join()
+
+    # assert check: turned away at once with Retry-After, the event loop still answers, the first request completes
+    LOGGER.info(busy.text)
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == str(RETRY_AFTER)
+    assert busy.json()["error"] == "ServerBusy"
+    assert health.status_code == 200
+    assert after["ingest_pool"]["rejected"] == before["ingest_pool"]["rejected"] + 1
+    assert first["response"].status_code == 200
+    assert first["response"].json()["rows_checked"] == 600_000
+
+def test_brainbox_api_job_pool_full(brainbox_api_client, busy_api, large_csv):
+    LOGGER.info("test_brainbox_api_job_pool_full()")
+    # send POST to endpoint upload?async=true: the first job takes the only job worker
+    first = brainbox_api_client.post(busy_api + "/upload/", params = {"async": "true", "mode": "append"},
+                                     files = {'file': ('bp_large.csv', large_csv)}, timeout = 30)
+    assert first.status_code == 202
+    wait_busy(brainbox_api_client, busy_api, "jobs")
+    busy = brainbox_api_client.post(busy_api + "/upload/", params = {"async": "true"},
+                                    files = {'file': ('bp_small.csv', large_csv[:200])}, timeout = 10)
+    health = brainbox_api_client.get(busy_api + "/health", timeout = 10)
+
+    # assert check
+    LOGGER.info(busy.text)
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == str(RETRY_AFTER)
+    assert health.status_code == 200
+    # let the first job finish (its rows stay in the shared QA database like any upload)
+    for _ in range(600):
+        job = brainbox_api_client.get(busy_api + first.json()["status_url"], timeout = 10).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.1)
+    assert job["status"] == "succeeded"
@@ -0,0 +1,79 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - Glue catalog
+# Gang Hu 
+# --------------------------------
+# modules
+import pytest
+import re
+import logging
+import requests
+import uuid
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+# -------------------------------------------------
+@pytest.fixture(scope="session")
+def catalog_url():
+    return "http://localhost:8000/catalog"
+
+@pytest.fixture(scope="session")
+def upload_url():
+    return "http://localhost:8000/upload/"
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers 
+    session = requests.Session()
+    #
+    yield session
+    # tear down
+    session.close()
+
+def test_brainbox_api_catalog_after_upload(brainbox_api_client, catalog_url, upload_url):
+    # Verify an upload is cataloged with its row count and date range
+    LOGGER.info("test_brainbox_api_catalog_after_upload()")
+    with open("./tests/data/valid_1.csv", 'rb') as file_obj:
+        upload = brainbox_api_client.post(upload_url, files = {'file': file_obj}, data = {})
+    response = brainbox_api_client.get(catalog_url + "/valid_1.csv", timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    entry = response.json()
+    assert upload.status_code == 200
+    assert response.status_code == 200
+    assert entry["valid"] is True
+    assert entry["row_count"] == upload.json()["rows_inserted"]
+    assert re.match(r"\d{4}-\d{2}-\d{2}$", entry["min_start_date"])
+    assert entry["min_start_date"] <= entry["max_start_date"]
+
+def test_brainbox_api_catalog_crawl_incremental(brainbox_api_client, catalog_url):
+    # A second crawl with nothing changed must not re-process any file
+    LOGGER.info("test_brainbox_api_catalog_crawl_incremental()")
+    brainbox_api_client.post(catalog_url + "/crawl", timeout = 10)
+    response = brainbox_api_client.post(catalog_url + "/crawl", timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    run = response.json()
+    assert response.status_code == 200
+    assert re.match(".+local_state/glue/bills_crawler_.*", response.text)
+    assert run["added"] == 0 and run["updated"] == 0
+    assert run["unchanged"] == run["scanned"]
+
+def test_brainbox_api_catalog_upload_crawls_only_its_key(brainbox_api_client, catalog_url, upload_url):
+    # Verify an upload catalogs the object it stored and nothing else; a full sweep is POST /catalog/crawl
+    LOGGER.info("test_brainbox_api_catalog_upload_crawls_only_its_key()")
+    name = f"cat_{uuid.uuid4().hex[:8]}.csv"
+    with open("./tests/data/valid_1.csv", 'rb') as file_obj:
+        upload = brainbox_api_client.post(upload_url, files = {'file': (name, file_obj)})
+    after_upload = brainbox_api_client.get(catalog_url, timeout = 10).json()
+    sweep = brainbox_api_client.post(catalog_url + "/crawl", timeout = 10).json()
+
+    # assert check
+    LOGGER.info(after_upload["last_run"])
+    LOGGER.info(sweep)
+    assert upload.status_code == 200
+    assert (after_upload["last_run"]["scanned"], after_upload["last_run"]["added"]) == (1, 1)
+    assert name in [f["key"] for f in after_upload["files"]]
+    assert sweep["scanned"] == after_upload["count"]
+    assert sweep["unchanged"] == sweep["scanned"]
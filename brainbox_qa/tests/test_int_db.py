@@ -0,0 +1,74 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - db indexes
+# Gang Hu 
+# --------------------------------
+# modules
+import pytest
+import re
+import logging
+import requests
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+# -------------------------------------------------
+@pytest.fixture(scope="session")
+def indexes_url():
+    return "http://localhost:8000/db/indexes"
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers 
+    session = requests.Session()
+    #
+    yield session
+    # tear down
+    session.close()
+
+def test_brainbox_api_db_indexes_list(brainbox_api_client, indexes_url):
+    LOGGER.info("test_brainbox_api_db_indexes_list()")
+    # send GET to endpoint
+    response = brainbox_api_client.get(indexes_url, timeout = 10)
+
+    # assert check - composite (building_id, start_date) index is created by the schema migration
+    expected_pattern = ".+table.+custom_csv.+idx_custom_csv_building_start.+building_id.+start_date.+present.+true.+"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    #
+    assert response.status_code == 200
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_db_indexes_unknown(brainbox_api_client, indexes_url):
+    LOGGER.info("test_brainbox_api_db_indexes_unknown()")
+    # send POST to endpoint - not a managed index name
+    response = brainbox_api_client.post(indexes_url + "/idx_not_managed", timeout = 10)
+
+    # assert check
+    expected_pattern = ".+error.+IndexNotFound.+"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    #
+    assert response.status_code == 404
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_db_partitions_default_layout(brainbox_api_client, indexes_url):
+    LOGGER.info("test_brainbox_api_db_partitions_default_layout()")
+    # send GET to endpoint - month partitioning is opt-in, the default layout is one table
+    response = brainbox_api_client.get(indexes_url.replace("/indexes", "/partitions"), timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json() == {"layout": "table", "partitions": []}
+
+def test_brainbox_api_db_migrate_needs_target(brainbox_api_client, indexes_url):
+    LOGGER.info("test_brainbox_api_db_migrate_needs_target()")
+    # send POST to endpoint - neither date_storage nor layout given
+    response = brainbox_api_client.post(indexes_url.replace("/indexes", "/migrate"), timeout = 10)
+
+    # assert check
+    expected_pattern = ".+error.+InvalidMigration.+"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    #
+    assert response.status_code == 400
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
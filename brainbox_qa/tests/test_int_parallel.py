@@ -0,0 +1,141 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - parallel parse path
+# Gang Hu
+# --------------------------------
+# The process-pool parser (app/parallel.py) only runs for uploads of at least
+# BRAINBOX_PARALLEL_MIN_BYTES (32 MiB). These tests start a second API instance with the
+# threshold and BRAINBOX_PARSE_CHUNK_BYTES lowered, so small files are cut into many ranges,
+# and compare its answers with the main instance on localhost:8000 (sequential path).
+# modules
+import pytest
+import re
+import logging
+import requests
+import os
+import csv
+import io
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+API_DIR = Path(__file__).resolve().parents[2] / "brainbox_local_api"
+CHUNK_BYTES = 300  # a few rows per range: many cuts, some inside quoted fields
+# -------------------------------------------------
+@pytest.fixture(scope="session")
+def validate_url():
+    return "http://localhost:8000/validate/"
+
+@pytest.fixture(scope="module")
+def parallel_api():
+    # tear up - second API instance on a free port with the parallel path forced on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {**os.environ, "BRAINBOX_PARALLEL_MIN_BYTES": "1", "BRAINBOX_PARSE_CHUNK_BYTES": str(CHUNK_BYTES),
+           "BRAINBOX_PARSE_WORKERS": "2"}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+                              cwd = API_DIR, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    base_url = f"http://localhost:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(base_url + "/health", timeout = 1).status_code == 200:
+                break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    else:
+        server.terminate()
+        pytest.fail("parallel API instance did not start")
+    yield base_url
+    # tear down
+    server.terminate()
+    server.wait(timeout = 10)
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers
+    session = requests.Session()
+    yield session
+    # tear down
+    session.close()
+
+def make_rows(prefix, count, bad_every = None):
+    # rows with quoted embedded newlines and "" escapes; every bad_every-th row has a non-integer meter_id
+    rows = []
+    for i in range(count):
+        usage = f'water\nline {i} "quoted"' if i % 3 == 0 else ("gas, metered" if i % 3 == 1 else "electricity")
+        meter = "x12" if bad_every and i % bad_every == bad_every - 1 else str(1000 + i)
+        rows.append([f"{prefix}-{i}", meter, usage, str(i % 5), "2024-01-01", "20240131"])
+    return rows
+
+def to_csv(rows):
+    out = io.StringIO(newline = "")
+    writer = csv.writer(out, lineterminator = "\n")
+    writer.writerow(["bill_id", "meter_id", "usage_type", "building_id", "start_date", "end_date"])
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+def test_brainbox_api_parallel_validate_matches_sequential(brainbox_api_client, validate_url, parallel_api):
+    LOGGER.info("test_brainbox_api_parallel_validate_matches_sequential()")
+    content = to_csv(make_rows("PAR-" + uuid.uuid4().hex[:8], 200))
+    assert len(content) > 20 * CHUNK_BYTES
+    # send POST to endpoint validate on both instances
+    sequential = brainbox_api_client.post(validate_url, files = {'file': ('par_ok.csv', content)})
+    parallel = brainbox_api_client.post(parallel_api + "/validate/", files = {'file': ('par_ok.csv', content)})
+
+    # assert check
+    LOGGER.info(parallel.text)
+    assert sequential.status_code == 200 and parallel.status_code == 200
+    assert parallel.json()["rows_checked"] == sequential.json()["rows_checked"] == 200
+    assert parallel.json()["validation_token"] == sequential.json()["validation_token"]
+
+def test_brainbox_api_parallel_errors_match_sequential(brainbox_api_client, validate_url, parallel_api):
+    LOGGER.info("test_brainbox_api_parallel_errors_match_sequential()")
+    # bad cells spread over the file: several of them land next to a range boundary
+    content = to_csv(make_rows("PAR-" + uuid.uuid4().hex[:8], 200, bad_every = 7))
+    # send POST to endpoint validate on both instances
+    sequential = brainbox_api_client.post(validate_url, files = {'file': ('par_bad.csv', content)})
+    parallel = brainbox_api_client.post(parallel_api + "/validate/", files = {'file': ('par_bad.csv', content)})
+
+    # assert check
+    LOGGER.info(parallel.text)
+    assert sequential.status_code == 422 and parallel.status_code == 422
+    assert parallel.json()["error_count"] == 200 // 7
+    assert [e["row"] for e in parallel.json()["errors"]] == list(range(7, 201, 7))
+    assert parallel.json() == sequential.json()
+
+def test_brainbox_api_parallel_fatal_line_matches_sequential(brainbox_api_client, validate_url, parallel_api):
+    LOGGER.info("test_brainbox_api_parallel_fatal_line_matches_sequential()")
+    rows = make_rows("PAR-" + uuid.uuid4().hex[:8], 150)
+    rows[120] = rows[120] + ["extra"]  # too many fields, well after the first range
+    content = to_csv(rows)
+    # send POST to endpoint validate on both instances
+    sequential = brainbox_api_client.post(validate_url, files = {'file': ('par_fatal.csv', content)})
+    parallel = brainbox_api_client.post(parallel_api + "/validate/", files = {'file': ('par_fatal.csv', content)})
+
+    # assert check: same message, same (physical) line number
+    LOGGER.info(parallel.text)
+    assert sequential.status_code == 400 and parallel.status_code == 400
+    assert re.match(".+InvalidCSV.+line.+more fields.+", parallel.text)
+    assert parallel.json() == sequential.json()
+
+def test_brainbox_api_parallel_upload_rows_in_order(brainbox_api_client, parallel_api):
+    LOGGER.info("test_brainbox_api_parallel_upload_rows_in_order()")
+    prefix = "PAR-" + uuid.uuid4().hex[:8]
+    rows = make_rows(prefix, 200)
+    # send POST to endpoint upload on the parallel instance, then read the rows back
+    response = brainbox_api_client.post(parallel_api + "/upload/", files = {'file': (f"{prefix}.csv", to_csv(rows))})
+    loaded = brainbox_api_client.post(parallel_api + "/athena/query", json = {
+        "sql": "SELECT bill_id, meter_id, usage_type, building_id, start_date, end_date FROM custom_csv "
+               "WHERE bill_id LIKE ? ORDER BY rowid", "params": [prefix + "-%"], "max_rows": 1000}, timeout = 10)
+
+    # assert check: every row, in file order, quoted newlines and quotes intact, dates canonical
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["rows_inserted"] == 200
+    expected = [[b, int(m), u, int(bld), s, "2024-01-31"] for b, m, u, bld, s, _ in rows]
+    assert loaded.json()["rows"] == expected
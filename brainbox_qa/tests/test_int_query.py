@@ -119,3 +119,262 @@ def test_brainbox_api_query_empty_csv(brainbox_api_client, upload_url, query_url
     assert response.status_code == 200 
     assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
     # {"error":"InvalidSchema","missing":["building_id"],"extra":[]}
+
+def test_brainbox_api_query_ndjson_stream(brainbox_api_client, query_url):
+    # Verify streamed SQL query result (NDJSON): columns line, one line per row, rowcount line
+    LOGGER.info("test_brainbox_api_query_ndjson_stream()")
+    payload = {"sql": "SELECT bill_id, meter_id FROM custom_csv LIMIT 5"}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, params = {"format": "ndjson"}, json = payload, timeout = 10)
+
+    # assert check
+    lines = response.text.splitlines()
+    LOGGER.info(response.text)
+    #
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert json.loads(lines[0]) == {"columns": ["bill_id", "meter_id"]}
+    assert len(lines) == 7
+    assert json.loads(lines[-1]) == {"rowcount": 5}
+
+def test_brainbox_api_query_cache_invalidated_by_upload(brainbox_api_client, upload_url, query_url, valid_upload_file):
+    # Verify repeated SQL query is served from the result cache, and an upload invalidates it (new row count)
+    LOGGER.info("test_brainbox_api_query_cache_invalidated_by_upload()")
+    stats_url = query_url.replace("/athena/query", "/stats")
+    payload = {"sql": "SELECT COUNT(*) AS n FROM custom_csv"}
+    # send POST to endpoint query twice
+    count1 = brainbox_api_client.post(query_url, json = payload, timeout = 10).json()["rows"][0][0]
+    hits1 = brainbox_api_client.get(stats_url, timeout = 10).json()["query_cache"]["hits"]
+    response = brainbox_api_client.post(query_url, json = {"sql": "SELECT   COUNT(*) AS n\n FROM custom_csv;"}, timeout = 10)
+    hits2 = brainbox_api_client.get(stats_url, timeout = 10).json()["query_cache"]["hits"]
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["rows"][0][0] == count1
+    assert hits2 == hits1 + 1
+
+    # Upload --------------
+    with open(valid_upload_file, 'rb') as file_obj:
+        response = brainbox_api_client.post(upload_url, files = {'file': file_obj})
+    inserted = response.json()["rows_inserted"]
+    count2 = brainbox_api_client.post(query_url, json = payload, timeout = 10).json()["rows"][0][0]
+
+    # assert check
+    LOGGER.info(f"count before {count1}, inserted {inserted}, count after {count2}")
+    assert response.status_code == 200
+    assert count2 == count1 + inserted
+
+def test_brainbox_api_query_cache_line_comment(brainbox_api_client, query_url):
+    # Verify the line break that ends a -- comment is part of the cache key: the text after it is SQL again
+    LOGGER.info("test_brainbox_api_query_cache_line_comment()")
+    commented = "SELECT COUNT(*) AS z FROM custom_csv -- x WHERE 0"
+    # send POST to endpoint query: whole-table count first, then the same text with WHERE 0 on its own line
+    total = brainbox_api_client.post(query_url, json = {"sql": commented}, timeout = 10)
+    filtered = brainbox_api_client.post(query_url, json = {"sql": commented.replace(" WHERE", "\nWHERE")}, timeout = 10)
+
+    # assert check
+    LOGGER.info(total.text)
+    LOGGER.info(filtered.text)
+    assert total.status_code == 200 and filtered.status_code == 200
+    assert total.json()["rows"][0][0] > 0
+    assert filtered.json()["rows"] == [[0]]
+
+def test_brainbox_api_query_params(brainbox_api_client, query_url):
+    # Verify parameterized SQL query (? placeholders + params list); comments before SELECT are fine
+    LOGGER.info("test_brainbox_api_query_params()")
+    payload = {"sql": "-- dashboard\nSELECT bill_id, usage_type FROM custom_csv WHERE usage_type = ? AND meter_id > ? LIMIT 3",
+               "params": ["water", 0]}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, json = payload, timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["rowcount"] > 0
+    assert all(row[1] == "water" for row in response.json()["rows"])
+
+def test_brainbox_api_query_trailing_comment(brainbox_api_client, query_url):
+    # Verify a trailing ';' and comment after the statement are fine, also in the row-capped and streamed forms
+    LOGGER.info("test_brainbox_api_query_trailing_comment()")
+    for sql in ["SELECT 1; -- note", "SELECT 1 ;\n/* note */ ;"]:
+        for params in [{}, {"format": "ndjson"}]:
+            # send POST to endpoint query
+            response = brainbox_api_client.post(query_url, params = params, json = {"sql": sql, "max_rows": 5}, timeout = 10)
+
+            # assert check
+            LOGGER.info(response.text)
+            assert response.status_code == 200
+            assert "[1]" in response.text
+
+def test_brainbox_api_query_params_count(brainbox_api_client, query_url):
+    # Verify a params count that does not match the placeholders is a 400 about the user's SQL only
+    LOGGER.info("test_brainbox_api_query_params_count()")
+    for sql, params, uses in [("SELECT ?", [], 1), ("SELECT ?, '?' -- ?", [1, 2], 1), ("SELECT ?2, ?1", [1], 2)]:
+        # send POST to endpoint query
+        response = brainbox_api_client.post(query_url, json = {"sql": sql, "params": params}, timeout = 10)
+
+        # assert check
+        LOGGER.info(response.text)
+        assert response.status_code == 400
+        assert response.json()["error"] == "QueryError"
+        assert f"uses {uses}, and there are {len(params)} supplied" in response.json()["message"]
+
+def test_brainbox_api_query_not_select(brainbox_api_client, query_url):
+    # Verify non-SELECT statements are rejected, also when hidden behind a comment
+    LOGGER.info("test_brainbox_api_query_not_select()")
+    for sql in ["DELETE FROM custom_csv", "/* select */ DROP TABLE custom_csv"]:
+        # send POST to endpoint query
+        response = brainbox_api_client.post(query_url, json = {"sql": sql}, timeout = 10)
+
+        # assert check
+        expected_pattern = ".+error.+OnlySelectAllowed.+"
+        LOGGER.info(response.text)
+        assert response.status_code == 400
+        assert re.match(expected_pattern, response.text), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_query_readers_query_only(brainbox_api_client, query_url):
+    # Verify a write that gets past the SELECT/WITH check still fails: reader connections are query_only
+    LOGGER.info("test_brainbox_api_query_readers_query_only()")
+    count = {"sql": "SELECT COUNT(*) FROM custom_csv"}
+    flags = {"sql": "SELECT q.query_only, j.journal_mode FROM pragma_query_only() q, pragma_journal_mode() j"}
+    before = brainbox_api_client.post(query_url, json = count, timeout = 10).json()["rows"][0][0]
+    # send POST to endpoint query: the uncapped stream runs the statement as sent (the row-set form wraps it)
+    response = brainbox_api_client.post(query_url, params = {"format": "ndjson"},
+                                        json = {"sql": "WITH t AS (SELECT 1) DELETE FROM custom_csv"}, timeout = 10)
+    after = brainbox_api_client.post(query_url, json = count, timeout = 10).json()["rows"][0][0]
+    pooled = brainbox_api_client.post(query_url, json = flags, timeout = 10)
+    streamed = brainbox_api_client.post(query_url, params = {"format": "ndjson"}, json = flags, timeout = 10)
+
+    # assert check: nothing deleted; the pooled reader and the stream connection report query_only and WAL
+    LOGGER.info(response.text)
+    assert response.status_code == 400
+    assert re.match(".+QueryError.+readonly database.+", response.text)
+    assert after == before > 0
+    assert pooled.json()["rows"] == [[1, "wal"]]
+    assert json.loads(streamed.text.splitlines()[1]) == [1, "wal"]
+
+def test_brainbox_api_query_pool_stats(brainbox_api_client, query_url):
+    # Verify /stats reports the connection pool: WAL, its pragmas, reused readers, opened streams
+    LOGGER.info("test_brainbox_api_query_pool_stats()")
+    stats_url = query_url.replace("/athena/query", "/stats")
+    payload = {"sql": "SELECT bill_id FROM custom_csv LIMIT 2"}
+    before = brainbox_api_client.get(stats_url, timeout = 10).json()["db_pool"]
+    # send POST to endpoint query: row-set form a few times, then one stream
+    for _ in range(5):
+        assert brainbox_api_client.post(query_url, json = payload, timeout = 10).status_code == 200
+    assert brainbox_api_client.post(query_url, params = {"format": "ndjson"}, json = payload, timeout = 10).status_code == 200
+    after = brainbox_api_client.get(stats_url, timeout = 10).json()["db_pool"]
+
+    # assert check: readers are opened once per thread and reused, each stream gets its own connection
+    LOGGER.info(after)
+    assert after["journal_mode"] == "wal"
+    assert after["db_path"].endswith(".sqlite")
+    assert set(after["pragmas"]) == {"synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout"}
+    assert after["statement_cache"] > 0
+    assert 1 <= after["reader_connections"] <= before["reader_connections"] + 5
+    assert after["streams_opened"] == before["streams_opened"] + 1
+    assert after["writer_busy"] is False
+
+def test_brainbox_api_query_columnar(brainbox_api_client, query_url):
+    # Verify column-oriented JSON result (?format=columnar): one value array per column
+    LOGGER.info("test_brainbox_api_query_columnar()")
+    payload = {"sql": "SELECT bill_id, meter_id FROM custom_csv LIMIT 4"}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, params = {"format": "columnar"}, json = payload, timeout = 10)
+    rows = brainbox_api_client.post(query_url, json = payload, timeout = 10).json()["rows"]
+
+    # assert check
+    LOGGER.info(response.text)
+    body = response.json()
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/vnd.brainbox.columnar+json")
+    assert body["columns"] == ["bill_id", "meter_id"]
+    assert body["rowcount"] == 4
+    assert body["values"] == [list(col) for col in zip(*rows)]
+
+def test_brainbox_api_query_unknown_format(brainbox_api_client, query_url):
+    # Verify unknown response format is rejected with 406
+    LOGGER.info("test_brainbox_api_query_unknown_format()")
+    payload = {"sql": "SELECT bill_id FROM custom_csv LIMIT 1"}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, params = {"format": "xml"}, json = payload, timeout = 10)
+
+    # assert check
+    expected_pattern = ".+error.+NotAcceptable.+"
+    LOGGER.info(response.text)
+    assert response.status_code == 406
+    assert re.match(expected_pattern, response.text), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_query_max_rows(brainbox_api_client, query_url):
+    # Verify max_rows caps the result, and a non-positive max_rows is rejected instead of lifting the cap
+    LOGGER.info("test_brainbox_api_query_max_rows()")
+    payload = {"sql": "SELECT bill_id FROM custom_csv", "max_rows": 2}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, json = payload, timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["rowcount"] == 2
+
+    for max_rows in [-1, 0]:
+        for params in [{}, {"format": "ndjson"}]:
+            # send POST to endpoint query
+            response = brainbox_api_client.post(query_url, params = params,
+                                                json = {**payload, "max_rows": max_rows}, timeout = 10)
+
+            # assert check
+            LOGGER.info(response.text)
+            assert response.status_code == 422
+
+def test_brainbox_api_query_blob(brainbox_api_client, query_url):
+    # Verify BLOB cells are returned hex encoded in every JSON format
+    LOGGER.info("test_brainbox_api_query_blob()")
+    payload = {"sql": "SELECT x'41ff' AS b"}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, json = payload, timeout = 10)
+    columnar = brainbox_api_client.post(query_url, params = {"format": "columnar"}, json = payload, timeout = 10)
+    ndjson = brainbox_api_client.post(query_url, params = {"format": "ndjson"}, json = payload, timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["rows"] == [["41ff"]]
+    assert columnar.status_code == 200
+    assert columnar.json()["values"] == [["41ff"]]
+    assert ndjson.status_code == 200
+    assert json.loads(ndjson.text.splitlines()[1]) == ["41ff"]
+
+def test_brainbox_api_query_msgpack(brainbox_api_client, query_url):
+    # Verify MessagePack result by Accept header; unknown Accept types fall back to JSON
+    LOGGER.info("test_brainbox_api_query_msgpack()")
+    payload = {"sql": "SELECT bill_id FROM custom_csv LIMIT 2"}
+    # send POST to endpoint query
+    response = brainbox_api_client.post(query_url, headers = {"Accept": "application/msgpack"}, json = payload, timeout = 10)
+    fallback = brainbox_api_client.post(query_url, headers = {"Accept": "text/xml, */*"}, json = payload, timeout = 10)
+
+    # assert check
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/msgpack")
+    LOGGER.info(fallback.text)
+    assert fallback.status_code == 200
+    assert fallback.json()["rowcount"] == 2
+
+def test_brainbox_api_query_ndjson_abandoned_streams(brainbox_api_client, query_url):
+    # Verify NDJSON streams dropped by the client give their stream slot back (more drops than BRAINBOX_MAX_STREAMS)
+    LOGGER.info("test_brainbox_api_query_ndjson_abandoned_streams()")
+    payload = {"sql": "SELECT * FROM custom_csv"}
+    for _ in range(40):
+        # send POST to endpoint query, then hang up without reading the body
+        with requests.Session() as session:
+            response = session.post(query_url, params = {"format": "ndjson"}, json = payload, stream = True, timeout = 10)
+            assert response.status_code == 200
+            response.close()
+    response = brainbox_api_client.post(query_url, params = {"format": "ndjson"},
+                                        json = {"sql": "SELECT 1 AS one"}, timeout = 10)
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1]) == {"rowcount": 1}
@@ -0,0 +1,60 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - rollups
+# Gang Hu 
+# --------------------------------
+# modules
+import pytest
+import re
+import logging
+import requests
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+# -------------------------------------------------
+@pytest.fixture(scope="session")
+def rollups_url():
+    return "http://localhost:8000/rollups"
+
+@pytest.fixture(scope="session")
+def query_url():
+    return "http://localhost:8000/athena/query"
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers 
+    session = requests.Session()
+    #
+    yield session
+    # tear down
+    session.close()
+
+def test_brainbox_api_rollups_match_table(brainbox_api_client, rollups_url, query_url):
+    # Verify rollup groups agree with a GROUP BY over custom_csv
+    LOGGER.info("test_brainbox_api_rollups_match_table()")
+    # send GET to endpoint rollups, and the same aggregate through SQL query
+    response = brainbox_api_client.get(rollups_url, timeout = 10)
+    payload = {"sql": "SELECT building_id, usage_type, substr(start_date, 1, 7), COUNT(*) FROM custom_csv "
+                      "GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"}
+    expected = brainbox_api_client.post(query_url, json = payload, timeout = 10).json()["rows"]
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    groups = response.json()["rollups"]
+    assert [[g["building_id"], g["usage_type"], g["month"], g["bill_count"]] for g in groups] == expected
+
+def test_brainbox_api_rollups_rebuild(brainbox_api_client, rollups_url):
+    # Verify rebuild recomputes the same groups as the incremental maintenance
+    LOGGER.info("test_brainbox_api_rollups_rebuild()")
+    before = brainbox_api_client.get(rollups_url, timeout = 10).json()
+    # send POST to endpoint rollups rebuild
+    response = brainbox_api_client.post(rollups_url + "/rebuild", timeout = 10)
+    after = brainbox_api_client.get(rollups_url, params = {"month_from": "1900-01"}, timeout = 10).json()
+
+    # assert check
+    expected_pattern = ".+table.+custom_csv_rollup.+groups.+"
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert re.match(expected_pattern, response.text), f"Does not match the test pattern '{expected_pattern}'"
+    assert response.json()["groups"] == before["rowcount"]
+    assert after["rollups"] == before["rollups"]
@@ -0,0 +1,164 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Integration API Test - other registered layouts (?schema=)
+# Gang Hu
+# --------------------------------
+# Only the bills layout is registered in the API itself. These tests start two more API
+# instances that register a test-only layout (qa_readings) before the app is imported:
+# one on the sequential parse path, one with the process-pool path forced on (see
+# test_int_parallel.py), and run ?schema=qa_readings ingests end to end.
+# modules
+import pytest
+import re
+import logging
+import requests
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+API_DIR = Path(__file__).resolve().parents[2] / "brainbox_local_api"
+LAYOUT = "qa_readings"
+# reading_id, meter_id, read_on required; kwh, read_at, note nullable
+LAUNCH = f"""
+import sys, uvicorn
+from app.schemas import Column, Schema, register_schema
+register_schema(Schema("{LAYOUT}", [Column("reading_id"), Column("meter_id", "integer"), Column("read_on", "date"),
+                                   Column("kwh", "integer", nullable=True), Column("read_at", "date", nullable=True),
+                                   Column("note", nullable=True)]))
+uvicorn.run("app.main:app", port=int(sys.argv[1]))
+"""
+# -------------------------------------------------
+def start_api(env):
+    # API instance on a free port with the qa_readings layout registered
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "-c", LAUNCH, str(port)], cwd = API_DIR, env = {**os.environ, **env},
+                              stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    base_url = f"http://localhost:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(base_url + "/health", timeout = 1).status_code == 200:
+                return server, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    pytest.fail("API instance with the qa_readings layout did not start")
+
+@pytest.fixture(scope="module")
+def layout_api():
+    # tear up
+    server, base_url = start_api({})
+    yield base_url
+    # tear down
+    server.terminate()
+    server.wait(timeout = 10)
+
+@pytest.fixture(scope="module")
+def layout_parallel_api():
+    # tear up - parallel path forced on, a few rows per range
+    server, base_url = start_api({"BRAINBOX_PARALLEL_MIN_BYTES": "1", "BRAINBOX_PARSE_CHUNK_BYTES": "300",
+                                  "BRAINBOX_PARSE_WORKERS": "2"})
+    yield base_url
+    # tear down
+    server.terminate()
+    server.wait(timeout = 10)
+
+@pytest.fixture(scope="function")
+def brainbox_api_client():
+    # tear up - define requests default session with headers
+    session = requests.Session()
+    yield session
+    # tear down
+    session.close()
+
+def readings_csv(prefix, count, bad = ()):
+    # columns in another order than declared; every other row leaves the nullable cells empty,
+    # notes hold quoted newlines; rows in `bad` get a non-integer kwh
+    lines = ["note,reading_id,meter_id,read_on,kwh,read_at"]
+    for i in range(count):
+        kwh = "x" if i in bad else ("" if i % 2 else str(10 + i))
+        read_at = "" if i % 2 else "20240302"
+        note = "" if i % 2 else f'"line 1\nline {i}"'
+        lines.append(f"{note},{prefix}-{i},{500 + i},2024-03-01,{kwh},{read_at}")
+    return ("\n".join(lines) + "\n").encode()
+
+def test_brainbox_api_schema_upload_other_layout(brainbox_api_client, layout_api):
+    LOGGER.info("test_brainbox_api_schema_upload_other_layout()")
+    prefix = "QAR-" + uuid.uuid4().hex[:8]
+    files = {'file': (f"{prefix}.csv", readings_csv(prefix, 2))}
+    # send POST to endpoints validate and upload with ?schema=qa_readings
+    validate = brainbox_api_client.post(layout_api + "/validate/", params = {"schema": LAYOUT}, files = files)
+    response = brainbox_api_client.post(layout_api + "/upload/", params = {"schema": LAYOUT}, files = files)
+    rows = brainbox_api_client.post(layout_api + "/athena/query", json = {
+        "sql": f"SELECT * FROM {LAYOUT} WHERE reading_id LIKE ? ORDER BY reading_id", "params": [prefix + "-%"]},
+        timeout = 10).json()["rows"]
+    in_bills = brainbox_api_client.post(layout_api + "/athena/query", json = {
+        "sql": "SELECT COUNT(*) FROM custom_csv WHERE bill_id LIKE ?", "params": [prefix + "-%"]}, timeout = 10)
+
+    # assert check: rows in declared column order, empty nullable cells NULL, nothing in custom_csv
+    LOGGER.info(response.text)
+    assert validate.status_code == 200 and validate.json()["rows_checked"] == 2
+    assert response.status_code == 200
+    assert re.match(".+status.+ok.+stored.+crawler_marker.+rows_inserted.+2.+schema.+qa_readings.+table.+qa_readings.+",
+                    response.text)
+    assert rows == [[f"{prefix}-0", 500, "2024-03-01", 10, "2024-03-02", "line 1\nline 0"],
+                    [f"{prefix}-1", 501, "2024-03-01", None, None, None]]
+    assert in_bills.json()["rows"][0][0] == 0
+    catalog = brainbox_api_client.get(f"{layout_api}/catalog/{prefix}.csv").json()
+    LOGGER.info(catalog)
+    assert catalog["valid"] is True and catalog["row_count"] == 2
+
+def test_brainbox_api_schema_rejects(brainbox_api_client, layout_api):
+    LOGGER.info("test_brainbox_api_schema_rejects()")
+    prefix = "QAR-" + uuid.uuid4().hex[:8]
+    bills = b"bill_id,meter_id,usage_type,building_id,start_date,end_date\nb1,1,water,1,2024-01-01,2024-01-31\n"
+    # send POST to endpoint upload / validate: a bills file as qa_readings, bad nullable cells, the main API
+    wrong = brainbox_api_client.post(layout_api + "/upload/", params = {"schema": LAYOUT},
+                                     files = {'file': (f"{prefix}.csv", bills)})
+    bad = brainbox_api_client.post(layout_api + "/validate/", params = {"schema": LAYOUT}, files = {'file': (
+        f"{prefix}.csv", readings_csv(prefix, 2).replace(b",,\n", b",7.5,2024-99-01\n"))})
+    unknown = brainbox_api_client.post("http://localhost:8000/validate/", params = {"schema": LAYOUT},
+                                       files = {'file': (f"{prefix}.csv", readings_csv(prefix, 2))})
+
+    # assert check
+    LOGGER.info(bad.text)
+    assert wrong.status_code == 422 and re.match(".+InvalidSchema.+missing.+reading_id.+", wrong.text)
+    assert bad.status_code == 422
+    assert [(e["row"], e["field"], e["expected"]) for e in bad.json()["errors"]] == [
+        (2, "kwh", "integer"), (2, "read_at", "ISO date")]
+    assert unknown.status_code == 400 and re.match(".+UnknownSchema.+registered.+bills.+", unknown.text)
+
+def test_brainbox_api_schema_parallel_matches_sequential(brainbox_api_client, layout_api, layout_parallel_api):
+    LOGGER.info("test_brainbox_api_schema_parallel_matches_sequential()")
+    prefix = "QAR-" + uuid.uuid4().hex[:8]
+    content = readings_csv(prefix, 200, bad = (41, 150))
+    # send POST to endpoint validate on both instances (the parse workers get the layout with each range)
+    sequential = brainbox_api_client.post(layout_api + "/validate/", params = {"schema": LAYOUT},
+                                          files = {'file': (f"{prefix}.csv", content)})
+    parallel = brainbox_api_client.post(layout_parallel_api + "/validate/", params = {"schema": LAYOUT},
+                                        files = {'file': (f"{prefix}.csv", content)})
+
+    # assert check
+    LOGGER.info(parallel.text)
+    assert parallel.status_code == 422
+    assert [(e["row"], e["field"]) for e in parallel.json()["errors"]] == [(42, "kwh"), (151, "kwh")]
+    assert parallel.json() == sequential.json()
+
+    # send POST to endpoint upload on the parallel instance, then read the rows back
+    response = brainbox_api_client.post(layout_parallel_api + "/upload/", params = {"schema": LAYOUT},
+                                        files = {'file': (f"{prefix}.csv", readings_csv(prefix, 200))})
+    loaded = brainbox_api_client.post(layout_parallel_api + "/athena/query", json = {
+        "sql": f"SELECT reading_id, kwh, note FROM {LAYOUT} WHERE reading_id LIKE ? ORDER BY rowid",
+        "params": [prefix + "-%"], "max_rows": 1000}, timeout = 10).json()["rows"]
+
+    # assert check: every row, in file order
+    LOGGER.info(response.text)
+    assert response.status_code == 200 and response.json()["rows_inserted"] == 200
+    assert loaded == [[f"{prefix}-{i}", None if i % 2 else 10 + i, None if i % 2 else f"line 1\nline {i}"]
+                      for i in range(200)]
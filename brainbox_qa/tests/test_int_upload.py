@@ -10,6 +10,9 @@ import logging
 import requests
 import os
 import json
+import time
+import gzip
+import uuid
 from pathlib import Path
 
 LOGGER = logging.getLogger(__name__) # use config in pytest.ini
@@ -117,3 +120,377 @@ def test_brainbox_api_upload_empty_csv(brainbox_api_client, upload_url, empty_up
     assert response.status_code == 422 
     assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
     # {"error":"InvalidSchema","missing":["building_id"],"extra":[]}
+
+def test_brainbox_api_upload_async_job_ok_csv(brainbox_api_client, upload_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_async_job_ok_csv()")
+    #
+    with open(valid_upload_file, 'rb') as file_obj:
+        # variables
+        files = {'file': file_obj}
+        data = {}
+
+        # send POST to endpoint (async ingest - returns a job id right away)
+        response = brainbox_api_client.post(upload_url, params = {"async": "true"}, files = files, data = data)
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    # poll job status until the background worker is done
+    job_url = "http://localhost:8000/jobs/" + job_id
+    for _ in range(50):
+        job = brainbox_api_client.get(job_url, timeout = 10)
+        if job.json()["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.1)
+
+    # assert check
+    expected_pattern = ".+status.+succeeded.+rows_validated.+3.+rows_inserted.+3.+stored.+local_state/uploads.+"
+    actual_result = str(job.text)
+    LOGGER.info(actual_result)
+    #
+    assert job.status_code == 200
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_upload_async_job_failed_after_first_batch(brainbox_api_client, upload_url, query_url):
+    LOGGER.info("test_brainbox_api_upload_async_job_failed_after_first_batch()")
+    prefix = "JOB-" + uuid.uuid4().hex[:8]
+    rows = [(f"{prefix}-{i}", 100 + i, "water", 7, "2024-01-01", "2024-01-31") for i in range(50_010)]
+    rows[50_005] = (f"{prefix}-bad", "x12", "water", 7, "2024-01-01", "2024-01-31")  # in the second 50k batch
+    # send POST to endpoint (async ingest), then poll the job
+    response = brainbox_api_client.post(upload_url, params = {"async": "true"}, files = {'file': (f"{prefix}.csv", bills_csv(rows))})
+    assert response.status_code == 202
+    job_url = "http://localhost:8000/jobs/" + response.json()["job_id"]
+    for _ in range(300):
+        job = brainbox_api_client.get(job_url, timeout = 10).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.1)
+
+    # assert check: the first batch was sent to the insert, but the load rolled back
+    LOGGER.info({k: v for k, v in job.items() if k != "error"})
+    assert job["status"] == "failed" and job["error_status"] == 422
+    assert job["error"]["row"] == 50_006
+    assert job["rows_validated"] == 50_010
+    assert job["rows_inserted"] == 0
+    assert count_prefix(brainbox_api_client, query_url, prefix) == 0
+
+def test_brainbox_api_upload_bulk_ok_csv(brainbox_api_client, upload_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_bulk_ok_csv()")
+    #
+    with open(valid_upload_file, 'rb') as file_obj:
+        # variables
+        files = {'file': file_obj}
+        data = {}
+
+        # send POST to endpoint (bulk load - batched insert, reports load timings)
+        response = brainbox_api_client.post(upload_url, params = {"bulk": "true"}, files = files, data = data)
+
+    # assert check
+    expected_pattern = ".+status.+ok.+rows_inserted.+3.+load.+rows_per_s.+indexes_deferred.+"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    #
+    assert response.status_code == 200
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+
+def test_brainbox_api_upload_ingest_stored_key(brainbox_api_client, upload_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_ingest_stored_key()")
+    #
+    with open(valid_upload_file, 'rb') as file_obj:
+        brainbox_api_client.post(upload_url, files = {'file': file_obj}, data = {})
+
+    # ingest the stored upload again by key (memory-mapped, no file sent)
+    response = brainbox_api_client.post("http://localhost:8000/uploads/valid_1.csv/ingest")
+    missing = brainbox_api_client.post("http://localhost:8000/uploads/no_such_file.csv/ingest")
+
+    # assert check
+    expected_pattern = ".+status.+ok.+stored.+local_state/uploads/valid_1.csv.+rows_inserted.+3.*"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    LOGGER.info(missing.text)
+    #
+    assert response.status_code == 200
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+    assert missing.status_code == 404
+    assert re.match(".+NoSuchKey.+", missing.text)
+
+def test_brainbox_api_upload_multipart_then_ingest(brainbox_api_client, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_multipart_then_ingest()")
+    base_url = "http://localhost:8000/uploads/multipart_1.csv"
+    with open(valid_upload_file, 'rb') as file_obj:
+        content = file_obj.read()
+    half = len(content) // 2
+
+    # S3-style multipart: create, upload two parts (out of order), complete, then ingest by key
+    upload_id = brainbox_api_client.post(base_url + "/multipart").json()["upload_id"]
+    part_2 = brainbox_api_client.put(f"{base_url}/multipart/{upload_id}/parts/2", files = {'file': content[half:]})
+    part_1 = brainbox_api_client.put(f"{base_url}/multipart/{upload_id}/parts/1", files = {'file': content[:half]})
+    complete = brainbox_api_client.post(f"{base_url}/multipart/{upload_id}/complete")
+    response = brainbox_api_client.post(base_url + "/ingest")
+
+    # assert check
+    LOGGER.info(complete.text)
+    LOGGER.info(response.text)
+    assert part_1.status_code == 200 and part_2.status_code == 200
+    assert complete.status_code == 200
+    assert complete.json()["size"] == len(content)
+    assert response.status_code == 200
+    assert re.match(".+status.+ok.+stored.+local_state/uploads/multipart_1.csv.+rows_inserted.+3.*", response.text)
+
+def test_brainbox_api_upload_multipart_complete_catalogs_object(brainbox_api_client, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_multipart_complete_catalogs_object()")
+    name = f"mp_{uuid.uuid4().hex[:8]}.csv"
+    base_url = f"http://localhost:8000/uploads/{name}"
+    with open(valid_upload_file, 'rb') as file_obj:
+        content = file_obj.read()
+
+    # S3-style multipart in one part, complete, then read its catalog entry (no ingest)
+    upload_id = brainbox_api_client.post(base_url + "/multipart").json()["upload_id"]
+    brainbox_api_client.put(f"{base_url}/multipart/{upload_id}/parts/1", files = {'file': content})
+    complete = brainbox_api_client.post(f"{base_url}/multipart/{upload_id}/complete")
+    entry = brainbox_api_client.get(f"http://localhost:8000/catalog/{name}", timeout = 10)
+    last_run = brainbox_api_client.get("http://localhost:8000/catalog", timeout = 10).json()["last_run"]
+
+    # assert check: cataloged at complete time by a crawl of that key alone
+    LOGGER.info(complete.text)
+    LOGGER.info(entry.text)
+    assert complete.status_code == 200
+    assert re.match(".+crawler_marker.+local_state/glue/bills_crawler_.+", complete.text)
+    assert entry.status_code == 200
+    assert entry.json()["sha256"] == complete.json()["sha256"]
+    assert entry.json()["valid"] is True and entry.json()["row_count"] == 3
+    assert (last_run["scanned"], last_run["added"]) == (1, 1)
+
+def test_brainbox_api_upload_batch_per_file_status(brainbox_api_client, valid_upload_file, invalid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_batch_per_file_status()")
+    with open(valid_upload_file, 'rb') as valid_obj, open(invalid_upload_file, 'rb') as invalid_obj:
+        valid, invalid = valid_obj.read(), invalid_obj.read()
+
+    # send POST to batch endpoint - two valid files and one invalid, as multiple parts
+    files = [('files', ('batch_1.csv', valid)), ('files', ('batch_2.csv', valid)), ('files', ('batch_3.csv', invalid))]
+    response = brainbox_api_client.post("http://localhost:8000/upload/batch", files = files)
+
+    # assert check
+    LOGGER.info(response.text)
+    result = response.json()
+    assert response.status_code == 200
+    assert result["status"] == "partial"
+    assert result["files_loaded"] == 2 and result["files_failed"] == 1
+    assert [f["status"] for f in result["files"]] == [200, 200, 422]
+    assert re.match(".+crawler_marker.+local_state/glue/bills_crawler_.+files_per_s.+", response.text)
+
+def test_brainbox_api_upload_gzip_csv(brainbox_api_client, upload_url, validate_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_gzip_csv()")
+    with open(valid_upload_file, 'rb') as file_obj:
+        content = gzip.compress(file_obj.read())
+
+    # send POST to endpoints validate and upload with a gzip-compressed csv, plus a truncated one
+    validate = brainbox_api_client.post(validate_url, files = {'file': ('valid_1.csv.gz', content)})
+    response = brainbox_api_client.post(upload_url, files = {'file': ('valid_1.csv.gz', content)})
+    truncated = brainbox_api_client.post(upload_url, files = {'file': ('broken_1.csv.gz', content[:20])})
+
+    # assert check
+    expected_pattern = ".+status.+ok.+stored.+local_state/uploads/valid_1.csv.gz.+rows_inserted.+3.*"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    LOGGER.info(truncated.text)
+    #
+    assert validate.status_code == 200
+    assert response.status_code == 200
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+    assert truncated.status_code == 400
+    assert re.match(".+InvalidCompression.+", truncated.text)
+
+def test_brainbox_api_upload_dates_stored_canonical(brainbox_api_client, upload_url, validate_url, query_url):
+    LOGGER.info("test_brainbox_api_upload_dates_stored_canonical()")
+    # every form date.fromisoformat/datetime.fromisoformat accepts is valid; it is stored as its isoformat()
+    prefix = "CAN-" + uuid.uuid4().hex[:8]
+    content = (f"bill_id,meter_id,usage_type,building_id,start_date,end_date\n"
+               f"{prefix}-1,1,water,1,20240201,2024-02-29\n"
+               f"{prefix}-2,1,water,1,2024-W05-4,2024-02-01T06:30\n"
+               f"{prefix}-3,1,water,1,2024-02-01,2024-02-01 06:30:00\n").encode()
+    # send POST to endpoints validate and upload, then read the rows back
+    validate = brainbox_api_client.post(validate_url, files = {'file': (f"{prefix}.csv", content)})
+    response = brainbox_api_client.post(upload_url, files = {'file': (f"{prefix}.csv", content)})
+    rows = brainbox_api_client.post(query_url, json = {
+        "sql": "SELECT start_date, end_date FROM custom_csv WHERE bill_id LIKE ? ORDER BY bill_id",
+        "params": [prefix + "-%"]}, timeout = 10).json()["rows"]
+
+    # assert check: the loaded rows and the catalog date range hold canonical ISO text, so text order is date order
+    LOGGER.info(response.text)
+    assert validate.status_code == 200 and response.status_code == 200
+    assert rows == [["2024-02-01", "2024-02-29"], ["2024-02-01", "2024-02-01T06:30:00"],
+                    ["2024-02-01", "2024-02-01T06:30:00"]]
+    catalog = brainbox_api_client.get(f"http://localhost:8000/catalog/{prefix}.csv").json()
+    LOGGER.info(catalog)
+    assert (catalog["min_end_date"], catalog["max_end_date"]) == ("2024-02-01T06:30:00", "2024-02-29")
+
+def test_brainbox_api_upload_with_validation_token(brainbox_api_client, upload_url, validate_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_with_validation_token()")
+    with open(valid_upload_file, 'rb') as file_obj:
+        content = file_obj.read()
+
+    # /validate returns a token; /upload with it skips re-validation, a wrong token falls back to a full check
+    token = brainbox_api_client.post(validate_url, files = {'file': ('valid_1.csv', content)}).json()["validation_token"]
+    response = brainbox_api_client.post(upload_url, params = {"validation_token": token}, files = {'file': ('valid_1.csv', content)})
+    mismatch = brainbox_api_client.post(upload_url, params = {"validation_token": "0" * 64}, files = {'file': ('valid_1.csv', content)})
+
+    # assert check
+    LOGGER.info(response.text)
+    LOGGER.info(mismatch.text)
+    assert response.status_code == 200 and mismatch.status_code == 200
+    assert re.match(".+status.+ok.+rows_inserted.+3.+validation.+token.*", response.text)
+    assert mismatch.json()["validation"] == "full"
+
+# Upsert / dedupe ------------------------------------
+# The QA database is shared and holds repeated bill_ids from the append tests, so these tests write
+# their own run-unique bill_ids and upsert on a dedicated key (bill_id, meter_id) whose UNIQUE index is
+# dropped again afterwards, leaving append uploads of duplicates working for the other tests.
+UPSERT_KEY = "bill_id,meter_id"
+
+def bills_csv(rows):
+    header = "bill_id,meter_id,usage_type,building_id,start_date,end_date\n"
+    return (header + "".join(",".join(map(str, row)) + "\n" for row in rows)).encode()
+
+@pytest.fixture(scope="function")
+def upsert_rows():
+    prefix = "UPS-" + uuid.uuid4().hex[:8]
+    building_id = 10_000_000 + int(prefix[-6:], 16)  # own building, so its rollup groups are only these rows
+    return prefix, [(f"{prefix}-{i}", 100 + i, "electricity", building_id, "2024-03-01", "2024-03-31") for i in range(3)]
+
+@pytest.fixture(scope="function")
+def upsert_key_index(brainbox_api_client):
+    yield UPSERT_KEY
+    # tear down - drop the UNIQUE index the upsert created
+    brainbox_api_client.delete("http://localhost:8000/db/indexes/uq_custom_csv_bill_id_meter_id")
+
+def count_prefix(client, query_url, prefix, usage_type = None):
+    sql = "SELECT COUNT(*) FROM custom_csv WHERE bill_id LIKE ?" + (" AND usage_type = ?" if usage_type else "")
+    params = [prefix + "-%"] + ([usage_type] if usage_type else [])
+    return client.post(query_url, json = {"sql": sql, "params": params}, timeout = 10).json()["rows"][0][0]
+
+def test_brainbox_api_upload_upsert_duplicate_keys(brainbox_api_client, upload_url, query_url, valid_upload_file, upsert_rows):
+    LOGGER.info("test_brainbox_api_upload_upsert_duplicate_keys()")
+    prefix, rows = upsert_rows
+    # make sure custom_csv repeats bill_ids: append the same file twice
+    for _ in range(2):
+        with open(valid_upload_file, 'rb') as file_obj:
+            assert brainbox_api_client.post(upload_url, files = {'file': file_obj}).status_code == 200
+
+    # send POST to endpoint upload - upsert on the default key (bill_id) cannot build its UNIQUE index
+    response = brainbox_api_client.post(upload_url, params = {"mode": "upsert"},
+                                        files = {'file': (f"{prefix}.csv", bills_csv(rows))})
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 409
+    assert re.match(".+error.+DuplicateKeys.+dedupe.+", response.text)
+    assert count_prefix(brainbox_api_client, query_url, prefix) == 0  # nothing loaded
+
+def test_brainbox_api_upload_upsert_overwrites_and_skips(brainbox_api_client, upload_url, query_url, upsert_rows, upsert_key_index):
+    LOGGER.info("test_brainbox_api_upload_upsert_overwrites_and_skips()")
+    prefix, rows = upsert_rows
+    # append the rows twice, then /db/dedupe on the key keeps one (the latest) row per key value
+    for _ in range(2):
+        response = brainbox_api_client.post(upload_url, files = {'file': (f"{prefix}.csv", bills_csv(rows))})
+        assert response.status_code == 200
+    response = brainbox_api_client.post("http://localhost:8000/db/dedupe", params = {"key": upsert_key_index})
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert response.json()["key"] == ["bill_id", "meter_id"]
+    assert response.json()["rows_deleted"] >= len(rows)
+    assert count_prefix(brainbox_api_client, query_url, prefix) == len(rows)
+
+    # send POST to endpoint upload - upsert with changed usage_type overwrites instead of duplicating
+    changed = bills_csv([(b, m, "water", bld, s, e) for b, m, _, bld, s, e in rows])
+    response = brainbox_api_client.post(upload_url, params = {"mode": "upsert", "key": upsert_key_index},
+                                        files = {'file': (f"{prefix}.csv", changed)})
+
+    # assert check
+    LOGGER.info(response.text)
+    result = response.json()
+    assert response.status_code == 200
+    assert result["mode"] == "upsert" and result["rows_inserted"] == len(rows)
+    assert count_prefix(brainbox_api_client, query_url, prefix) == len(rows)
+    assert count_prefix(brainbox_api_client, query_url, prefix, "water") == len(rows)
+    rollups = brainbox_api_client.get("http://localhost:8000/rollups", params = {"building_id": rows[0][3]}).json()
+    LOGGER.info(rollups)
+    assert [(r["usage_type"], r["bill_count"]) for r in rollups["rollups"]] == [("water", len(rows))]
+
+    # send POST to endpoint upload - the same bytes again are not parsed: earlier result, "skipped": true
+    again = brainbox_api_client.post(upload_url, params = {"mode": "upsert", "key": upsert_key_index},
+                                     files = {'file': (f"{prefix}.csv", changed)})
+
+    # assert check
+    LOGGER.info(again.text)
+    assert again.status_code == 200
+    assert again.json()["skipped"] is True and again.json()["rows_inserted"] == 0
+    assert again.json()["content_hash"] == result["content_hash"]
+    assert count_prefix(brainbox_api_client, query_url, prefix) == len(rows)
+
+def test_brainbox_api_upload_failed_upsert_leaves_no_key_index(brainbox_api_client, upload_url, query_url, upsert_rows, upsert_key_index):
+    LOGGER.info("test_brainbox_api_upload_failed_upsert_leaves_no_key_index()")
+    prefix, rows = upsert_rows
+    # custom_csv must not repeat the key, or the upsert stops at its UNIQUE index (409) before any row
+    assert brainbox_api_client.post("http://localhost:8000/db/dedupe", params = {"key": upsert_key_index}).status_code == 200
+    bad = bills_csv(rows + [(f"{prefix}-bad", "x12", "gas", rows[0][3], "2024-03-01", "2024-03-31")])
+    # send POST to endpoint upload - an upsert whose last row fails validation
+    response = brainbox_api_client.post(upload_url, params = {"mode": "upsert", "key": upsert_key_index},
+                                        files = {'file': (f"{prefix}.csv", bad)})
+
+    # assert check: 422, and the UNIQUE index the upsert built went with the rolled-back load
+    LOGGER.info(response.text)
+    assert response.status_code == 422
+    indexes = brainbox_api_client.get("http://localhost:8000/db/indexes").json()
+    assert "uq_custom_csv_bill_id_meter_id" not in [ix["name"] for ix in indexes["indexes"] if ix["present"]]
+
+    # send POST to endpoint upload and upload/batch - plain appends that repeat a key still load
+    for _ in range(2):
+        response = brainbox_api_client.post(upload_url, files = {'file': (f"{prefix}.csv", bills_csv(rows))})
+        LOGGER.info(response.text)
+        assert response.status_code == 200
+    response = brainbox_api_client.post("http://localhost:8000/upload/batch",
+                                        files = [('files', (f"{prefix}-b.csv", bills_csv(rows)))])
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 200
+    assert count_prefix(brainbox_api_client, query_url, prefix) == 3 * len(rows)
+
+def test_brainbox_api_upload_append_repeating_unique_key(brainbox_api_client, upload_url, query_url, upsert_rows, upsert_key_index):
+    LOGGER.info("test_brainbox_api_upload_append_repeating_unique_key()")
+    prefix, rows = upsert_rows
+    # an upsert builds the UNIQUE index on the key (once custom_csv no longer repeats it)
+    assert brainbox_api_client.post("http://localhost:8000/db/dedupe", params = {"key": upsert_key_index}).status_code == 200
+    response = brainbox_api_client.post(upload_url, params = {"mode": "upsert", "key": upsert_key_index},
+                                        files = {'file': (f"{prefix}.csv", bills_csv(rows))})
+    assert response.status_code == 200
+    # send POST to endpoint upload and upload/batch - appends repeating that key
+    appended = brainbox_api_client.post(upload_url, files = {'file': (f"{prefix}-again.csv", bills_csv(rows))})
+    batch = brainbox_api_client.post("http://localhost:8000/upload/batch",
+                                     files = [('files', (f"{prefix}-b.csv", bills_csv(rows)))])
+
+    # assert check: 409 DuplicateKeys instead of a 500, nothing appended
+    LOGGER.info(appended.text)
+    LOGGER.info(batch.text)
+    assert appended.status_code == 409 and batch.status_code == 409
+    assert re.match(".+error.+DuplicateKeys.+UNIQUE.+", appended.text)
+    assert batch.json()["error"] == "DuplicateKeys"
+    assert count_prefix(brainbox_api_client, query_url, prefix) == len(rows)
+
+def test_brainbox_api_upload_upsert_bad_key(brainbox_api_client, upload_url, valid_upload_file):
+    LOGGER.info("test_brainbox_api_upload_upsert_bad_key()")
+    with open(valid_upload_file, 'rb') as file_obj:
+        # send POST to endpoint upload with a key column that does not exist
+        response = brainbox_api_client.post(upload_url, params = {"mode": "upsert", "key": "bill_id,nope"},
+                                            files = {'file': file_obj})
+    dedupe = brainbox_api_client.post("http://localhost:8000/db/dedupe", params = {"key": "nope"})
+
+    # assert check
+    LOGGER.info(response.text)
+    assert response.status_code == 400 and dedupe.status_code == 400
+    assert re.match(".+error.+InvalidKey.+", response.text)
+
+# Second registered layout ------------------------------------
@@ -10,6 +10,8 @@ import logging
 import requests
 import os
 import json
+import random
+from datetime import date, timedelta
 from pathlib import Path
 
 LOGGER = logging.getLogger(__name__) # use config in pytest.ini
@@ -160,3 +162,79 @@ def test_brainbox_api_validate_empty_csv(brainbox_api_client, validate_url, empt
     #assert re.match(expected_pattern1, actual_result), f"Does not match the test pattern '{expected_pattern1}'"
     assert re.match(expected_pattern2, actual_result), f"Does not match the test pattern '{expected_pattern2}'"
     # {"error":"InvalidSchema","missing":["building_id"],"extra":[]}
+
+def test_brainbox_api_validate_fail_wrong_datatype_after_row_100_csv(brainbox_api_client, validate_url):
+    LOGGER.info("test_brainbox_api_validate_fail_wrong_datatype_after_row_100_csv()")
+    # csv file - 150 data rows, bad meter_id at row 120 and bad start_date at row 150 (whole file is checked)
+    with open("./tests/data/invalid_3.csv", 'rb') as file_obj:
+        # variables
+        files = {'file': file_obj}
+        data = {}
+
+        # send POST to endpoint
+        response = brainbox_api_client.post(validate_url, files = files, data = data)
+
+    # assert check
+    expected_pattern = ".+error.+InvalidType.+row.+120.+field.+meter_id.+error_count.+2.+row.+150.+field.+start_date.+"
+    actual_result = str(response.text)
+    LOGGER.info(actual_result)
+    #
+    assert response.status_code == 422
+    assert re.match(expected_pattern, actual_result), f"Does not match the test pattern '{expected_pattern}'"
+    # {"error":"InvalidType","row":120,"field":"meter_id","expected":"integer","error_count":2,"errors":[...],"errors_truncated":false}
+
+def test_brainbox_api_validate_header_and_sample_modes(brainbox_api_client, validate_url):
+    LOGGER.info("test_brainbox_api_validate_header_and_sample_modes()")
+    # csv file - 150 data rows, bad meter_id at row 120 and bad start_date at row 150
+    with open("./tests/data/invalid_3.csv", 'rb') as file_obj:
+        content = file_obj.read()
+
+    # send POST to endpoint with mode=header, mode=sample (first 100 rows, then first 130 rows)
+    header = brainbox_api_client.post(validate_url, params = {"mode": "header"}, files = {'file': ('invalid_3.csv', content)})
+    sample_100 = brainbox_api_client.post(validate_url, params = {"mode": "sample", "sample": 100}, files = {'file': ('invalid_3.csv', content)})
+    sample_130 = brainbox_api_client.post(validate_url, params = {"mode": "sample", "sample": 130}, files = {'file': ('invalid_3.csv', content)})
+
+    # assert check
+    LOGGER.info(header.text)
+    LOGGER.info(sample_100.text)
+    LOGGER.info(sample_130.text)
+    assert header.status_code == 200
+    assert re.match(".+CSV header is valid.+rows_checked.+0.+mode.+header.+", header.text)
+    assert sample_100.status_code == 200
+    assert sample_100.json()["rows_checked"] == 100
+    assert sample_130.status_code == 422
+    assert re.match(".+error.+InvalidType.+row.+120.+field.+meter_id.+error_count.+1.+", sample_130.text)
+
+def test_brainbox_api_validate_date_cache_stats(brainbox_api_client, validate_url):
+    LOGGER.info("test_brainbox_api_validate_date_cache_stats()")
+    stats_url = validate_url.replace("/validate/", "/stats")
+    # dates no other test uses: one lookup per distinct value per column, cached across requests
+    first = date(1000, 1, 1) + timedelta(days = random.randrange(300_000))
+    header = "bill_id,meter_id,usage_type,building_id,start_date,end_date\n"
+    small = (header + "".join(f"dc-{i},1,water,1,{first.isoformat()},{first:%Y%m%d}\n" for i in range(50))).encode()
+    before = brainbox_api_client.get(stats_url, timeout = 10).json()["date_cache"]
+    # send POST to endpoint validate twice: parsed once, then served from the cache
+    miss = brainbox_api_client.post(validate_url, files = {'file': ('dc_small.csv', small)})
+    middle = brainbox_api_client.get(stats_url, timeout = 10).json()["date_cache"]
+    hit = brainbox_api_client.post(validate_url, files = {'file': ('dc_small.csv', small)})
+    after = brainbox_api_client.get(stats_url, timeout = 10).json()["date_cache"]
+
+    # assert check
+    LOGGER.info(after)
+    assert miss.status_code == 200 and hit.status_code == 200
+    assert (middle["misses"] - before["misses"], middle["hits"] - before["hits"]) == (2, 0)
+    assert (after["misses"] - middle["misses"], after["hits"] - middle["hits"]) == (0, 2)
+
+    # send POST to endpoint validate with more distinct dates than the cache holds
+    days = after["maxsize"] + 100
+    large = (header + "".join(f"dc-{i},1,water,1,{first + timedelta(days = 1 + i)},{first.isoformat()}\n"
+                              for i in range(days))).encode()
+    response = brainbox_api_client.post(validate_url, files = {'file': ('dc_large.csv', large)})
+    full = brainbox_api_client.get(stats_url, timeout = 10).json()["date_cache"]
+
+    # assert check: the least recently used entries make room, the size stays at maxsize
+    LOGGER.info(full)
+    assert response.status_code == 200 and response.json()["rows_checked"] == days
+    assert full["misses"] - after["misses"] >= days
+    assert full["evictions"] - after["evictions"] >= 100
+    assert full["size"] == full["maxsize"]
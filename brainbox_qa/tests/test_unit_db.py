@@ -0,0 +1,100 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Unit Test - schema migrations and storage layouts (brainbox_local_api/app/db.py)
+# Gang Hu
+# --------------------------------
+# modules
+import pytest
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "brainbox_local_api"))
+from app import db
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+
+ROWS = [("b1", "1", "water", "1", "2024-01-05", "2024-01-31"), ("b2", "2", "gas", "1", "2024-02-03", "2024-02-29"),
+        ("b3", "3", "water", "2", "2024-03-01", "2024-03-31")]
+
+def sqlite_state(project_root):
+    conn = sqlite3.connect(db.get_db_path(project_root))
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        names = sorted(name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+        return version, names
+    finally:
+        conn.close()
+
+# -----------------
+def test_db_migrations_fresh(tmp_path):
+    LOGGER.info("test_db_migrations_fresh()")
+    db.init_db(tmp_path)
+    version, names = sqlite_state(tmp_path)
+    # assert check
+    assert version == db.SCHEMA_VERSION
+    assert {db.TABLE_NAME, db.INGEST_LOG_TABLE, db.ROLLUP_TABLE, *db.DEFAULT_INDEXES} <= set(names)
+
+def test_db_migration_failure_rolls_back(tmp_path, monkeypatch):
+    LOGGER.info("test_db_migration_failure_rolls_back()")
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (x)")
+        raise RuntimeError("crash during migration")
+    # v1 (indexes) runs, then the v2 step fails part-way
+    monkeypatch.setattr(db, "_MIGRATIONS", [db._MIGRATIONS[0], (2, broken)] + db._MIGRATIONS[2:])
+    with pytest.raises(RuntimeError):
+        db.init_db(tmp_path)
+    version, names = sqlite_state(tmp_path)
+
+    # assert check: nothing of the upgrade was committed, user_version included
+    LOGGER.info(names)
+    assert version == 0
+    assert names == []
+
+    # the next start runs the whole upgrade
+    monkeypatch.undo()
+    db.init_db(tmp_path)
+    assert sqlite_state(tmp_path)[0] == db.SCHEMA_VERSION
+
+def columns(project_root, sql):
+    cur = db.pool_for(project_root).reader().execute(sql)
+    cur.fetchall()
+    return [d[0] for d in cur.description]
+
+def test_db_select_star_same_in_both_layouts(tmp_path):
+    LOGGER.info("test_db_select_star_same_in_both_layouts()")
+    db.load_rows(tmp_path, ROWS)
+    table_columns = columns(tmp_path, f"SELECT * FROM {db.TABLE_NAME}")
+    db.migrate_layout(tmp_path, "partitioned")
+    cols, rows = db.run_select(tmp_path, f"SELECT * FROM {db.TABLE_NAME} ORDER BY bill_id")
+    _, march = db.run_select(tmp_path, f"SELECT bill_id, {db.PARTITION_COLUMN} FROM {db.MONTH_VIEW} "
+                                       f"WHERE {db.PARTITION_COLUMN} = '2024-03'")
+
+    # assert check: custom_csv reads the same as the table; the month column is on custom_csv_by_month only
+    LOGGER.info(cols)
+    assert db.storage_layout(tmp_path) == "partitioned"
+    assert table_columns == cols == list(db.BILLS.names)
+    assert [r[0] for r in rows] == ["b1", "b2", "b3"]
+    assert columns(tmp_path, f"SELECT * FROM {db.MONTH_VIEW}") == [*db.BILLS.names, db.PARTITION_COLUMN]
+    assert march == [("b3", "2024-03")]
+
+def test_db_migration_v4_month_view(tmp_path):
+    LOGGER.info("test_db_migration_v4_month_view()")
+    db.load_rows(tmp_path, ROWS)
+    db.migrate_layout(tmp_path, "partitioned")
+    # a v3 database: custom_csv itself carries bill_month, no custom_csv_by_month
+    with db.pool_for(tmp_path).writer() as conn:
+        conn.execute(f"DROP VIEW {db.MONTH_VIEW}")
+        conn.execute(f"DROP VIEW {db.TABLE_NAME}")
+        conn.execute(f"CREATE VIEW {db.TABLE_NAME} AS SELECT *, NULL AS {db.PARTITION_COLUMN} FROM {db.TEMPLATE_TABLE} "
+                     f"WHERE 0 UNION ALL " + " UNION ALL ".join(
+                         f"SELECT *, '{m}' FROM {db._partition_table(m)}" for m in ("2024-01", "2024-02", "2024-03")))
+        conn.execute("PRAGMA user_version = 3")
+    db._date_storage.pop(db.get_db_path(tmp_path))
+    db.init_db(tmp_path)
+
+    # assert check: the restart moved bill_month to custom_csv_by_month
+    assert sqlite_state(tmp_path)[0] == db.SCHEMA_VERSION
+    assert columns(tmp_path, f"SELECT * FROM {db.TABLE_NAME}") == list(db.BILLS.names)
+    assert columns(tmp_path, f"SELECT * FROM {db.MONTH_VIEW}") == [*db.BILLS.names, db.PARTITION_COLUMN]
@@ -0,0 +1,128 @@
+# ---------------------------------------
+# QA tech assignement for BrainBox AI - Aug 2025
+# Python Unit Test - schema registry (brainbox_local_api/app/schemas.py)
+# Gang Hu
+# --------------------------------
+# modules
+import pytest
+import logging
+import pickle
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "brainbox_local_api"))
+from app.schemas import BILLS, SCHEMAS, Column, Schema, get_schema, register_schema, schema_for_header
+from app.validators import TypeChecker, RowValidationError, column_rules, to_canonical, validate_header_exact
+
+LOGGER = logging.getLogger(__name__) # use config in pytest.ini
+
+@pytest.fixture(scope="function")
+def readings_schema():
+    # not registered: a layout with every column type, nullable and not
+    return Schema("readings", [Column("reading_id"), Column("meter_id", "integer"), Column("read_on", "date"),
+                               Column("kwh", "integer", nullable = True), Column("read_at", "date", nullable = True),
+                               Column("note", nullable = True)])
+
+@pytest.fixture(scope="function")
+def registered_readings(readings_schema):
+    # tear up - the readings layout as a second registered schema
+    yield register_schema(readings_schema)
+    # tear down
+    SCHEMAS.pop(readings_schema.name)
+
+# -----------------
+def test_schema_registry_bills_default():
+    LOGGER.info("test_schema_registry_bills_default()")
+    # assert check
+    assert get_schema("bills") is BILLS
+    assert BILLS.table == "custom_csv"
+    assert BILLS.names == ["bill_id", "meter_id", "usage_type", "building_id", "start_date", "end_date"]
+    assert BILLS.date_columns == ("start_date", "end_date")
+    assert list(SCHEMAS) == ["bills"]
+    with pytest.raises(LookupError):
+        get_schema("nope")
+    with pytest.raises(ValueError):
+        register_schema(Schema("bills", [Column("x")]))
+    with pytest.raises(ValueError):
+        Column("x", "float")
+
+def test_schema_header_check_and_converter(readings_schema):
+    LOGGER.info("test_schema_header_check_and_converter()")
+    header = ["note", "read_on", "reading_id", "read_at", "meter_id", "kwh"]
+    # assert check
+    assert readings_schema.check_header(header) == (True, {"missing": [], "extra": []})
+    assert validate_header_exact(["reading_id", "extra"], readings_schema) == (False, {
+        "missing": ["meter_id", "read_on", "kwh", "read_at", "note"], "extra": ["extra"]})
+    assert readings_schema.converter(readings_schema.names) is None  # already in column order
+    assert list(to_canonical(header, [("n", "2024-01-02", "r1", "", "7", "12")], readings_schema)) == [
+        ("r1", "7", "2024-01-02", "12", "", "n")]
+    assert schema_for_header(list(reversed(BILLS.names))) is BILLS
+    assert schema_for_header(header) is None  # not registered
+
+def test_schema_registry_second_layout(registered_readings):
+    LOGGER.info("test_schema_registry_second_layout()")
+    # assert check: found by name and by header; names and tables stay unique
+    assert get_schema("readings") is registered_readings
+    assert registered_readings.table == "readings"
+    assert schema_for_header(["note", "read_on", "reading_id", "read_at", "meter_id", "kwh"]) is registered_readings
+    assert schema_for_header(BILLS.names) is BILLS
+    with pytest.raises(ValueError):
+        register_schema(Schema("readings", [Column("x")]))
+    with pytest.raises(ValueError):
+        register_schema(Schema("other", [Column("x")], table = "custom_csv"))
+
+def test_schema_pickled_copy(readings_schema):
+    LOGGER.info("test_schema_pickled_copy()")
+    # the parse workers get a pickled copy of the schema with every range
+    copy = pickle.loads(pickle.dumps(readings_schema))
+    # assert check: equal, and it reuses the compiled column rules
+    assert copy is not readings_schema and copy == readings_schema and hash(copy) == hash(readings_schema)
+    assert column_rules(copy) is column_rules(readings_schema)
+    assert copy != Schema("readings", [Column("reading_id")])
+
+def test_schema_type_rules(readings_schema):
+    LOGGER.info("test_schema_type_rules()")
+    checker = TypeChecker(schema = readings_schema)
+    rows = [("r1", "7", "2024-01-02", "12", "20240103", "ok"),
+            ("", "x", "2024-13-01", "1.5", "bad", ""),
+            ("r3", "+8", "20240105", "", "", "")]
+    # assert check: one error per bad cell, in row then column order; non-nullable empties fail
+    with pytest.raises(RowValidationError) as e:
+        list(checker.iter_checked(rows))
+    LOGGER.info(e.value.info)
+    assert e.value.info["error_count"] == 5
+    assert [(err["row"], err["field"], err["expected"]) for err in e.value.info["errors"]] == [
+        (2, "reading_id", "string(non-empty)"), (2, "meter_id", "integer"), (2, "read_on", "ISO date"),
+        (2, "kwh", "integer"), (2, "read_at", "ISO date")]
+
+def test_schema_nullable_empty_cells_load_as_null(readings_schema):
+    LOGGER.info("test_schema_nullable_empty_cells_load_as_null()")
+    checker = TypeChecker(schema = readings_schema)
+    rows = [("r1", "7", "2024-01-02", "12", "20240103", "ok"), ("r2", "8", "20240105", "", "", "")]
+    checked = list(checker.iter_checked(rows))
+    # load through the compiled DDL / INSERT
+    conn = sqlite3.connect(":memory:")
+    conn.execute(readings_schema.ddl("readings"))
+    conn.executemany(readings_schema.insert_sql("readings"), checked)
+
+    # assert check: empty nullable cells are NULL, dates canonical
+    assert checked[1] == ("r2", "8", "2024-01-05", None, None, None)
+    assert conn.execute("SELECT * FROM readings").fetchall() == [
+        ("r1", 7, "2024-01-02", 12, "2024-01-03", "ok"), ("r2", 8, "2024-01-05", None, None, None)]
+    assert checker.date_ranges == {"read_on": ["2024-01-02", "2024-01-05"], "read_at": ["2024-01-03", "2024-01-03"]}
+    with pytest.raises(sqlite3.IntegrityError):  # non-nullable columns are NOT NULL
+        conn.execute(readings_schema.insert_sql("readings"), (None, 1, "2024-01-01", None, None, None))
+
+def test_schema_upsert_sql(readings_schema):
+    LOGGER.info("test_schema_upsert_sql()")
+    conn = sqlite3.connect(":memory:")
+    conn.execute(readings_schema.ddl("readings"))
+    conn.execute("CREATE UNIQUE INDEX uq ON readings (reading_id)")
+    upsert = readings_schema.upsert_sql("readings", ("reading_id",))
+    conn.execute(upsert, ("r1", 7, "2024-01-02", 12, None, None))
+    conn.execute(upsert, ("r1", 9, "2024-01-02", 15, None, "fixed"))
+
+    # assert check
+    assert conn.execute("SELECT reading_id, meter_id, kwh, note FROM readings").fetchall() == [("r1", 9, 15, "fixed")]
+    assert "INTEGER NOT NULL" in readings_schema.ddl("t") and "read_on INTEGER" in readings_schema.ddl("t", "epoch_days")